@@ -19,6 +19,19 @@ DEFAULT_CONFIG = {
     'paid': False,
     'export_dir': get_save_path() + '/export',
     'auto_export': True,
+    'render_mode': 'incremental',
+    'render_fps': 10,
+    'pool_maxsize': 10,
+    'connect_timeout': 10,
+    'read_timeout': 360,
+    'http2': False,
+    'cache_max_bytes': 256 * 1024 * 1024,
+    'cache_max_age_days': 90,
+    'reduce_fan_in': 8,
+    'tokenizer': 'auto',
+    'tokenizer_dir': get_save_path() + '/tiktoken',
+    'review_exclude': ['*.lock', 'package-lock.json', 'pnpm-lock.yaml', 'go.sum', '*.min.js', '*.map', '*.snap',
+                       '*_pb2.py', '*.pb.go', '*.generated.*', 'vendor/*', 'node_modules/*', 'dist/*'],
 }
 
 
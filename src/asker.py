@@ -1,11 +1,29 @@
-import time
-import tiktoken
+from __future__ import annotations
 
-from revChatGPT.V1 import Chatbot
+import hashlib
+import re
+
+from bisect import bisect_right
+from itertools import accumulate
+from operator import methodcaller
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable
+from cache import TrunkCache
+from patch_splitter import filter_patches, get_hunk_key, parse_patch
+from retry import RetryExhausted, RetryPolicy
+from syntax_splitter import split_units
+from tokenizer import get_encoding
+
+if TYPE_CHECKING:
+    from revChatGPT.V1 import Chatbot
 
 TRUNK_TOKEN_SIZE = 2800
 TRUNK_STR_SIZE = 11500
 MAX_ASK_RETRY_COUNT = 10
+# Asks are long, a busy server gets more time to recover
+ASK_RETRY = RetryPolicy(max_attempts=MAX_ASK_RETRY_COUNT, max_delay=60, deadline=600)
+# Answers summarized together at most in every round of the reduce
+REDUCE_FAN_IN = 8
 
 
 
@@ -13,80 +31,445 @@ class AskTimeoutException(Exception):
     pass
 
 
-def get_next_trunk_text(encoder: tiktoken.Encoding, tockens: list[int], tocken_index: int) -> tuple[str, int]:
-    chunk_token_size = TRUNK_TOKEN_SIZE
-    chunk_str = ''
-    for _ in range(0, 20):
-        chunk_tockens = tockens[tocken_index : tocken_index + chunk_token_size]
-        chunk_str = encoder.decode(chunk_tockens)
-        if len(chunk_str) > TRUNK_STR_SIZE:
-            chunk_token_size = int(chunk_token_size * 0.9)
-        else:
-            return chunk_str, tocken_index + chunk_token_size
-    raise Exception('Unable to generate the next trunk.')
+# UTF-8 continuation bytes, a trunk must never start with one of them
+CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+
+class Trunk:
+    def __init__(self, text: str, token_count: int, key: str | None = None) -> None:
+        self.text = text
+        self.token_count = token_count
+        # What identifies the trunk in the cache, the text by default
+        self.key = key
+
+
+def is_line_end(piece: bytes) -> bool:
+    return piece.endswith(b'\n') or (b'\n' in piece and piece.isspace())
+
+
+def is_blank_line_end(piece: bytes, prev_piece: bytes) -> bool:
+    if piece.isspace() and piece.count(b'\n') >= 2:
+        return True
+    return piece.endswith(b'\n') and prev_piece.endswith(b'\n')
+
+
+def find_cut(cuts: list[int], low: int, high: int) -> int:
+    # The largest cut in (low, high], or -1
+    i = bisect_right(cuts, high) - 1
+    if i >= 0 and cuts[i] > low:
+        return cuts[i]
+    return -1
+
+
+def split_pieces(pieces: list[bytes], token_size: int = TRUNK_TOKEN_SIZE, str_size: int = TRUNK_STR_SIZE) -> list[Trunk]:
+    """Split token pieces (the bytes of every token) into trunks in one pass.
 
+    Each trunk holds at most token_size tokens and str_size characters, and is cut
+    at a blank line or line end when possible, never inside a UTF-8 sequence.
+    """
+    count = len(pieces)
+    data = b''.join(pieces)
+    byte_offsets = list(accumulate(map(len, pieces), initial=0))
+    if data.isascii():
+        char_offsets = byte_offsets
+    else:
+        char_counts = map(len, map(methodcaller('translate', None, CONTINUATION_BYTES), pieces))
+        char_offsets = list(accumulate(char_counts, initial=0))
+
+    # Only look at the pieces that contain a line feed
+    line_cuts = []
+    for match in re.finditer(b'\n', data):
+        index = bisect_right(byte_offsets, match.start()) - 1
+        if (not line_cuts or line_cuts[-1] != index + 1) and is_line_end(pieces[index]):
+            line_cuts.append(index + 1)
+    blank_cuts = [i for i in line_cuts if is_blank_line_end(pieces[i - 1], pieces[i - 2] if i > 1 else b'')]
+
+    def is_safe_cut(index: int) -> bool:
+        return index >= count or not pieces[index] or pieces[index][0] not in CONTINUATION_BYTES
 
-def split_code(gpt_mode: str, code: str) -> tuple[list[str], int]:
-    encoder = tiktoken.encoding_for_model(gpt_mode)
-    tockens = encoder.encode(code)
     result = []
-    tocken_index = 0
-    while True:
-        chunk_str, next_tocken_index = get_next_trunk_text(encoder, tockens, tocken_index)
-        result.append(chunk_str)
-        # print(f'Chunk str length: {len(chunk_str)} token_count: {next_tocken_index - tocken_index}')
-        if next_tocken_index >= len(tockens):
-            break
-        tocken_index = next_tocken_index
-    
-    return result, len(tockens)
+    start = 0
+    while start < count:
+        end = min(count, start + token_size, bisect_right(char_offsets, char_offsets[start] + str_size) - 1)
+        end = max(end, start + 1)
+        if end < count:
+            # Do not accept a boundary that leaves the trunk less than half full
+            low = start + (end - start) // 2
+            cut = find_cut(blank_cuts, low, end)
+            if cut < 0:
+                cut = find_cut(line_cuts, low, end)
+            if cut < 0:
+                cut = end
+                while cut > start and not is_safe_cut(cut):
+                    cut -= 1
+                if cut == start:
+                    # A single character spans the whole window, exceed the budget a little
+                    cut = end
+                    while not is_safe_cut(cut):
+                        cut += 1
+            end = cut
+
+        text = data[byte_offsets[start] : byte_offsets[end]].decode('utf-8', errors='replace')
+        result.append(Trunk(text, end - start))
+        start = end
+
+    return result
+
+
+class ModelBudget:
+    def __init__(self, encoding: str, token_size: int, str_size: int) -> None:
+        # The tiktoken encoding that counts the tokens
+        self.encoding = encoding
+        self.token_size = token_size
+        self.str_size = str_size
+
+
+# Trunk budgets of the models, a larger context gets larger trunks and so fewer requests.
+# The models of the web ui are tokenized like the api models they are based on.
+MODEL_BUDGETS = {
+    'text-davinci-002-render-sha': ModelBudget('cl100k_base', TRUNK_TOKEN_SIZE, TRUNK_STR_SIZE),
+    'gpt-3.5-turbo': ModelBudget('cl100k_base', TRUNK_TOKEN_SIZE, TRUNK_STR_SIZE),
+    'gpt-4': ModelBudget('cl100k_base', 5600, 23000),
+}
+DEFAULT_BUDGET = MODEL_BUDGETS['gpt-3.5-turbo']
+
+
+def get_budget(model: str) -> ModelBudget:
+    return MODEL_BUDGETS.get(model, DEFAULT_BUDGET)
+
+
+def get_encoder(model: str):
+    # Exact or estimated depending on the tokenizer config, see tokenizer.configure
+    return get_encoding(get_budget(model).encoding)
+
+
+def encode_all(encoder, texts: list[str]) -> list[list[int]]:
+    # encode_batch tokenizes in a thread pool, only worth it for several texts
+    if len(texts) > 1:
+        return encoder.encode_batch(texts)
+    return [encoder.encode(text) for text in texts]
+
+
+def pack_units(units: list[str], token_counts: list[int], split_unit: Callable[[int], list[Trunk]],
+               token_size: int = TRUNK_TOKEN_SIZE, str_size: int = TRUNK_STR_SIZE) -> list[Trunk]:
+    """Pack whole units into trunks, only units too large on their own are split."""
+    result = []
+    texts = []
+    trunk_token_count = 0
+    trunk_str_size = 0
+
+    def flush():
+        nonlocal texts, trunk_token_count, trunk_str_size
+        if texts:
+            result.append(Trunk(''.join(texts), trunk_token_count))
+        texts, trunk_token_count, trunk_str_size = [], 0, 0
+
+    for i, unit in enumerate(units):
+        if token_counts[i] > token_size or len(unit) > str_size:
+            flush()
+            result.extend(split_unit(i))
+            continue
+
+        if trunk_token_count + token_counts[i] > token_size or trunk_str_size + len(unit) > str_size:
+            flush()
+        texts.append(unit)
+        trunk_token_count += token_counts[i]
+        trunk_str_size += len(unit)
+
+    flush()
+    return result
+
+
+def split_files(model: str, codes: list[str], paths: list[str] | None = None) -> list[tuple[list[Trunk], int]]:
+    """Split many codes at once, returns the trunks and token count of each one.
+
+    All codes, or all their units with paths to split along the syntax, are
+    tokenized in one batch.
+    """
+    budget = get_budget(model)
+    encoder = get_encoder(model)
+    if paths is None:
+        return [(split_pieces(encoder.decode_tokens_bytes(tockens), budget.token_size, budget.str_size), len(tockens))
+                for tockens in encode_all(encoder, codes)]
+
+    units = [split_units(code, path) for code, path in zip(codes, paths)]
+    all_unit_tockens = encode_all(encoder, [unit for file_units in units for unit in file_units])
+    result = []
+    offset = 0
+    for file_units in units:
+        unit_tockens = all_unit_tockens[offset:offset + len(file_units)]
+        offset += len(file_units)
+
+        def split_unit(i: int) -> list[Trunk]:
+            return split_pieces(encoder.decode_tokens_bytes(unit_tockens[i]), budget.token_size, budget.str_size)
+
+        trunks = pack_units(file_units, [len(t) for t in unit_tockens], split_unit, budget.token_size, budget.str_size)
+        result.append((trunks, sum(len(t) for t in unit_tockens)))
+    return result
+
+
+def split_code(model: str, code: str) -> tuple[list[Trunk], int]:
+    return split_files(model, [code])[0]
+
+
+def split_code_by_syntax(model: str, code: str, path: str) -> tuple[list[Trunk], int]:
+    return split_files(model, [code], [path])[0]
+
 
-def ask_trunk_impl(bot: Chatbot, prompt_prefix: str, trunk: str, log_prefix = '') -> str:
-    print(f'{log_prefix}Ask: {prompt_prefix} Text len: {len(trunk)}\n')
+def split_patch(model: str, patch: str, excludes: list[str]) -> tuple[list[Trunk], int]:
+    """Split a patch along its files and hunks, a trunk never holds hunks of different files.
+
+    Every trunk starts with the header of its file, and is keyed by its hunks without
+    their line numbers, so its cached review survives changes in other hunks.
+    """
+    budget = get_budget(model)
+    encoder = get_encoder(model)
+    file_patches = filter_patches(parse_patch(patch), excludes)
+    all_tockens = encode_all(encoder, [text for p in file_patches for text in [p.header] + p.hunks])
+    result = []
+    token_count = 0
+    offset = 0
+    for file_patch in file_patches:
+        header_token_count = len(all_tockens[offset])
+        hunk_tockens = all_tockens[offset + 1:offset + 1 + len(file_patch.hunks)]
+        offset += 1 + len(file_patch.hunks)
+        token_count += header_token_count + sum(len(t) for t in hunk_tockens)
+        token_size = budget.token_size - header_token_count
+        str_size = budget.str_size - len(file_patch.header)
+
+        def split_hunk(i: int) -> list[Trunk]:
+            return split_pieces(encoder.decode_tokens_bytes(hunk_tockens[i]), token_size, str_size)
+
+        trunks = pack_units(file_patch.hunks or [''], [len(t) for t in hunk_tockens] or [0], split_hunk,
+                            token_size, str_size)
+        for trunk in trunks:
+            result.append(Trunk(file_patch.header + trunk.text, header_token_count + trunk.token_count,
+                                file_patch.path + '\0' + get_hunk_key(trunk.text)))
+    return result, token_count
+
+def ask_trunk_impl(bot: Chatbot, prompt_prefix: str, trunk: str, log_prefix = '', stream = True) -> str:
+    if stream:
+        print(f'{log_prefix}Ask: {prompt_prefix} Text len: {len(trunk)}\n')
     prev_text = ''
     for data in bot.ask(prompt_prefix + trunk):
-        message = data['message'][len(prev_text) :]
-        print(message, end='', flush=True)
+        if stream:
+            print(data['delta'], end='', flush=True)
         prev_text = data['message']
     
-    print('\n-----------------------------------------------------------------')
+    if stream:
+        print('\n-----------------------------------------------------------------')
+    else:
+        # Parallel asks would interleave their streams, so print the whole answer at once
+        print(f'{log_prefix}Ask: {prompt_prefix} Text len: {len(trunk)}\n\n{prev_text}'
+              '\n-----------------------------------------------------------------', flush=True)
     return prev_text
 
-def ask(bot: Chatbot, prompt_prefix: str, code: str, log_prefix = '') -> str:
-    for i in range(0, MAX_ASK_RETRY_COUNT):
-        try:
-            return ask_trunk_impl(bot, prompt_prefix, code, log_prefix)
-        except Exception as e:
-            print(f'Error:{e}')
-            print(f'\n[{i+1}/{MAX_ASK_RETRY_COUNT}]Retry in 3 seconds.')
-            time.sleep(3)
-    raise AskTimeoutException(f'The number of retries has exceeded the limit {MAX_ASK_RETRY_COUNT}')
+def ask(bot: Chatbot, prompt_prefix: str, code: str, log_prefix = '', stream = True) -> str:
+    try:
+        return ASK_RETRY.call(lambda: ask_trunk_impl(bot, prompt_prefix, code, log_prefix, stream), 'ask')
+    except RetryExhausted as e:
+        raise AskTimeoutException(str(e)) from e
 
 class Prompt:
-    def __init__(self, trunk_first, trunk_next, sumarize_multi, sumarize_single) -> None:
+    def __init__(self, trunk_first, trunk_next, sumarize_multi, sumarize_single, sumarize_partial = None) -> None:
         self.trunk_first = trunk_first
         self.trunk_next = trunk_next
         self.sumarize_multi = sumarize_multi
         self.sumarize_single = sumarize_single
+        # Summarizes a part of the answers when they do not fit in one ask, sumarize_multi by default
+        self.sumarize_partial = sumarize_partial or sumarize_multi
+
+    @property
+    def version(self) -> str:
+        prompts = [self.trunk_first, self.trunk_next, self.sumarize_multi, self.sumarize_single]
+        if self.sumarize_partial != self.sumarize_multi:
+            prompts.append(self.sumarize_partial)
+        content = '\0'.join(prompts)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
+def delete_conversation(bot: Chatbot) -> None:
+    if not bot.conversation_id:
+        return
+
+    try:
+        ASK_RETRY.call(lambda: bot.delete_conversation(bot.conversation_id), 'delete_conversation')
+    except RetryExhausted as e:
+        print(f'Failed to delete session: {e}')
+
+
+def create_chatbot(config: dict, session = None, jobs: int = 1) -> Chatbot:
+    # Chatbots created with the same session share its connection pool, which
+    # keeps a connection for every job.
+    if session is None and jobs > config.get('pool_maxsize', 0):
+        config = {**config, 'pool_maxsize': jobs}
+    from revChatGPT.V1 import Chatbot
+
+    return Chatbot(config, session=session)
+
+
+def ask_in_new_conversation(config: dict, prompt_prefix: str, trunk: str, log_prefix = '', session = None) -> str:
+    bot = create_chatbot(config, session)
+    try:
+        return ask(bot, prompt_prefix, trunk, log_prefix, stream=False)
+    finally:
+        delete_conversation(bot)
+
+
+def get_trunk_key(config: dict, prompt_prefix: str, trunk: Trunk) -> str:
+    text = trunk.key if trunk.key is not None else trunk.text
+    return TrunkCache.get_key(prompt_prefix, config.get('model') or '', config.get('language') or '', text)
+
+
+def ask_trunks(bot: Chatbot, trunks: list[Trunk], prompt: Prompt, jobs: int, cache: TrunkCache | None = None,
+               stream: bool = True) -> list[str]:
+    # In parallel every trunk is asked in a new conversation, where a follow-up prompt
+    # would refer to trunks the model never saw, so each one gets the standalone prompt
+    prompts = [prompt.trunk_first if i == 0 or jobs > 1 else prompt.trunk_next for i in range(len(trunks))]
+    keys = [get_trunk_key(bot.config, prompts[i], trunk) for i, trunk in enumerate(trunks)]
+    result = [cache.read(key) if cache else None for key in keys]
+    misses = [i for i, r in enumerate(result) if r is None]
+    if cache:
+        print(f'Cached trunks: {len(trunks) - len(misses)}/{len(trunks)}')
+
+    def ask_trunk(i: int) -> str:
+        log_prefix = f'[{i+1}/{len(trunks)}] '
+        if jobs <= 1:
+            response = ask(bot, prompts[i], trunks[i].text, log_prefix, stream)
+        else:
+            response = ask_in_new_conversation(bot.config, prompts[i], trunks[i].text, log_prefix, bot.session)
+        if cache:
+            cache.write(keys[i], response)
+        return response
+
+    if jobs <= 1:
+        for i in misses:
+            result[i] = ask_trunk(i)
+        return result # type: ignore
+
+    # Every trunk is sent in its own conversation, so they can not share context
+    # and must not share the (stateful) bot either.
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [(i, executor.submit(ask_trunk, i)) for i in misses]
+        for i, future in futures:
+            result[i] = future.result()
+    return result # type: ignore
+
+
+def group_answers(texts: list[str], token_counts: list[int], token_size: int = TRUNK_TOKEN_SIZE,
+                  str_size: int = TRUNK_STR_SIZE, fan_in: int = REDUCE_FAN_IN) -> list[list[str]]:
+    """Group consecutive answers so that every group fits in one ask.
 
-def ask_for_content(bot: Chatbot, content: str, prompt: Prompt) -> list[str]:
-    trunks, token_count = split_code('gpt-3.5-turbo', content)
-    print(f'Code length: {len(content)} token_count: {token_count} trunks: {len(trunks)}')
+    A group holds at most fan_in answers, and at least two of them even when they
+    exceed the budget, so every round of the reduce has fewer answers.
+    """
+    fan_in = max(2, fan_in)
+    result = []
+    group = []
+    group_token_count = 0
+    group_str_size = 0
+    for text, token_count in zip(texts, token_counts):
+        if len(group) >= 2 and (len(group) >= fan_in or group_token_count + token_count > token_size
+                                or group_str_size + len(text) > str_size):
+            result.append(group)
+            group, group_token_count, group_str_size = [], 0, 0
+        group.append(text)
+        group_token_count += token_count
+        group_str_size += len(text)
+
+    if len(group) == 1 and result:
+        result[-1].append(group[0])
+    elif group:
+        result.append(group)
+    return result
+
+
+def reduce_answers(bot: Chatbot, texts: list[str], prompt: Prompt, jobs: int, cache: TrunkCache | None = None,
+                   stream: bool = True) -> str:
+    """Summarize the answers of all trunks into one.
+
+    Answers too large to be summarized at once are summarized by groups, in parallel
+    with jobs, and the summaries of the groups are reduced again.
+    """
+    model = bot.config.get('model') or ''
+    budget = get_budget(model)
+    encoder = get_encoder(model)
+    fan_in = bot.config.get('reduce_fan_in', REDUCE_FAN_IN)
+    # Room for the prompt, which is sent with every group
+    token_size = budget.token_size - len(encoder.encode(prompt.sumarize_partial))
+    str_size = budget.str_size - len(prompt.sumarize_partial)
+
+    def group(texts: list[str]) -> list[list[str]]:
+        token_counts = [len(tokens) for tokens in encode_all(encoder, texts)]
+        return group_answers(texts, token_counts, token_size, str_size, fan_in)
+
+    groups = group(texts)
+    level = 0
+    while len(groups) > 1:
+        level += 1
+        print(f'Reduce round {level}: {len(texts)} answers in {len(groups)} groups')
+
+        def summarize(i: int) -> str:
+            trunk = Trunk('\n'.join(groups[i]), 0)
+            key = get_trunk_key(bot.config, prompt.sumarize_partial, trunk)
+            response = cache.read(key) if cache else None
+            if response is None:
+                log_prefix = f'[{level}:{i+1}/{len(groups)}] '
+                if jobs <= 1:
+                    response = ask(bot, prompt.sumarize_partial, trunk.text, log_prefix, stream)
+                else:
+                    response = ask_in_new_conversation(bot.config, prompt.sumarize_partial, trunk.text, log_prefix,
+                                                       bot.session)
+                if cache:
+                    cache.write(key, response)
+            return response
+
+        if jobs <= 1:
+            texts = [summarize(i) for i in range(len(groups))]
+        else:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                texts = list(executor.map(summarize, range(len(groups))))
+        groups = group(texts)
+
+    return ask(bot, prompt.sumarize_multi, '\n'.join(texts), stream=stream)
+
+
+def ask_for_content(bot: Chatbot, content: str, prompt: Prompt, jobs: int = 1, syntax_path: str | None = None,
+                    cache: TrunkCache | None = None, stream: bool = True) -> list[str]:
+    """Split the content into trunks and ask for them, see ask_for_trunks.
+
+    With syntax_path, trunks are split along the top level declarations of the code.
+    """
+    model = bot.config.get('model') or ''
+    if syntax_path:
+        trunks, token_count = split_code_by_syntax(model, content, syntax_path)
+    else:
+        trunks, token_count = split_code(model, content)
+    print(f'Code length: {len(content)} token_count: {token_count} trunks: {len(trunks)} jobs: {jobs}')
+    return ask_for_trunks(bot, trunks or [Trunk(content, 0)], prompt, jobs, cache, stream)
+
+
+def ask_for_trunks(bot: Chatbot, trunks: list[Trunk], prompt: Prompt, jobs: int = 1, cache: TrunkCache | None = None,
+                   stream: bool = True) -> list[str]:
+    """Ask for every trunk, then for the summary of all answers, see reduce_answers.
+
+    With cache, only the trunks whose answers are not cached are sent.
+    Without stream, answers are printed once they are complete.
+    """
+    print(f'Trunk token counts: {", ".join(str(trunk.token_count) for trunk in trunks)}')
     result = []
     if len(trunks) > 1:
-        texts = []
-        i = 0
-        for trunk in trunks:
-            i += 1
-            prompt0 = prompt.trunk_first if i == 1 else prompt.trunk_next
-            trunk_response = ask(bot, prompt0, trunk, f'[{i}/{len(trunks)}] ')
-            texts.append(trunk_response)
-            result.append( trunk_response)
-
-        final_response = ask(bot, prompt.sumarize_multi, '\n'.join(texts))
-        result.append(final_response)
+        texts = ask_trunks(bot, trunks, prompt, jobs, cache, stream)
+        result.extend(texts)
+
+        result.append(reduce_answers(bot, texts, prompt, jobs, cache, stream))
     else:
-        result.append(ask(bot, prompt.sumarize_single, content))
+        key = get_trunk_key(bot.config, prompt.sumarize_single, trunks[0])
+        response = cache.read(key) if cache else None
+        if response is None:
+            response = ask(bot, prompt.sumarize_single, trunks[0].text, stream=stream)
+            if cache:
+                cache.write(key, response)
+        result.append(response)
     
     return result
 
@@ -104,22 +487,27 @@ def format_result(result: list[str]) -> str:
     return '\n'.join(formated_result)
 
 
-def do_ask_for_large_file_cmd(path: str, prompt: Prompt, config: dict) -> str:
+def do_ask_for_content_cmd(content: str, prompt: Prompt, config: dict, jobs: int = 1, syntax_path: str | None = None,
+                           cache: TrunkCache | None = None, session = None, stream: bool = True) -> str:
+    bot = create_chatbot(config, session, jobs)
+    result = ask_for_content(bot, content, prompt, jobs, syntax_path, cache, stream)
+    delete_conversation(bot)
+    return format_result(result)
+
+
+def do_ask_for_trunks_cmd(trunks: list[Trunk], prompt: Prompt, config: dict, jobs: int = 1,
+                          cache: TrunkCache | None = None, session = None, stream: bool = True) -> str:
+    bot = create_chatbot(config, session, jobs)
+    result = ask_for_trunks(bot, trunks, prompt, jobs, cache, stream)
+    delete_conversation(bot)
+    return format_result(result)
+
+
+def do_ask_for_large_file_cmd(path: str, prompt: Prompt, config: dict, jobs: int = 1, split_by_syntax: bool = False,
+                              cache: TrunkCache | None = None, session = None, stream: bool = True) -> str:
     with open(path, 'r') as f:
         code = f.read()
-        bot = Chatbot(config)
-        result = ask_for_content(bot, code, prompt)
-
-        for i in range(0, MAX_ASK_RETRY_COUNT):
-            try:
-                bot.delete_conversation(bot.conversation_id) # type: ignore
-                break
-            except Exception as e:
-                print(f'Error:{e}')
-                print(f'\n[{i+1}/{MAX_ASK_RETRY_COUNT}]Failed to delete session, retrying in 3 seconds.')
-                time.sleep(3)
-
-        return format_result(result)
+        return do_ask_for_content_cmd(code, prompt, config, jobs, path if split_by_syntax else None, cache, session, stream)
 
 
 def test_split_code():
@@ -1,33 +1,279 @@
+import argparse
+import atexit
+import glob
+import hashlib
+import math
 import os
+import threading
+import time
 
-from app import get_save_path
+from abc import ABCMeta, abstractmethod
 
+from app import get_save_path, load_config
+from common import atomic_write
+from json_config import JsonConfig
 
-class Cache:
-    def __init__(self, name: str) -> None:
+PROG_NAME = 'cache'
+DESC = 'Show statistics of the cache in ~/.chatgpt_tool/cache, or prune it'
+
+# Last used time of an entry is only saved when it is older than this, so reads rarely write the index
+USED_RESOLUTION = 3600
+DAY_SECONDS = 24 * 3600
+# Seconds between two saves of the index while writing, it is rewritten as a whole
+SAVE_INTERVAL = 5
+# Share of max_bytes kept when evicting on write
+EVICT_RATIO = 0.9
+
+
+def hash_file(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class IndexedCache(metaclass=ABCMeta):
+    """A cache whose entries are tracked in an index file.
+
+    Every entry records its size in bytes and its last used time, so the total
+    size and the least recently used entries are known without a stat of the
+    cache directory. Entries are evicted on write once max_bytes or max_age_days
+    (0 means no limit) is exceeded. The index is saved at most every SAVE_INTERVAL
+    seconds while writing, and at exit, merged with the entries other processes
+    saved meanwhile. Entry files missing from the index, left by a run killed
+    before saving it, are reconciled by prune and stats.
+    """
+
+    def __init__(self, index_path: str, max_bytes: int = 0, max_age_days: float = 0) -> None:
+        self.index = JsonConfig(index_path)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        # Reentrant, so prune can reconcile and evict under the same lock
+        self.lock = threading.RLock()
+        self.total_bytes = sum(entry.get('bytes', 0) for _, entry in self.index.items())
+        # Never later than the last used time of the oldest entry, the index is only
+        # scanned for expired entries once this is past the cutoff
+        self.oldest_used = min((entry.get('used', 0) for _, entry in self.index.items()), default=math.inf)
+        # Keys removed since the last save, so merging the saved index does not restore them
+        self.removed: set[str] = set()
+        self.last_save = time.monotonic()
+        atexit.register(self.flush)
+
+    @abstractmethod
+    def get_entry_path(self, key: str) -> str:
+        pass
+
+    @abstractmethod
+    def list_entry_files(self) -> list[str]:
+        pass
+
+    def get_entry_key(self, path: str) -> str | None:
+        # Key of an entry file, None when it can not be recovered from the path
+        return None
+
+    def save_index(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.last_save < SAVE_INTERVAL:
+            return
+        if self.index.is_dirty:
+            self.merge_saved_index()
+            self.index.save()
+        self.last_save = now
+
+    def merge_saved_index(self) -> None:
+        """Merge the index saved by other processes since it was loaded.
+
+        The entry used last wins when both have one, an entry missing from the saved
+        index is dropped when another process removed its file.
+        """
+        saved = self.index.read_saved()
+        for key, entry in saved.items():
+            current = self.index[key]
+            if key in self.removed or (current and current.get('used', 0) >= entry.get('used', 0)):
+                continue
+            self.set_entry(key, entry)
+        for key, entry in self.index.items():
+            if key not in saved and not os.path.exists(self.get_entry_path(key)):
+                self.remove_entry(key)
+        self.removed.clear()
+
+    def set_entry(self, key: str, entry: dict) -> None:
+        old_entry = self.index[key]
+        if old_entry:
+            self.total_bytes -= old_entry.get('bytes', 0)
+        self.index[key] = entry
+        self.total_bytes += entry.get('bytes', 0)
+        self.oldest_used = min(self.oldest_used, entry.get('used', 0))
+        self.removed.discard(key)
+
+    def remove_entry(self, key: str) -> int:
+        entry = self.index[key] or {}
+        self.index.delete(key)
+        self.total_bytes -= entry.get('bytes', 0)
+        self.removed.add(key)
+        return entry.get('bytes', 0)
+
+    def flush(self) -> None:
+        with self.lock:
+            self.save_index(force=True)
+
+    def touch(self, key: str) -> None:
+        with self.lock:
+            entry = self.index[key]
+            now = time.time()
+            if entry and now - entry.get('used', 0) > USED_RESOLUTION:
+                self.index[key] = {**entry, 'used': now}
+                self.save_index()
+
+    def record(self, key: str, entry: dict) -> None:
+        size = os.path.getsize(self.get_entry_path(key))
+        with self.lock:
+            self.set_entry(key, {**entry, 'bytes': size, 'used': time.time()})
+            # Evict a bit more than needed, so the following writes do not evict again
+            self.evict(self.max_bytes, self.max_age_days, int(self.max_bytes * EVICT_RATIO))
+            self.save_index()
+
+    def evict(self, max_bytes: int, max_age_days: float, target_bytes: int | None = None) -> tuple[int, int]:
+        """Remove the least recently used entries, returns the count and bytes removed.
+
+        Once over max_bytes, entries are removed down to target_bytes, max_bytes by default.
+        """
+        now = time.time()
+        cutoff = now - max_age_days * DAY_SECONDS
+        over_size = max_bytes and self.total_bytes > max_bytes
+        over_age = max_age_days and self.oldest_used < cutoff
+        if not over_size and not over_age:
+            return 0, 0
+
+        target_bytes = max_bytes if target_bytes is None else target_bytes
+        count = 0
+        removed_bytes = 0
+        self.oldest_used = math.inf
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1].get('used', 0)):
+            expired = max_age_days and entry.get('used', 0) < cutoff
+            if not expired and not (over_size and self.total_bytes > target_bytes):
+                self.oldest_used = entry.get('used', 0)
+                break
+
+            try:
+                os.remove(self.get_entry_path(key))
+            except FileNotFoundError:
+                pass
+            removed_bytes += self.remove_entry(key)
+            count += 1
+        return count, removed_bytes
+
+    def reconcile(self) -> int:
+        """Make the index match the entry files, returns the count of entries fixed.
+
+        Untracked files are indexed when their key is known and removed otherwise,
+        entries whose file is gone are dropped.
+        """
+        with self.lock:
+            # Entries saved by other processes are not untracked
+            self.merge_saved_index()
+            tracked = {os.path.normpath(self.get_entry_path(key)): key for key, _ in self.index.items()}
+            count = 0
+            for path in self.list_entry_files():
+                path = os.path.normpath(path)
+                if tracked.pop(path, None) is not None:
+                    continue
+
+                key = self.get_entry_key(path)
+                if key is None:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    stat = os.stat(path)
+                    self.set_entry(key, {'created': stat.st_mtime, 'bytes': stat.st_size, 'used': stat.st_mtime})
+                count += 1
+            for key in tracked.values():
+                self.remove_entry(key)
+                count += 1
+            self.save_index(force=True)
+            return count
+
+    def prune(self, max_bytes: int, max_age_days: float) -> tuple[int, int]:
+        with self.lock:
+            self.reconcile()
+            result = self.evict(max_bytes, max_age_days)
+            self.save_index(force=True)
+            return result
+
+    def __len__(self) -> int:
+        return len(self.index.config)
+
+
+class Cache(IndexedCache):
+    """Results of whole files, with an index of the metadata that produced them.
+
+    The index (cache/<name>/index.json) is read once, so checking whether the
+    entries of many files are fresh does not open any cached result.
+    """
+
+    def __init__(self, name: str, max_bytes: int = 0, max_age_days: float = 0) -> None:
+        super().__init__(os.path.join('cache', name, 'index.json'), max_bytes, max_age_days)
         self.name = name
         self.content = ''
 
-    def read(self, path: str) -> str | None:
-        cache_path = self.get_cache_path(path)
-        if not os.path.exists(cache_path):
-            return None
-        
+    def is_fresh(self, path: str, meta: dict) -> bool:
         if not os.path.exists(path):
+            return False
+
+        entry = self.index[self.get_key(path)]
+        if not entry:
+            return False
+
+        for key, value in meta.items():
+            if entry.get(key) != value:
+                return False
+
+        # Only hash the file when it looks changed, a checkout that restores the
+        # same content keeps the entry valid.
+        stat = os.stat(path)
+        if entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+            return True
+
+        if entry.get('hash') != hash_file(path):
+            return False
+        with self.lock:
+            self.index[self.get_key(path)] = {**entry, 'mtime': stat.st_mtime, 'size': stat.st_size}
+            self.save_index()
+        return True
+
+    def read(self, path: str, meta: dict) -> str | None:
+        if not self.is_fresh(path, meta):
             return None
 
-        if os.path.getmtime(path) > os.path.getmtime(cache_path):
+        cache_path = self.get_cache_path(path)
+        if not os.path.exists(cache_path):
             return None
 
+        self.touch(self.get_key(path))
         with open(cache_path, 'r') as f:
             return f.read()
 
-    def write(self, path: str, content: str) -> None:
-        cache_path = self.get_cache_path(path)
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    def write(self, path: str, content: str, meta: dict) -> None:
+        atomic_write(self.get_cache_path(path), content)
+
+        stat = os.stat(path)
+        self.record(self.get_key(path), {
+            **meta,
+            'hash': hash_file(path),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'created': time.time(),
+        })
+
+    def get_key(self, path: str) -> str:
+        return os.path.normpath(os.path.abspath(path))
 
-        with open(cache_path, 'w') as f:
-            f.write(content)
+    def get_entry_path(self, key: str) -> str:
+        return self.get_cache_path(key)
+
+    def list_entry_files(self) -> list[str]:
+        # The path of a file can not be recovered from the name of its entry
+        return glob.glob(os.path.join(get_save_path(), 'cache', glob.escape(self.name), '*.md'))
 
     def get_cache_path(self, path: str) -> str:
         if not os.path.isabs(path):
@@ -35,10 +281,125 @@ class Cache:
         formated_path = path.replace('/', '_').replace('\\', '_').replace(':', '_')
         return os.path.normpath(os.path.join(get_save_path(), 'cache', self.name, f'{formated_path}.md'))
 
+
+class TrunkCache(IndexedCache):
+    """Responses of single trunks, addressed by the hash of everything that produced them."""
+
+    def __init__(self, name: str, max_bytes: int = 0, max_age_days: float = 0) -> None:
+        super().__init__(os.path.join('cache', name, 'trunks', 'index.json'), max_bytes, max_age_days)
+        self.name = name
+
+    @staticmethod
+    def get_key(prompt_prefix: str, model: str, language: str, text: str) -> str:
+        content = '\0'.join([prompt_prefix, model, language, text])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def read(self, key: str) -> str | None:
+        cache_path = self.get_cache_path(key)
+        if not os.path.exists(cache_path):
+            return None
+
+        self.touch(key)
+        with open(cache_path, 'r', encoding='utf8') as f:
+            return f.read()
+
+    def write(self, key: str, content: str) -> None:
+        # Concurrent readers never see a partial response
+        atomic_write(self.get_cache_path(key), content)
+        self.record(key, {'created': time.time()})
+
+    def get_entry_path(self, key: str) -> str:
+        return self.get_cache_path(key)
+
+    def list_entry_files(self) -> list[str]:
+        return glob.glob(os.path.join(get_save_path(), 'cache', glob.escape(self.name), 'trunks', '*', '*.md'))
+
+    def get_entry_key(self, path: str) -> str | None:
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def get_cache_path(self, key: str) -> str:
+        return os.path.normpath(os.path.join(get_save_path(), 'cache', self.name, 'trunks', key[:2], f'{key}.md'))
+
+
+def create_cache(config: dict, name: str) -> Cache:
+    return Cache(name, config['cache_max_bytes'], config['cache_max_age_days'])
+
+
+def create_trunk_cache(config: dict, name: str) -> TrunkCache:
+    return TrunkCache(name, config['cache_max_bytes'], config['cache_max_age_days'])
+
+
+def get_all_caches() -> list[IndexedCache]:
+    root = os.path.join(get_save_path(), 'cache')
+    result = []
+    for path in sorted(glob.glob(os.path.join(root, '*', 'index.json'))):
+        result.append(Cache(os.path.basename(os.path.dirname(path))))
+    for path in sorted(glob.glob(os.path.join(root, '*', 'trunks', 'index.json'))):
+        result.append(TrunkCache(os.path.basename(os.path.dirname(os.path.dirname(path)))))
+    return result
+
+
+def format_size(size: int) -> str:
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f'{size:.1f}{unit}' if unit != 'B' else f'{size}{unit}'
+        size /= 1024 # type: ignore
+    return f'{size:.1f}GB'
+
+
+def show_stats() -> None:
+    caches = get_all_caches()
+    if not caches:
+        print('Cache is empty')
+        return
+
+    for cache in caches:
+        count = cache.reconcile()
+        if count > 0:
+            print(f'{cache.name}: reconciled {count} entries missing from the index')
+    for cache in caches:
+        kind = 'trunks' if isinstance(cache, TrunkCache) else 'files'
+        print(f'{cache.name:<20}{kind:<8}{len(cache):>8} entries {format_size(cache.total_bytes):>10}')
+    print(f'{"total":<28}{sum(len(c) for c in caches):>8} entries {format_size(sum(c.total_bytes for c in caches)):>10}')
+
+
+def prune(max_bytes: int, max_age_days: float) -> None:
+    for cache in get_all_caches():
+        count, removed_bytes = cache.prune(max_bytes, max_age_days)
+        if count > 0:
+            print(f'{cache.name}: removed {count} entries, {format_size(removed_bytes)}')
+    show_stats()
+
+
+def create_args_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog=PROG_NAME, description=DESC)
+    parser.add_argument('command', nargs='?', choices=['stats', 'prune'], default='stats', help='command to run, default stats')
+    parser.add_argument('--max-bytes', type=int, help='bytes kept in every cache when pruning, default cache_max_bytes of the config')
+    parser.add_argument('--max-age-days', type=float, help='days an unused entry is kept when pruning, default cache_max_age_days of the config')
+    parser.add_argument('-t', '--test', action='store_true', help='whether it is in test mode')
+    parser.add_argument('-cfg', '--config', help='path of the config file')
+    return parser
+
+
 def test_get_cache_path():
     cache = Cache('code_explainer')
     print(cache.get_cache_path('revChatGPT/typings.py'))
     print(cache.get_cache_path('f:\\revChatGPT\\typings.py'))
 
 if __name__ == '__main__':
-    test_get_cache_path()
\ No newline at end of file
+    parser = create_args_parser()
+    args = parser.parse_args()
+
+    if args.test:
+        test_get_cache_path()
+        exit(0)
+
+    if args.command == 'prune':
+        max_bytes, max_age_days = args.max_bytes, args.max_age_days
+        if max_bytes is None or max_age_days is None:
+            config = load_config(args.config)
+            max_bytes = config['cache_max_bytes'] if max_bytes is None else max_bytes
+            max_age_days = config['cache_max_age_days'] if max_age_days is None else max_age_days
+        prune(max_bytes, max_age_days)
+    else:
+        show_stats()
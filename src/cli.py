@@ -1,21 +1,26 @@
 import argparse
+import asyncio
 import os
-
-from rich.live import Live
-from rich.markdown import Markdown
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
 from cli_help import SHORTCUTS_HELP
 from conversation_exporter import ConversationExporter
 
-from revChatGPT.V1 import Chatbot
-from revChatGPT.utils import create_session, create_completer, get_input
 from revChatGPT.typings import CLIError, C
 
 from app import load_config
 from commands import Commands
-from common import GPT_MODELS, print_md, try_chatbot
+from common import GPT_MODELS, iter_messages, print_md, try_chatbot
 from conversation_cache import ConversationCache
+from conversation_store import ConversationStore
 from json_config import JsonConfig
+from stream_renderer import StreamRenderer
+
+if TYPE_CHECKING:
+    from revChatGPT.V1 import AsyncChatbot
 
 
 WELCOME_MESSAGE = f'''
@@ -27,7 +32,9 @@ WELCOME_MESSAGE = f'''
 
 
 class ChatbotCli:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, use_async: bool = False):
+        from revChatGPT.V1 import AsyncChatbot, Chatbot
+
         self.__config = config.copy()
         self.__save = JsonConfig('save.json')
         self.__commands = Commands()
@@ -36,8 +43,15 @@ class ChatbotCli:
             conversation_id=self.__config.get('conversation_id'),
             parent_id=self.__config.get('parent_id'),
         )
-        self.__exporter = ConversationExporter(self.__config['export_dir'], self.__chatbot)
+        # In async mode, answers are streamed by the async chatbot and the work after
+        # an answer runs in background tasks, the commands still use the chatbot.
+        self.__async_chatbot = AsyncChatbot(self.__config) if use_async else None
+        self.__tasks: set[asyncio.Task] = set()
+        self.__pending_titles: set[str] = set()
+        self.__store = ConversationStore()
+        self.__exporter = ConversationExporter(self.__config['export_dir'], self.__chatbot, self.__store)
         self.__cache = None
+        self.__cache_version = -1
         
         self.__commands.add('.show_shortcuts', 'Show short cuts', self.__show_shortcuts)
         self.__commands.add('.new', 'Start new conversation', self.__new_conversation)
@@ -45,28 +59,45 @@ class ChatbotCli:
         self.__commands.add('.change_title', 'Change the title of the current conversation', self.__change_title)
         self.__commands.add('.set_conversation', f'{C.HEADER}P1: cid{C.ENDC}. Set the current conversation to cid', self.__set_conversation)
         self.__commands.add('.show_messages', 'Show all messages in the current conversation', self.__show_msgs)
-        self.__commands.add('.show_conversations', 'List all conversations', self.__list_conversations)
+        self.__commands.add('.show_conversations', f'{C.HEADER}[-s]{C.ENDC}. List all conversations, -s to sync them from the server first', self.__list_conversations)
         self.__commands.add('.set_model', f'{C.HEADER}P1: model{C.ENDC}. Set model, valid models: {C.HEADER}{", ".join(GPT_MODELS.keys())}{C.ENDC}', self.__set_model)
         self.__commands.add('.export', f'{C.HEADER}P1: cid{C.ENDC}, export conversation', self.__export_conversation)
-        self.__commands.add('.export_all', 'export all conversations', self.__export_all_conversations)
+        self.__commands.add('.export_all', f'{C.HEADER}[-f]{C.ENDC}. export all conversations changed since the last export, or all of them with -f', self.__export_all_conversations)
         self.__commands.add('.delete', f'{C.HEADER}[P1: cid]{C.ENDC}. Delete conversation(current or cid)', self.__delete_conversation)
         self.__commands.add('.delete_all', 'Delete all conversations', self.__delete_all_conversations)
         self.__commands.add('.show_config', 'Show config', self.__show_config)
 
     def __get_cache(self) -> ConversationCache:
         if self.__cache is None:
-            self.__cache = ConversationCache(self.__chatbot.get_conversations(limit=100))
+            self.__cache_version = self.__store.version
+            self.__cache = ConversationCache(load_page=self.__store.list_conversations)
         return self.__cache
     
     def __clear_cache(self) -> None:
         self.__cache = None
 
+    @try_chatbot
+    def __sync(self) -> None:
+        changed = self.__store.sync(self.__chatbot, full=True)
+        print(f'{changed} conversations synced.')
+
+    def __sync_in_background(self) -> None:
+        def sync():
+            try:
+                self.__store.sync(self.__chatbot)
+            except Exception:
+                pass # the local conversations are still usable, .show_conversations -s syncs again
+
+        threading.Thread(target=sync, daemon=True).start()
+
     @try_chatbot
     def __ask(self, prompt):
         message_id = 0
-        with Live(auto_refresh=False, vertical_overflow='visible') as live:
+        if self.__chatbot.conversation_id:
+            self.__store.invalidate(self.__chatbot.conversation_id)
+        with StreamRenderer(self.__config['render_mode'], self.__config['render_fps']) as renderer:
             for data in self.__chatbot.ask(prompt, auto_continue=True):
-                live.update(Markdown(data['message']), refresh=True)
+                renderer.update(data['message'], data['delta'])
                 message_id = data['parent_id']
         self.__save.set('conversation_id', self.__chatbot.conversation_id)
         self.__save.save()
@@ -80,6 +111,7 @@ class ChatbotCli:
             }
             print(f'\n{C.OKCYAN}{title}{C.ENDC} created.')
             cache.add(conversation)
+            self.__store.save_conversation(conversation)
 
         if self.__config.get('auto_export'):
             title = cache.get_title(cache.get_index(self.__chatbot.conversation_id))
@@ -104,7 +136,7 @@ class ChatbotCli:
         
         print(prompt)
         while True:
-            answer = get_input().strip().lower()
+            answer = self.__get_answer()
             if answer == '':
                 return default
             if answer in ['y', 'yes']:
@@ -114,18 +146,101 @@ class ChatbotCli:
             print('Invalid answer')
 
     
-    def run(self):
+    def __start_task(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__on_task_done)
+
+    def __on_task_done(self, task: asyncio.Task) -> None:
+        self.__tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f'{C.FAIL}Error{C.ENDC}:{task.exception()}')
+
+    async def __stream_async(self, prompt: str) -> str | None:
+        message_id = None
+        with StreamRenderer(self.__config['render_mode'], self.__config['render_fps']) as renderer:
+            async for data in self.__async_chatbot.ask(prompt, auto_continue=True): # type: ignore
+                renderer.update(data['message'], data['delta'])
+                message_id = data['parent_id']
+        return message_id
+
+    async def __ask_async(self, prompt: str):
+        bot: AsyncChatbot = self.__async_chatbot # type: ignore
+        cid = self.__chatbot.conversation_id
+        bot.conversation_id, bot.parent_id = cid, self.__chatbot.parent_id
+        if cid and not bot.parent_id and cid not in bot.conversation_mapping:
+            # Read the current node from the store, instead of mapping all conversations
+            history = await asyncio.to_thread(self.__store.get_history, self.__chatbot, cid)
+            bot.conversation_mapping[cid] = history['current_node']
+        if cid:
+            self.__store.invalidate(cid)
+
+        # Ctrl+C only cancels the answer being streamed
+        task = asyncio.create_task(self.__stream_async(prompt))
+        loop = asyncio.get_running_loop()
+        handler = signal.signal(signal.SIGINT, lambda *_: loop.call_soon_threadsafe(task.cancel))
+        try:
+            message_id = await task
+        except asyncio.CancelledError:
+            print(f'\n{C.WARNING}Cancelled.{C.ENDC}')
+            return
+        except Exception as e:
+            print(f'{C.FAIL}Error{C.ENDC}:{e}')
+            return
+        finally:
+            signal.signal(signal.SIGINT, handler)
+
+        self.__chatbot.conversation_id, self.__chatbot.parent_id = bot.conversation_id, bot.parent_id
+        self.__save.set('conversation_id', bot.conversation_id)
+        self.__save.save()
+        if bot.conversation_id:
+            self.__start_task(self.__after_ask_async(bot.conversation_id, message_id))
+
+    async def __after_ask_async(self, cid: str, message_id: str | None):
+        cache = self.__get_cache()
+        if cid in self.__pending_titles:
+            # The task of the previous answer creates the conversation and exports it
+            return
+
+        if cache.get_index(cid) == -1:
+            self.__pending_titles.add(cid)
+            try:
+                title = await self.__async_chatbot.gen_title(cid, message_id) # type: ignore
+            finally:
+                self.__pending_titles.discard(cid)
+            conversation = {
+                'id': cid,
+                'title': title,
+            }
+            print(f'\n{C.OKCYAN}{title}{C.ENDC} created.')
+            cache.add(conversation)
+            self.__store.save_conversation(conversation)
+
+        if self.__config.get('auto_export'):
+            title = cache.get_title(cache.get_index(cid))
+            await asyncio.to_thread(self.__exporter.export, cid, title)
+
+    def __start(self) -> bool:
         if not self.__check_export_dir():
             return False
         
+        self.__exporter.index_in_background()
         print(WELCOME_MESSAGE)
         print(f'Model: {C.WARNING}{self.__config["model"]}{C.ENDC}')
         print()
 
+        # Conversations are listed from the local store, the changes are pulled in the background
+        if self.__store.is_empty():
+            self.__sync()
+        elif self.__async_chatbot is not None:
+            self.__start_task(asyncio.to_thread(self.__store.sync, self.__chatbot))
+        else:
+            self.__sync_in_background()
+
         conversation_id = self.__save.get('conversation_id')
         if conversation_id:
             try:
-                if self.__chatbot.get_msg_history(conversation_id):
+                if self.__store.get_history(self.__chatbot, conversation_id):
                     self.__chatbot.conversation_id = conversation_id                
                 self.__show_msgs([])
             except Exception:
@@ -135,9 +250,27 @@ class ChatbotCli:
         if self.__save.get('conversation_id') is None:
             self.__list_conversations([])
         print()
+        return True
+
+    def __get_answer(self) -> str:
+        from revChatGPT.utils import get_input
+
+        if self.__async_chatbot is not None:
+            # A prompt of prompt_toolkit runs its own event loop, which it can not do in the
+            # thread running the loop of the async mode, so the answer is read in another one
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                return executor.submit(get_input).result().strip().lower()
+        return get_input().strip().lower()
+
+    def run(self):
+        if not self.__start():
+            return False
+
+        # prompt_toolkit is imported once the command line is running, not for --help
+        from revChatGPT.utils import create_completer, create_session, get_input
 
         session = create_session()
-        completer1 = create_completer(self.__commands.names + self.__exporter.all_titles)
+        completer1 = create_completer(lambda: self.__commands.names + self.__exporter.all_titles)
         completer2 = create_completer(self.__commands.names)
         try:
             while True:
@@ -166,6 +299,50 @@ class ChatbotCli:
             error = CLIError('command line program unknown error')
             raise error from exc
 
+    async def run_async(self):
+        if not self.__start():
+            return False
+
+        from prompt_toolkit.patch_stdout import patch_stdout
+        from revChatGPT.utils import create_completer, create_session, get_input_async
+
+        session = create_session()
+        completer1 = create_completer(lambda: self.__commands.names + self.__exporter.all_titles)
+        completer2 = create_completer(self.__commands.names)
+        try:
+            while True:
+                print(f'{C.OKBLUE + C.BOLD}You: {C.ENDC}')
+
+                completer = completer1 if self.__chatbot.conversation_id is None else completer2
+                # Background tasks print above the prompt while it is waiting for input
+                with patch_stdout():
+                    prompt = await get_input_async(session=session, completer=completer)
+                if self.__chatbot.conversation_id is None:
+                    if self.__exporter.has_conversation(prompt):
+                        self.__exporter.print_conversation(prompt)
+                        continue
+
+                if self.__commands.handle(prompt):
+                    print()
+                    continue
+
+                print()
+                print(f'{C.OKGREEN + C.BOLD}ChatGPT: {C.ENDC}')
+
+                await self.__ask_async(prompt)
+
+                print()
+        except (KeyboardInterrupt, EOFError):
+            pass
+        except Exception as exc:
+            error = CLIError('command line program unknown error')
+            raise error from exc
+        finally:
+            if self.__tasks:
+                print(f'Waiting for {len(self.__tasks)} background tasks...')
+                await asyncio.gather(*self.__tasks, return_exceptions=True)
+            await self.__async_chatbot.session.aclose() # type: ignore
+
     def __show_shortcuts(self, args: list[str]):
         print(SHORTCUTS_HELP)
     
@@ -179,7 +356,11 @@ class ChatbotCli:
     def __list_conversations(self, args: list[str]):
         if len(args) == 2:
             if args[1] == '-s':
+                self.__sync()
                 self.__clear_cache()
+        if self.__cache_version != self.__store.version:
+            # Indexes are only renumbered when the conversations are listed again
+            self.__clear_cache()
 
         cache = self.__get_cache()
         titles = cache.titles()
@@ -234,10 +415,11 @@ class ChatbotCli:
         print(f'Save to: {path}')
 
     def __export_all_conversations(self, args: list[str]):
-        cache = self.__get_cache()
-        for index in range(len(cache)):
-            path = self.__exporter.export(cache.get_cid(index), cache.get_title(index))
-            print(f'Save to: {path}')
+        force = len(args) == 2 and args[1] == '-f'
+        self.__sync()
+        exported, unchanged, failed = self.__exporter.export_all(self.__store.list_conversations(), force=force)
+        print(f'Exported: {exported} unchanged: {unchanged} failed: {failed}')
+        print(f'Save to: {self.__config["export_dir"]}')
 
     @try_chatbot
     def __delete_conversation(self, args: list[str]):
@@ -268,6 +450,7 @@ class ChatbotCli:
         title = cache.get_title(index)
         self.__chatbot.delete_conversation(conversation_id)
         cache.delete(index)
+        self.__store.delete_conversation(conversation_id)
         print(f'session {C.OKCYAN}{title}{C.ENDC} successfully delete.')
 
         if self.__config['auto_export']:
@@ -282,6 +465,7 @@ class ChatbotCli:
         if not self.__confirm('Are you sure to delete all conversations?'):
             return
         self.__chatbot.clear_conversations()
+        self.__store.clear()
         print(f'{C.OKCYAN}All conversations successfully deleted.{C.ENDC}')
         self.__clear_cache()
         self.__chatbot.conversation_id = None
@@ -294,25 +478,14 @@ class ChatbotCli:
             print(f'{C.WARNING}No conversation to show messages.{C.ENDC}')
             return
         
-        history = self.__chatbot.get_msg_history(self.__chatbot.conversation_id, 'utf-8')
+        history = self.__store.get_history(self.__chatbot, self.__chatbot.conversation_id)
         print(f'{C.OKCYAN + C.BOLD}Title: {history["title"]}{C.ENDC}\n') # type: ignore
 
-        mapping = history['mapping'] # type: ignore
-        messages = [msg['message'] for msg in mapping.values() if 'message' in msg and 'content' in msg['message']]
-
-        for msg in messages:
-            content_type = msg['content']['content_type']
-            if content_type != 'text':
-                continue
-
-            text = msg['content']['parts'][0]
-            if not text.strip():
-                continue
-
-            if msg['author']['role'] == 'assistant':
+        for role, text in iter_messages(history): # type: ignore
+            if role == 'assistant':
                 print(f'{C.OKGREEN}ChatGPT:{C.ENDC}')
                 print_md(text)
-            elif msg['author']['role'] == 'user':
+            elif role == 'user':
                 print(f'{C.OKBLUE}You:{C.ENDC}')
                 print_md(text)
             
@@ -341,6 +514,7 @@ class ChatbotCli:
         print(f'{C.OKCYAN + C.BOLD}      Model:{C.ENDC} {self.__chatbot.config["model"]}')
         print(f'{C.OKCYAN + C.BOLD} Export Dir:{C.ENDC} {self.__chatbot.config["export_dir"]}')
         print(f'{C.OKCYAN + C.BOLD}Auto Export:{C.ENDC} {self.__chatbot.config["auto_export"]}')
+        print(f'{C.OKCYAN + C.BOLD}Render Mode:{C.ENDC} {self.__config["render_mode"]}')
 
     @try_chatbot
     def __change_title(self, args: list[str]):
@@ -362,6 +536,7 @@ class ChatbotCli:
             self.__exporter.rename(cid, cache.get_title(index), title)
 
         cache.set_title(index, title)
+        self.__store.set_title(cid, title)
 
         print(f'Conversation title successfully changed to {C.OKCYAN}{title}{C.ENDC}.')    
 
@@ -370,13 +545,14 @@ def __parse_args():
     parser = argparse.ArgumentParser(description='Chatgpt Command Line Tool')
     parser.add_argument('-m', '--model', type=str, default='3.5',
                         help='gpt model, 3.5 or 4, default 3.5')
+    parser.add_argument('-a', '--async', dest='use_async', action='store_true',
+                        help='stream answers with the async chatbot, the work after an answer runs in the background')
     parser.add_argument('-cfg', '--config', help='config file path')
 
     return parser.parse_args()
 
 
-def __load_cmd_config() -> dict:
-    args = __parse_args()
+def __load_cmd_config(args: argparse.Namespace) -> dict:
     config = load_config(args.config)
     if args.model in GPT_MODELS:
         config['model'] = GPT_MODELS[args.model]
@@ -384,6 +560,10 @@ def __load_cmd_config() -> dict:
 
 
 if __name__ == '__main__':
-    config = __load_cmd_config()
-    mgr = ChatbotCli(config)
-    mgr.run()
+    args = __parse_args()
+    config = __load_cmd_config(args)
+    mgr = ChatbotCli(config, args.use_async)
+    if args.use_async:
+        asyncio.run(mgr.run_async())
+    else:
+        mgr.run()
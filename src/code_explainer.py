@@ -1,14 +1,22 @@
 import argparse
+import os
 
-from app import load_config
-from cache import Cache
-from asker import Prompt, do_ask_for_large_file_cmd
-from common import open_file
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app import get_save_path, load_config
+from cache import Cache, TrunkCache, create_cache, create_trunk_cache
+from asker import Prompt, Trunk, create_chatbot, do_ask_for_large_file_cmd, do_ask_for_trunks_cmd, split_files
+from common import match_any, open_file, read_file, write_file
+from revChatGPT.typings import C
+from tokenizer import configure
 
 
 PROG_NAME = 'code_explainer'
 DESC = 'Code explainer used to generate code explanations and assist code reading'
 
+DEFAULT_INCLUDES = ['*.py', '*.ts', '*.tsx', '*.js', '*.jsx', '*.java', '*.kt', '*.go', '*.rs',
+                    '*.c', '*.h', '*.cpp', '*.hpp', '*.cc', '*.cs', '*.lua', '*.rb', '*.php', '*.swift']
+DEFAULT_EXCLUDES = ['.*', 'node_modules', '__pycache__', 'build', 'dist', '*.min.js', '*.d.ts']
+
 def create_prompt(lan) -> Prompt:
     first = f'''The code I sent you is a part of a code file.
 Please help me generate a summary. include the most unique and helpful points.
@@ -36,15 +44,110 @@ into a list of key points and takeaways. Reply in {lan}:'''
 def create_args_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description=DESC)
     parser.add_argument('-t', '--test', action='store_true', help='whether it is in test mode')
-    parser.add_argument('-c', '--cache', action='store_true', help='whether to use cache')
+    parser.add_argument('-c', '--cache', action='store_true', help='whether to use cache, changed files only ask for their changed trunks')
     parser.add_argument('-f', '--file', help='path of the code file')
+    parser.add_argument('-d', '--dir', help='path of a directory, explain every code file in it')
+    parser.add_argument('-i', '--include', nargs='+', default=DEFAULT_INCLUDES, help='glob patterns of the files to explain in --dir')
+    parser.add_argument('-e', '--exclude', nargs='+', default=DEFAULT_EXCLUDES, help='glob patterns of the files and directories to skip in --dir')
+    parser.add_argument('-s', '--split', choices=['syntax', 'token'], default='syntax', help='how to split the code into trunks, default syntax')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only show the trunks the code would be split into, never downloads the tokenizer data')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of trunks (or files with --dir) asked concurrently, default 1')
     parser.add_argument('-cfg', '--config', help='path of the config file')
     return parser
 
 
+def create_cache_meta(config: dict, prompt: Prompt) -> dict:
+    return {
+        'model': config['model'],
+        'language': config['language'],
+        'prompt_version': prompt.version,
+    }
+
+
 def gen_explain_header(path: str) -> str:
     return f'# {path}\n\n[Open](file:///{path})\n'
 
+def to_rel_path(rel_dir: str, name: str) -> str:
+    return os.path.normpath(os.path.join(rel_dir, name)).replace('\\', '/')
+
+
+def collect_files(root: str, includes: list[str], excludes: list[str]) -> list[str]:
+    result = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root)
+        dir_names[:] = sorted(d for d in dir_names if not match_any(to_rel_path(rel_dir, d), excludes))
+        for name in sorted(file_names):
+            rel_path = to_rel_path(rel_dir, name)
+            if match_any(rel_path, includes) and not match_any(rel_path, excludes):
+                result.append(os.path.join(dir_path, name))
+    return result
+
+
+def gen_index(root: str, files: list[str], failed: set[str], cache: Cache) -> str:
+    lines = [f'# {root}', '']
+    for path in files:
+        rel_path = os.path.relpath(path, root).replace('\\', '/')
+        if path in failed:
+            lines.append(f'- {rel_path} (failed)')
+        else:
+            lines.append(f'- [{rel_path}](file:///{cache.get_cache_path(path)})')
+    return '\n'.join(lines) + '\n'
+
+
+def print_plan(paths: list[str], splits: list[tuple[list[Trunk], int]]) -> None:
+    for path, (trunks, token_count) in zip(paths, splits):
+        print(f'{path} tokens: {token_count} trunks: {len(trunks)} ({", ".join(str(t.token_count) for t in trunks)})')
+
+
+def explain_dir(args: argparse.Namespace, config: dict, prompt: Prompt, cache: Cache, trunk_cache: TrunkCache | None,
+                meta: dict) -> str:
+    root = os.path.abspath(args.dir)
+    files = collect_files(root, args.include, args.exclude)
+    todo = [path for path in files if not (args.cache and cache.is_fresh(path, meta))]
+    print(f'Files: {len(files)} cached: {len(files) - len(todo)} to explain: {len(todo)}')
+
+    failed = set()
+    codes = {}
+    for path in todo:
+        try:
+            codes[path] = read_file(path)
+        except (UnicodeDecodeError, OSError) as e:
+            failed.add(path)
+            print(f'{C.FAIL}Failed to read{C.ENDC} {path}: {e}')
+
+    # The codes of all files are tokenized in one batch
+    paths = list(codes)
+    splits = split_files(config['model'], [codes[p] for p in paths], paths if args.split == 'syntax' else None)
+    print(f'Tokens: {sum(count for _, count in splits)} trunks: {sum(len(trunks) for trunks, _ in splits)}')
+    if args.dry_run:
+        print_plan(paths, splits)
+        return ''
+
+    # All files are asked through the connection pool of one session
+    session = create_chatbot(config, jobs=args.jobs).session if paths else None
+
+    def explain(path: str, trunks: list[Trunk]) -> None:
+        trunks = trunks or [Trunk(codes[path], 0)]
+        result = do_ask_for_trunks_cmd(trunks, prompt, config, 1, trunk_cache, session, False)
+        cache.write(path, gen_explain_header(path) + '\n' + result + '\n', meta)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {executor.submit(explain, path, trunks): path for path, (trunks, _) in zip(paths, splits)}
+        for i, future in enumerate(as_completed(futures)):
+            path = futures[future]
+            try:
+                future.result()
+                print(f'{C.OKGREEN}[{i+1}/{len(paths)}] Explained{C.ENDC} {path}')
+            except Exception as e:
+                failed.add(path)
+                print(f'{C.FAIL}[{i+1}/{len(paths)}] Failed{C.ENDC} {path}: {e}')
+
+    index_path = os.path.normpath(os.path.join(get_save_path(), PROG_NAME, f'{os.path.basename(root)}.md'))
+    write_file(index_path, gen_index(root, files, failed, cache))
+    print(f'Index saved in: {index_path}')
+    return index_path
+
+
 def test() -> None:
     print('Test passed')
 
@@ -56,25 +159,38 @@ if __name__ == '__main__':
         test()
         exit(0)
 
-    if not args.file:
+    if not args.file and not args.dir:
         print(parser.format_help())
         exit(0)
     
-    cache = Cache(PROG_NAME)
+    config = load_config(args.config)
+    configure(config, dry_run=args.dry_run)
+    prompt = create_prompt(config['language'])
+    cache = create_cache(config, PROG_NAME)
+    trunk_cache = create_trunk_cache(config, PROG_NAME) if args.cache else None
+    meta = create_cache_meta(config, prompt)
+    if args.dir:
+        index_path = explain_dir(args, config, prompt, cache, trunk_cache, meta)
+        if index_path:
+            open_file(index_path)
+        exit(0)
+
+    if args.dry_run:
+        print_plan([args.file], split_files(config['model'], [read_file(args.file)],
+                                            [args.file] if args.split == 'syntax' else None))
+        exit(0)
+
     if args.cache:
-        result = cache.read(args.file)
+        result = cache.read(args.file, meta)
         if result:
             print(result)
             open_file(cache.get_cache_path(args.file))
             exit(0)
 
-    if args.file:
-        config = load_config(args.config)
-        prompt = create_prompt(config['language'])
-        result = do_ask_for_large_file_cmd(args.file, prompt, config)
-        if not result:
-            exit(1)
+    result = do_ask_for_large_file_cmd(args.file, prompt, config, args.jobs, args.split == 'syntax', trunk_cache)
+    if not result:
+        exit(1)
 
-        cache.write(args.file, gen_explain_header(args.file) + '\n' + result + '\n')
-        open_file(cache.get_cache_path(args.file))
-        exit(0)
+    cache.write(args.file, gen_explain_header(args.file) + '\n' + result + '\n', meta)
+    open_file(cache.get_cache_path(args.file))
+    exit(0)
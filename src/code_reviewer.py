@@ -1,9 +1,17 @@
+from __future__ import annotations
+
 import argparse
 import os
-from git.repo import Repo
+from typing import TYPE_CHECKING
 from app import get_save_path, load_config
-from asker import Prompt, do_ask_for_large_file_cmd
+from asker import Prompt, do_ask_for_trunks_cmd, split_patch
+from cache import create_trunk_cache
 from common import open_file, write_file
+from tokenizer import configure
+
+if TYPE_CHECKING:
+    from git.diff import Diff
+    from git.repo import Repo
 
 PROG_NAME = 'code_reviewer'
 DESC = '''A code reviewer used to generate code review
@@ -29,48 +37,100 @@ If any bug risk and improvement suggestion are welcome.
 Then, please provide a commit message 30 words or less.
 Please reply in {lan}:'''
 
-    return Prompt(first, next, sumarize_multi, sumarize_single)
+    sumarize_partial = f'''The following content is code reviews of different parts of the same code patch.
+Please summarize them with the most unique and helpful points, into a list of key points and takeaways.
+Please reply in {lan}:'''
+
+    return Prompt(first, next, sumarize_multi, sumarize_single, sumarize_partial)
 
 def create_args_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description=DESC)
     parser.add_argument('-t', '--test', action='store_true', help='whether it is in test mode')
+    parser.add_argument('-c', '--cache', action='store_true', help='whether to use cache, only the changed hunks are reviewed again')
     parser.add_argument('-f', '--file', help='file path, the git repository root directory will be taken as this file directory')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only show the trunks the patch would be split into, never downloads the tokenizer data')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of trunks asked concurrently, default 1')
     parser.add_argument('-cfg', '--config', help='path of the config file')
 
     return parser
 
+def open_repo(path: str) -> Repo:
+    # GitPython is imported when a repository is opened, not when the command line is parsed
+    from git.repo import Repo
+
+    return Repo(path, search_parent_directories=True)
+
+
+def format_diff(diff: Diff) -> str:
+    a_path = diff.a_path or diff.b_path
+    b_path = diff.b_path or diff.a_path
+    lines = [f'diff --git a/{a_path} b/{b_path}']
+    if diff.new_file:
+        lines.append('new file')
+    elif diff.deleted_file:
+        lines.append('deleted file')
+    elif diff.renamed_file:
+        lines.append(f'rename from {diff.rename_from}\nrename to {diff.rename_to}')
+    lines.append(f'--- {"/dev/null" if diff.new_file else "a/" + a_path}')
+    lines.append(f'+++ {"/dev/null" if diff.deleted_file else "b/" + b_path}')
+
+    content = diff.diff.decode('utf-8', errors='replace') if isinstance(diff.diff, bytes) else diff.diff
+    return '\n'.join(lines) + '\n' + (content or 'Binary files differ\n')
+
+
+def format_untracked_file(repo: Repo, path: str) -> str | None:
+    try:
+        with open(os.path.join(repo.working_dir, path), 'r', encoding='utf8') as f:
+            lines = f.read().splitlines()
+    except (UnicodeDecodeError, OSError):
+        return None
+
+    header = f'diff --git a/{path} b/{path}\nnew file\n--- /dev/null\n+++ b/{path}\n@@ -0,0 +1,{len(lines)} @@\n'
+    return header + ''.join(f'+{line}\n' for line in lines)
+
+
 def gen_patch(repo: Repo, file) -> str:
+    """Generate the patch of the uncommitted changes, or of the last commit if there is none.
+
+    Uncommitted changes include staged, unstaged and untracked files. The patch is
+    built in memory, the index and the working tree are never touched.
+    """
     if not repo:
         raise Exception(f'The directory where the file [{file}] is located is not a git repository')
-    
-    repo_name = os.path.basename(repo.working_dir)
-    patch_path = os.path.join(get_save_path(), f'{repo_name}.patch')
-    if repo.is_dirty():
-        repo.git.add(A=True)
-        repo.index.commit('Automatically submitted by code_reviewer')
-        os.system(f'cd {os.path.dirname(file)} && git format-patch -1 --stdout > {patch_path}')
-        repo.git.reset('HEAD~1')
-    else:
-        os.system(f'cd {os.path.dirname(file)} && git format-patch -1 --stdout > {patch_path}')
-
-    if not os.path.exists(patch_path):
-        raise Exception(f'Failed to generate patch file. Please check whether the directory where the file [{file}] is located is a git repository')
-    return patch_path
+
+    commit = repo.head.commit
+    if repo.is_dirty(untracked_files=True):
+        patches = [format_diff(d) for d in commit.diff(None, create_patch=True)]
+        for path in repo.untracked_files:
+            patch = format_untracked_file(repo, path)
+            if patch:
+                patches.append(patch)
+        return ''.join(patches)
+
+    from git.diff import NULL_TREE
+
+    parent = commit.parents[0] if commit.parents else NULL_TREE
+    diffs = parent.diff(commit, create_patch=True) if commit.parents else commit.diff(parent, create_patch=True)
+    header = f'From {commit.hexsha}\nAuthor: {commit.author}\nSubject: [PATCH] {commit.message.strip()}\n\n'
+    return header + ''.join(format_diff(d) for d in diffs)
+
 
 def gen_review_header(repo: Repo) -> str:
     commit_message = repo.head.commit.message.strip()
+    is_dirty = repo.is_dirty(untracked_files=True)
     return f'''# Code review
 
 Repository: {os.path.basename(repo.working_dir)}
 Branch: {repo.active_branch.name}
-Commit information: {"(unsubmitted)" if repo.is_dirty() else commit_message}
-Commit author: {"(unknown)" if repo.is_dirty() else repo.head.commit.author}
+Commit information: {"(unsubmitted)" if is_dirty else commit_message}
+Commit author: {"(unknown)" if is_dirty else repo.head.commit.author}
 '''
     
 
 def test() -> None:
-    repo = Repo(os.path.dirname(__file__), search_parent_directories=True)
+    repo = open_repo(os.path.dirname(__file__))
     print(gen_review_header(repo))
+    print(gen_patch(repo, __file__))
 
 
 if __name__ == '__main__':
@@ -86,13 +146,29 @@ if __name__ == '__main__':
         print(parser.format_help())
         exit(0)
     
-    repo = Repo(os.path.dirname(file), search_parent_directories=True)
-    patch_path = gen_patch(repo, file)
-    print(f'Generated patch file [{patch_path}]')
+    repo = open_repo(os.path.dirname(os.path.abspath(file)))
+    patch = gen_patch(repo, file)
+    if not patch:
+        print('Nothing to review')
+        exit(0)
+    print(f'Generated patch, length: {len(patch)}')
 
     config = load_config(args.config)
+    configure(config, dry_run=args.dry_run)
     prompt = create_prompt(config['language'])
-    result = do_ask_for_large_file_cmd(patch_path, prompt, config)
+    trunks, token_count = split_patch(config['model'], patch, config['review_exclude'])
+    if not trunks:
+        print('Nothing to review')
+        exit(0)
+    print(f'Patch token_count: {token_count} trunks: {len(trunks)} jobs: {args.jobs}')
+    if args.dry_run:
+        for trunk in trunks:
+            path = (trunk.key or '').partition('\0')[0]
+            print(f'{path} tokens: {trunk.token_count}')
+        exit(0)
+
+    trunk_cache = create_trunk_cache(config, PROG_NAME) if args.cache else None
+    result = do_ask_for_trunks_cmd(trunks, prompt, config, args.jobs, trunk_cache)
     
     review_header = gen_review_header(repo)
     repo_name = os.path.basename(repo.working_dir)
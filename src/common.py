@@ -1,11 +1,12 @@
 import os
 import re
-import time
+import threading
 
-from rich import print as print_rich
-from typing import Callable
-from rich.markdown import Markdown
+from fnmatch import fnmatch
+from functools import wraps
+from typing import Callable, Generator
 
+from retry import RetryExhausted, RetryPolicy
 from revChatGPT.typings import C
 
 GPT_MODELS = {
@@ -14,6 +15,7 @@ GPT_MODELS = {
 }
 
 MAX_RETRIES = 5
+CHATBOT_RETRY = RetryPolicy(max_attempts=MAX_RETRIES, deadline=60)
 
 
 def write_file(path: str, content: str) -> None:
@@ -25,6 +27,31 @@ def write_file(path: str, content: str) -> None:
         f.write(content)
 
 
+def atomic_write(path: str, content: str | bytes) -> None:
+    """Write the content to a temporary file first, then replace the file with it.
+
+    A killed run never leaves a truncated file, and concurrent readers never see a
+    partial one. The temporary file is unique to the process and thread.
+    """
+    dir = os.path.dirname(path)
+    if dir:
+        os.makedirs(dir, exist_ok=True)
+
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        if isinstance(content, bytes):
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+        else:
+            with open(temp_path, 'w', encoding='utf8') as f:
+                f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
 def read_file(path: str) -> str:
     with open(path, 'r') as f:
         return f.read()
@@ -38,6 +65,11 @@ def to_valid_filename(s):
     return re.sub(r'[^\w\s-]', '_', s).strip()
 
 
+def match_any(path: str, patterns: list[str]) -> bool:
+    name = os.path.basename(path)
+    return any(fnmatch(path, p) or fnmatch(name, p) for p in patterns)
+
+
 def replace_env_variables(json_string):
     pattern = r"\$\{(\w+)\}"
 
@@ -54,26 +86,51 @@ def replace_env_variables(json_string):
 
 
 def try_chatbot(func: Callable[..., object]) -> Callable[..., object]:
+    # Errors are printed and the command returns None once the retries are exhausted
+    @wraps(func)
     def wrapper(*args, **kwargs):
-        for i in range(0, MAX_RETRIES):
-            try:
-                return func(*args, **kwargs)
-            except Exception as e:
-                print(f'{C.FAIL}Error [{i+1}/{MAX_RETRIES}]{C.ENDC}:{e}')
-                if i < MAX_RETRIES - 1:
-                    print(f'\nRetrying in 3 seconds...\n')
-                    time.sleep(3)
-        
-        time.sleep(0.5)
-        print('')
-        print(f'{C.BOLD}{C.FAIL}Error: Failed to retry {MAX_RETRIES} times{C.ENDC}')
+        try:
+            return CHATBOT_RETRY.call(lambda: func(*args, **kwargs), func.__qualname__)
+        except RetryExhausted as e:
+            print('')
+            print(f'{C.BOLD}{C.FAIL}Error: Failed after {e.attempt.number} attempts{C.ENDC}')
     
     return wrapper
 
 
+def iter_messages(history: dict) -> Generator[tuple[str, str], None, None]:
+    """Role and text of the messages of the active branch of a history, from the first one.
+
+    The branch is found by following the parent links from current_node, so the
+    messages of regenerated answers that were abandoned are skipped.
+    """
+    mapping = history['mapping']
+    node_id = history.get('current_node')
+    if node_id not in mapping:
+        # Without a current node, fall back to the order of the mapping
+        branch = list(mapping)
+    else:
+        branch = []
+        while node_id is not None and node_id in mapping:
+            branch.append(node_id)
+            node_id = mapping[node_id].get('parent')
+        branch.reverse()
+
+    for node_id in branch:
+        msg = mapping[node_id].get('message')
+        if not msg or 'content' not in msg or msg['content'].get('content_type') != 'text':
+            continue
+        text = msg['content']['parts'][0]
+        if text.strip():
+            yield msg['author']['role'], text
+
+
 def print_md(msg, **kwargs):
     msg = msg.replace('You:', f'{C.OKBLUE}You:{C.ENDC}')
     msg = msg.replace('ChatGPT:', f'{C.OKGREEN}ChatGPT:{C.ENDC}')
+    from rich import print as print_rich
+    from rich.markdown import Markdown
+
     print_rich(Markdown(msg), **kwargs)
 
 
@@ -1,41 +1,163 @@
+from typing import Callable
+
+PAGE_SIZE = 100
+
+
+class LiveSlots:
+    """Fenwick tree over the slots of a list, 1 for a live slot and 0 for a deleted one.
+
+    Appending, deleting, counting the live slots before a slot and finding the k-th
+    live slot are all O(log n).
+    """
+
+    def __init__(self) -> None:
+        # 1-based, node i holds the live slots in (i - lowbit(i), i]
+        self.tree = [0]
+        self.count = 0
+
+    def append(self) -> None:
+        i = len(self.tree)
+        self.tree.append(1 + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+        self.count += 1
+
+    def remove(self, slot: int) -> None:
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] -= 1
+            i += i & -i
+        self.count -= 1
+
+    def prefix(self, n: int) -> int:
+        # Live slots among the first n slots
+        result = 0
+        while n > 0:
+            result += self.tree[n]
+            n -= n & -n
+        return result
+
+    def find(self, k: int) -> int:
+        # Slot of the k-th live slot, from 0
+        pos = 0
+        remaining = k + 1
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if pos + step < len(self.tree) and self.tree[pos + step] < remaining:
+                pos += step
+                remaining -= self.tree[pos]
+            step >>= 1
+        return pos
+
+
 class ConversationCache:
+    """Conversations from the most recent one, indexed by id.
+
+    Added conversations are appended to a reversed list, and the older ones are
+    appended to a second list as pages are loaded with load_page(last, limit),
+    where last is the last conversation loaded before. Deleted entries are left
+    as holes, skipped through a Fenwick tree of the live entries of each list, so
+    adding, deleting and finding an entry by position or by id are all O(log n).
+    """
+
+    def __init__(self, conversations: list[dict] | None = None,
+                 load_page: Callable[[dict | None, int], list[dict]] | None = None, page_size: int = PAGE_SIZE) -> None:
+        self.__newer: list[dict | None] = []
+        self.__older: list[dict | None] = []
+        self.__newer_live = LiveSlots()
+        self.__older_live = LiveSlots()
+        # id -> slot, -k-1 for the k-th entry of newer, k for the k-th entry of older
+        self.__slots: dict[str, int] = {}
+        self.__load_page = load_page
+        self.__page_size = page_size
+        self.__last_loaded = None
+        self.__exhausted = load_page is None
+        self.__append_older(conversations or [])
+
+    def __append_older(self, conversations: list[dict]) -> None:
+        for conv in conversations:
+            cid = conv.get('id')
+            if cid in self.__slots:
+                continue
+            self.__slots[cid] = len(self.__older) # type: ignore
+            self.__older.append(conv)
+            self.__older_live.append()
 
-    def __init__(self, conversations: list[dict]) -> None:
-        self.conversations = conversations
+    def __load_next_page(self) -> bool:
+        if self.__exhausted:
+            return False
+
+        page = self.__load_page(self.__last_loaded, self.__page_size) # type: ignore
+        if len(page) < self.__page_size:
+            self.__exhausted = True
+        if page:
+            self.__last_loaded = page[-1]
+            self.__append_older(page)
+        return bool(page)
+
+    def __load_all(self) -> None:
+        while self.__load_next_page():
+            pass
+
+    def __get(self, index: int) -> dict | None:
+        if index < 0:
+            return None
+        while index >= self.__newer_live.count + self.__older_live.count and self.__load_next_page():
+            pass
+
+        if index < self.__newer_live.count:
+            # The newest entry is the last live one of newer
+            return self.__newer[self.__newer_live.find(self.__newer_live.count - 1 - index)]
+        index -= self.__newer_live.count
+        return self.__older[self.__older_live.find(index)] if index < self.__older_live.count else None
 
     def exist(self, index: int) -> bool:
-        return 0 <= index and index < len(self.conversations)
-    
+        return self.__get(index) is not None
+
     def get_cid(self, index: int) -> str:
-        return self.conversations[index].get('id') # type: ignore
-    
+        return self.__get(index).get('id') # type: ignore
+
     def delete(self, index: int):
-        if not self.exist(index):
+        conv = self.__get(index)
+        if conv is None:
             return
-        del self.conversations[index]
-    
+        slot = self.__slots.pop(conv.get('id')) # type: ignore
+        if slot < 0:
+            self.__newer[-slot - 1] = None
+            self.__newer_live.remove(-slot - 1)
+        else:
+            self.__older[slot] = None
+            self.__older_live.remove(slot)
+
     def add(self, conversation: dict):
-        self.conversations.insert(0, conversation)
+        self.__slots[conversation.get('id')] = -len(self.__newer) - 1 # type: ignore
+        self.__newer.append(conversation)
+        self.__newer_live.append()
 
     def get_title(self, index: int) -> str:
-        return self.conversations[index].get('title') # type: ignore
-    
+        return self.__get(index).get('title') # type: ignore
+
     def set_title(self, index: int, title: str):
-        self.conversations[index]['title'] = title
+        self.__get(index)['title'] = title # type: ignore
 
     def get_index(self, conversation_id: str) -> int:
-        for i, conv in enumerate(self.conversations):
-            if conv.get('id') == conversation_id:
-                return i
-        return -1
-    
+        while conversation_id not in self.__slots and self.__load_next_page():
+            pass
+
+        slot = self.__slots.get(conversation_id)
+        if slot is None:
+            return -1
+        if slot < 0:
+            # Live entries of newer after this one
+            return self.__newer_live.count - self.__newer_live.prefix(-slot)
+        return self.__newer_live.count + self.__older_live.prefix(slot)
+
     def titles(self) -> list[str]:
-        return [conv.get('title') for conv in self.conversations] # type: ignore
-    
+        self.__load_all()
+        newer = [conv.get('title') for conv in reversed(self.__newer) if conv is not None]
+        return newer + [conv.get('title') for conv in self.__older if conv is not None] # type: ignore
+
     def __getitem__(self, index: int) -> dict | None:
-        if index < 0 or index >= len(self.conversations):
-            return None
-        return self.conversations[index]
-        
+        return self.__get(index)
+
     def __len__(self) -> int:
-        return len(self.conversations)
+        self.__load_all()
+        return len(self.__slots)
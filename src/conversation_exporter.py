@@ -1,43 +1,133 @@
+from __future__ import annotations
+
+import json
 import os
+import threading
 
-from revChatGPT.V1 import Chatbot
-from common import get_next_ok_path, print_md, to_valid_filename, try_chatbot
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+from common import atomic_write, get_next_ok_path, iter_messages, print_md, to_valid_filename, try_chatbot
+from conversation_store import ConversationStore
+from retry import RetryPolicy
 from revChatGPT.typings import CLIError, C
 
+if TYPE_CHECKING:
+    from revChatGPT.V1 import Chatbot
+
+MANIFEST_NAME = '.export_manifest.json'
+EXPORT_JOBS = 8
+# Rate limits are likely when fetching many histories at once
+FETCH_RETRY = RetryPolicy(max_attempts=5, deadline=120)
+
 
 class ConversationExporter:
-    def __init__(self, root: str, chatboot: Chatbot) -> None:
+    def __init__(self, root: str, chatboot: Chatbot, store: ConversationStore) -> None:
         self.__root = root
         self.__chatbot = chatboot
-        self.__conversations = [self.__filename_to_title(f) for f in os.listdir(self.__root) if os.path.isfile(os.path.join(self.__root, f))]
+        self.__store = store
+        self.__manifest_path = os.path.join(self.__root, MANIFEST_NAME)
+        self.__manifest = self.__load_manifest()
+        self.__manifest_lock = threading.Lock()
+        # Titles of the exported files, scanned on first use and then kept up to date
+        self.__titles: set[str] | None = None
+        self.__sorted_titles: list[str] | None = None
+        self.__titles_lock = threading.Lock()
 
     @try_chatbot
     def __get_history(self, cid: str) -> dict:
-        history = self.__chatbot.get_msg_history(cid, 'utf-8')
-        return history # type: ignore
+        return self.__store.get_history(self.__chatbot, cid)
 
-    def __save(self, cid: str, title: str, path: str) -> None:
-        history = self.__get_history(cid)
-        mapping = history['mapping'] # type: ignore
-        messages = [msg['message'] for msg in mapping.values() if 'message' in msg and 'content' in msg['message']]
+    def __fetch_history(self, cid: str) -> dict:
+        # Failures are printed with the progress, once the retries are exhausted
+        return FETCH_RETRY.call(lambda: self.__store.get_history(self.__chatbot, cid), 'get_history', verbose=False)
+
+    def __load_manifest(self) -> dict:
+        # cid -> update_time of the conversation when it was last exported
+        try:
+            with open(self.__manifest_path, 'r', encoding='utf8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def __save_manifest(self) -> None:
+        with self.__manifest_lock:
+            content = json.dumps(self.__manifest, indent=2)
+        atomic_write(self.__manifest_path, content)
+
+    def __record(self, cid: str, update_time: str | None) -> None:
+        with self.__manifest_lock:
+            if update_time:
+                self.__manifest[cid] = update_time
+            else:
+                self.__manifest.pop(cid, None)
 
+    def __write(self, cid: str, path: str, title: str, history: dict) -> None:
+        # The file is only replaced once the whole history is rendered
         try:
-            with open(path, 'w', encoding='utf8') as f:
-                f.write(f'# {title}\n\n')
-                for msg in messages:
-                    content_type = msg['content']['content_type']
-                    if content_type != 'text':
-                        continue
-                    text = msg['content']['parts'][0]
-                    if not text.strip():
-                        continue
-
-                    if msg['author']['role'] == 'assistant':
-                        f.write(f'ChatGPT:\n{text}\n\n')
-                    elif msg['author']['role'] == 'user':
-                        f.write(f'You:\n{text}\n\n')
+            texts = [f'# {title}\n\n']
+            for role, text in iter_messages(history):
+                if role == 'assistant':
+                    texts.append(f'ChatGPT:\n{text}\n\n')
+                elif role == 'user':
+                    texts.append(f'You:\n{text}\n\n')
+            atomic_write(path, ''.join(texts))
         except:
+            # A bad history is fetched again by the next export, instead of failing until the conversation changes
+            self.__store.invalidate(cid)
             raise CLIError(f'Failed to save conversation to: {path}')
+        self.__update_titles(added=path)
+
+    def __save(self, cid: str, title: str, path: str) -> None:
+        history = self.__get_history(cid)
+        self.__write(cid, path, title, history) # type: ignore
+        conversation = self.__store.get_conversation(cid)
+        self.__record(cid, conversation.get('update_time') if conversation else None)
+        self.__save_manifest()
+
+    def is_exported(self, conversation: dict) -> bool:
+        update_time = conversation.get('update_time')
+        return bool(update_time) and self.__manifest.get(conversation.get('id')) == update_time \
+            and os.path.exists(self.__get_path(conversation.get('title') or ''))
+
+    def export_all(self, conversations: list[dict], jobs: int = EXPORT_JOBS, force: bool = False) -> tuple[int, int, int]:
+        """Export the conversations, returns the count of exported, unchanged and failed ones.
+
+        Histories are fetched by a pool of jobs threads and written by another thread,
+        conversations whose update_time is the one of their last export are skipped.
+        """
+        todo = [conv for conv in conversations if force or not self.is_exported(conv)]
+        unchanged = len(conversations) - len(todo)
+        print(f'Conversations: {len(conversations)} unchanged: {unchanged} to export: {len(todo)}')
+
+        def write(conv: dict, history: dict) -> None:
+            title = to_valid_filename(conv.get('title') or '')
+            self.__write(conv['id'], self.__get_path(title), title, history)
+            self.__record(conv['id'], conv.get('update_time'))
+
+        exported = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=1) as writer, ThreadPoolExecutor(max_workers=max(1, jobs)) as fetcher:
+            futures = {fetcher.submit(self.__fetch_history, conv['id']): conv for conv in todo}
+            writes = []
+            for i, future in enumerate(as_completed(futures)):
+                conv = futures[future]
+                try:
+                    writes.append((conv, writer.submit(write, conv, future.result())))
+                    print(f'[{i+1}/{len(todo)}] {C.OKCYAN}{conv.get("title")}{C.ENDC}')
+                except Exception as e:
+                    failed += 1
+                    print(f'[{i+1}/{len(todo)}] {C.FAIL}{conv.get("title")}{C.ENDC}: {e}')
+
+            for conv, write_future in writes:
+                try:
+                    write_future.result()
+                    exported += 1
+                except Exception as e:
+                    failed += 1
+                    print(f'{C.FAIL}{e}{C.ENDC}')
+
+        self.__save_manifest()
+        return exported, unchanged, failed
     
     def export(self, cid: str, title: str, force: bool = True) -> str | None:
         path = self.__get_path(title)
@@ -55,6 +145,7 @@ class ConversationExporter:
         path = self.__get_path(title)
         if os.path.exists(path):
             os.remove(path)
+            self.__update_titles(removed=path)
     
     def rename(self, cid: str, old_title: str, new_title: str) -> None:
         old_path = self.__get_path(old_title)
@@ -70,9 +161,11 @@ class ConversationExporter:
             ok_path = get_next_ok_path(new_path)
             print(f'{C.WARNING}Saving to {ok_path}{C.ENDC}')
             os.rename(old_path, ok_path)
+            self.__update_titles(added=ok_path, removed=old_path)
             return
 
         os.rename(old_path, new_path)
+        self.__update_titles(added=new_path, removed=old_path)
     
     def __title_to_filename(self, title: str) -> str:
         return to_valid_filename(title) + '.md'
@@ -83,12 +176,42 @@ class ConversationExporter:
     def __get_path(self, title: str) -> str:
         return os.path.join(self.__root, self.__title_to_filename(title))
     
+    def __scan_titles(self) -> set[str]:
+        if not os.path.isdir(self.__root):
+            return set()
+        with os.scandir(self.__root) as entries:
+            return {self.__filename_to_title(e.name) for e in entries if e.name != MANIFEST_NAME and e.is_file()}
+
+    def __get_titles(self) -> set[str]:
+        with self.__titles_lock:
+            if self.__titles is None:
+                self.__titles = self.__scan_titles()
+            return self.__titles
+
+    def __update_titles(self, added: str | None = None, removed: str | None = None) -> None:
+        with self.__titles_lock:
+            if self.__titles is None:
+                return
+            if removed:
+                self.__titles.discard(self.__filename_to_title(removed))
+            if added:
+                self.__titles.add(self.__filename_to_title(added))
+            self.__sorted_titles = None
+
+    def index_in_background(self) -> None:
+        # Callers of all_titles or has_conversation wait for the scan if it is not done yet
+        threading.Thread(target=self.__get_titles, daemon=True).start()
+
     @property
     def all_titles(self) -> list[str]:
-        return [os.path.splitext(os.path.basename(f))[0] for f in self.__conversations]
+        titles = self.__get_titles()
+        with self.__titles_lock:
+            if self.__sorted_titles is None:
+                self.__sorted_titles = sorted(titles)
+            return self.__sorted_titles
     
     def has_conversation(self, title: str) -> bool:
-        return title in self.__conversations
+        return title in self.__get_titles()
 
     def print_conversation(self, titile: str) -> None:
         path = self.__get_path(titile)
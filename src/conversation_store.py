@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from app import get_save_path
+
+if TYPE_CHECKING:
+    from revChatGPT.V1 import Chatbot
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    update_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_update_time ON conversations (update_time);
+CREATE TABLE IF NOT EXISTS histories (
+    id TEXT PRIMARY KEY,
+    update_time TEXT,
+    data TEXT NOT NULL
+);
+'''
+
+
+def now_iso() -> str:
+    # Same format as the update_time of the conversation list
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ConversationStore:
+    """Conversations and their message histories saved in a local SQLite database.
+
+    A history is saved with the update_time of its conversation, and it is only
+    read back while the conversation has not changed since. sync pulls the
+    conversations changed since the last sync, so the histories of the other
+    ones are read locally.
+    """
+
+    def __init__(self, path: str = 'conversations.db') -> None:
+        self.path = path if path == ':memory:' else os.path.join(get_save_path(), path)
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Shared with the thread syncing in the background
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.version = 0
+
+    def list_conversations(self, last: dict | None = None, limit: int = -1) -> list[dict]:
+        """Conversations from the most recently updated, the ones after last if it is given."""
+        with self.lock:
+            if last is None:
+                rows = self.db.execute('SELECT data FROM conversations ORDER BY update_time DESC, id DESC LIMIT ?',
+                                       (limit,)).fetchall()
+            else:
+                rows = self.db.execute('SELECT data FROM conversations WHERE (update_time, id) < (?, ?) '
+                                       'ORDER BY update_time DESC, id DESC LIMIT ?',
+                                       (last['update_time'], last['id'], limit)).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def get_conversation(self, cid: str) -> dict | None:
+        with self.lock:
+            row = self.db.execute('SELECT data FROM conversations WHERE id = ?', (cid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_conversation(self, conversation: dict) -> None:
+        conversation = {**conversation, 'update_time': conversation.get('update_time') or now_iso()}
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO conversations (id, title, update_time, data) VALUES (?, ?, ?, ?)',
+                            (conversation['id'], conversation.get('title'), conversation['update_time'],
+                             json.dumps(conversation, ensure_ascii=False)))
+            self.version += 1
+
+    def set_title(self, cid: str, title: str) -> None:
+        conversation = self.get_conversation(cid)
+        if conversation:
+            self.save_conversation({**conversation, 'title': title})
+
+    def delete_conversation(self, cid: str) -> None:
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM conversations WHERE id = ?', (cid,))
+            self.db.execute('DELETE FROM histories WHERE id = ?', (cid,))
+            self.version += 1
+
+    def clear(self) -> None:
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM conversations')
+            self.db.execute('DELETE FROM histories')
+            self.version += 1
+
+    def invalidate(self, cid: str) -> None:
+        # The conversation got new messages, its history must be fetched again
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM histories WHERE id = ?', (cid,))
+
+    def read_history(self, cid: str) -> dict | None:
+        with self.lock:
+            row = self.db.execute('SELECT h.data FROM histories h JOIN conversations c ON c.id = h.id '
+                                  'WHERE h.id = ? AND h.update_time = c.update_time', (cid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_history(self, chatbot: Chatbot, cid: str) -> dict:
+        history = self.read_history(cid)
+        if history is not None:
+            return history
+
+        history = chatbot.get_msg_history(cid, 'utf-8')
+        conversation = self.get_conversation(cid)
+        if conversation:
+            with self.lock, self.db:
+                self.db.execute('INSERT OR REPLACE INTO histories (id, update_time, data) VALUES (?, ?, ?)',
+                                (cid, conversation['update_time'], json.dumps(history, ensure_ascii=False)))
+        return history # type: ignore
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM conversations LIMIT 1').fetchone() is None
+
+    def sync(self, chatbot: Chatbot, full: bool = False) -> int:
+        """Pull the conversations changed since the last sync, returns their count.
+
+        The conversations are listed from the most recently updated, so listing
+        stops at the first page with an unchanged conversation. A full sync lists
+        all of them and also removes the ones deleted elsewhere.
+        """
+        changed = 0
+        seen = set()
+        for items in chatbot.iter_conversations(encoding='utf-8'):
+            has_unchanged = False
+            for item in items:
+                seen.add(item['id'])
+                stored = self.get_conversation(item['id'])
+                if stored and stored.get('update_time') == item.get('update_time'):
+                    has_unchanged = True
+                    continue
+                self.save_conversation(item)
+                changed += 1
+            if has_unchanged and not full:
+                break
+
+        if full:
+            for conversation in self.list_conversations():
+                if conversation['id'] not in seen:
+                    self.delete_conversation(conversation['id'])
+                    changed += 1
+        return changed
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -2,6 +2,7 @@ import json
 import os
 
 from app import get_save_path
+from common import atomic_write
 
 # Example of using Config:
 #
@@ -18,23 +19,24 @@ class JsonConfig:
         self.is_dirty = False
 
     def load(self):
+        self.config = self.read_saved()
+
+    def read_saved(self) -> dict:
+        # Content of the file, which another process may have saved since it was loaded
         try:
             with open(self.path, 'r', encoding='utf8') as f:
-                self.config = json.load(f)
+                return json.load(f)
         except FileNotFoundError:
-            pass
+            return {}
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # Left truncated by a killed run, start over instead of failing every later run
+            return {}
 
     def save(self):
         if not self.is_dirty:
             return
 
-        # Create the directory if it does not exist.
-        dir_path = os.path.dirname(self.path)
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-
-        with open(self.path, 'w', encoding='utf8') as file:
-            json.dump(self.config, file, indent=2)
+        atomic_write(self.path, json.dumps(self.config, indent=2))
         self.is_dirty = False
 
     def get(self, key):
@@ -46,6 +48,14 @@ class JsonConfig:
             self.is_dirty = True
         self.config[key] = value
 
+    def delete(self, key):
+        if key in self.config:
+            del self.config[key]
+            self.is_dirty = True
+
+    def items(self):
+        return list(self.config.items())
+
     def __getitem__(self, key):
         return self.get(key)
 
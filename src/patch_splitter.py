@@ -0,0 +1,61 @@
+import re
+
+from common import match_any
+
+DIFF_HEADER = 'diff --git '
+HUNK_HEADER_PATTERN = re.compile(r'^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@', re.MULTILINE)
+
+
+class FilePatch:
+    def __init__(self, path: str, header: str, hunks: list[str]) -> None:
+        self.path = path
+        self.header = header
+        self.hunks = hunks
+
+
+def get_patch_path(diff_line: str) -> str:
+    # diff --git a/old_path b/new_path
+    paths = diff_line[len(DIFF_HEADER):].strip()
+    index = paths.rfind(' b/')
+    return paths[index + 3:] if index >= 0 else paths
+
+
+def parse_patch(patch: str) -> list[FilePatch]:
+    """Parse a git patch into files and hunks, the text before the first file is ignored."""
+    result = []
+    current = None
+    lines = []
+
+    def flush():
+        if current is None:
+            return
+        if lines:
+            current.hunks.append(''.join(lines))
+        result.append(current)
+
+    for line in patch.splitlines(keepends=True):
+        if line.startswith(DIFF_HEADER):
+            flush()
+            current = FilePatch(get_patch_path(line), line, [])
+            lines = []
+        elif current is None:
+            continue
+        elif line.startswith('@@'):
+            if lines:
+                current.hunks.append(''.join(lines))
+            lines = [line]
+        elif current.hunks or lines:
+            lines.append(line)
+        else:
+            current.header += line
+    flush()
+    return result
+
+
+def filter_patches(patches: list[FilePatch], excludes: list[str]) -> list[FilePatch]:
+    return [p for p in patches if not match_any(p.path, excludes)]
+
+
+def get_hunk_key(hunk: str) -> str:
+    # Line numbers change when an earlier hunk changes, they must not invalidate the cache
+    return HUNK_HEADER_PATTERN.sub('@@', hunk)
@@ -0,0 +1,163 @@
+import random
+import time
+
+from email.utils import parsedate_to_datetime
+from typing import Callable, TypeVar
+
+from revChatGPT.typings import AuthenticationError, C, Error, ErrorType
+
+T = TypeVar('T')
+
+# Classes of errors, and the base delay in seconds before retrying them. A class
+# without a delay fails fast, retrying would fail the same way.
+ERROR_DELAYS = {
+    'rate_limit': 5.0,
+    'server': 2.0,
+    'network': 1.0,
+    'unknown': 3.0,
+    'auth': None,
+    'invalid': None,
+}
+
+AUTH_STATUS = {401, 403}
+INVALID_STATUS = {400, 404, 405, 413, 422}
+AUTH_ERRORS = {ErrorType.EXPIRED_ACCESS_TOKEN_ERROR, ErrorType.INVALID_ACCESS_TOKEN_ERROR,
+               ErrorType.AUTHENTICATION_ERROR}
+RATE_LIMIT_ERRORS = {ErrorType.RATE_LIMIT_ERROR, ErrorType.PROHIBITED_CONCURRENT_QUERY_ERROR}
+SERVER_ERRORS = {ErrorType.SERVER_ERROR, ErrorType.CLOUDFLARE_ERROR}
+INVALID_ERRORS = {ErrorType.USER_ERROR, ErrorType.INVALID_REQUEST_ERROR}
+
+
+def classify(error: Exception) -> str:
+    if isinstance(error, AuthenticationError):
+        return 'auth'
+    if isinstance(error, Error):
+        code = error.code
+        if code in AUTH_STATUS or code in AUTH_ERRORS:
+            return 'auth'
+        if code == 429 or code in RATE_LIMIT_ERRORS:
+            return 'rate_limit'
+        if (isinstance(code, int) and code >= 500) or code in SERVER_ERRORS:
+            return 'server'
+        if code in INVALID_STATUS or code in INVALID_ERRORS:
+            return 'invalid'
+        return 'unknown'
+    # Connection errors and timeouts, requests errors are OSError too
+    if isinstance(error, OSError):
+        return 'network'
+    return 'unknown'
+
+
+def get_retry_after(error: Exception) -> float | None:
+    """Seconds to wait asked by the Retry-After header of the response, if any."""
+    value = getattr(error, 'retry_after', None)
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Attempt:
+    def __init__(self, name: str, number: int, elapsed: float, error: Exception | None = None,
+                 error_class: str | None = None, delay: float | None = None) -> None:
+        self.name = name
+        # From 1
+        self.number = number
+        self.elapsed = elapsed
+        # None when the attempt succeeded
+        self.error = error
+        self.error_class = error_class
+        # Seconds before the next attempt, None when there is none
+        self.delay = delay
+
+
+attempt_hooks: list[Callable[[Attempt], None]] = []
+
+
+def add_attempt_hook(hook: Callable[[Attempt], None]) -> None:
+    """Call hook with every attempt of every policy, to record them to metrics."""
+    attempt_hooks.append(hook)
+
+
+class RetryExhausted(Exception):
+    def __init__(self, attempt: Attempt) -> None:
+        super().__init__(f'{attempt.name} failed after {attempt.number} attempts: {attempt.error}')
+        self.attempt = attempt
+
+
+class RetryPolicy:
+    """Retry failed calls with exponential backoff and full jitter.
+
+    The delay of the n-th retry is random in [0, min(max_delay, base * 2^n)], where
+    base depends on the class of the error, so concurrent callers do not retry in
+    lockstep. A Retry-After of the server is always honored. Errors that can not
+    succeed on retry, like a bad access token, fail at once, and no retry starts
+    once the total wait before retries would exceed the deadline. The time spent
+    in the attempts is not counted, so a long streamed answer that fails is still
+    retried. User interrupts are never caught.
+    """
+
+    def __init__(self, max_attempts: int = 5, max_delay: float = 30.0, deadline: float = 120.0,
+                 delays: dict[str, float | None] | None = None) -> None:
+        self.max_attempts = max_attempts
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.delays = {**ERROR_DELAYS, **(delays or {})}
+
+    def get_delay(self, retry: int, error: Exception, error_class: str) -> float | None:
+        base = self.delays.get(error_class)
+        if base is None:
+            return None
+        delay = random.uniform(0, min(self.max_delay, base * 2 ** retry))
+        retry_after = get_retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def call(self, func: Callable[[], T], name: str | None = None, verbose: bool = True) -> T:
+        """Call func until it succeeds, raises RetryExhausted with the last attempt otherwise.
+
+        Every failed attempt is printed when verbose.
+        """
+        name = name or getattr(func, '__qualname__', 'call')
+        start = time.monotonic()
+        retry = 0
+        # Seconds slept before retries, bounded by the deadline
+        waited = 0.0
+        while True:
+            try:
+                result = func()
+            except Exception as e:
+                attempt = self.__on_error(name, retry, start, waited, e)
+                if verbose:
+                    print(f'{C.FAIL}Error [{attempt.number}/{self.max_attempts}]{C.ENDC}:{e}')
+                if attempt.delay is None:
+                    raise RetryExhausted(attempt) from e
+                if verbose:
+                    print(f'\nRetrying in {attempt.delay:.1f} seconds...\n')
+                time.sleep(attempt.delay)
+                waited += attempt.delay
+                retry += 1
+            else:
+                self.__record(Attempt(name, retry + 1, time.monotonic() - start))
+                return result
+
+    def __on_error(self, name: str, retry: int, start: float, waited: float, error: Exception) -> Attempt:
+        error_class = classify(error)
+        elapsed = time.monotonic() - start
+        delay = None
+        if retry + 1 < self.max_attempts:
+            delay = self.get_delay(retry, error, error_class)
+            if delay is not None and waited + delay > self.deadline:
+                delay = None
+        attempt = Attempt(name, retry + 1, elapsed, error, error_class, delay)
+        self.__record(attempt)
+        return attempt
+
+    def __record(self, attempt: Attempt) -> None:
+        for hook in attempt_hooks:
+            hook(attempt)
@@ -6,27 +6,36 @@ from __future__ import annotations
 import base64
 import binascii
 import contextlib
+import asyncio
 import json
 import logging
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from os import environ
 from os import getenv
 from pathlib import Path
 from typing import AsyncGenerator
+from typing import AsyncIterable
+from typing import Callable
 from typing import Generator
+from typing import Iterable
+from typing import TYPE_CHECKING
 
-import httpx
 import requests
-from httpx import AsyncClient
-from OpenAIAuth import Authenticator
-from OpenAIAuth import Error as AuthError
 
 from . import __version__
 from . import typings as t
 from .recipient import RecipientManager
-from .utils import get_input
+from .sse import loads
+from .sse import SSEDecoder
+from .transport import create_async_client
+from .transport import create_session
+from .transport import get_timeouts
+
+if TYPE_CHECKING:
+    import httpx
 
 if __name__ == "__main__":
     logging.basicConfig(
@@ -36,38 +45,49 @@ if __name__ == "__main__":
 log = logging.getLogger(__name__)
 
 
+# Tracing is decided when the module is imported, undecorated methods are called
+# directly unless CHATGPT_TRACE is set or debug logging is already enabled.
+TRACE = bool(environ.get("CHATGPT_TRACE"))
+trace_hooks: list[Callable[[str, float], None]] = []
+
+
+def add_trace_hook(hook: Callable[[str, float], None]) -> None:
+    """Receive the qualified name and running time in seconds of timed methods
+
+    Args:
+        hook (Callable[[str, float], None]): called after every timed method returns
+    """
+    trace_hooks.append(hook)
+
+
 def logger(is_timed: bool):
     """Logger decorator
 
     Args:
-        is_timed (bool): Whether to include function running time in exit log
+        is_timed (bool): Whether to report function running time to the trace hooks
 
     Returns:
-        _type_: decorated function
+        _type_: the function itself when tracing is disabled, decorated function otherwise
     """
 
     def decorator(func):
-        wraps(func)
+        if not TRACE and not log.isEnabledFor(logging.DEBUG):
+            return func
+
+        name = func.__qualname__
 
+        @wraps(func)
         def wrapper(*args, **kwargs):
-            log.debug(
-                "Entering %s with args %s and kwargs %s",
-                func.__name__,
-                args,
-                kwargs,
-            )
-            start = time.time()
+            if not is_timed:
+                log.debug("Calling %s", name)
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
             out = func(*args, **kwargs)
-            end = time.time()
-            if is_timed:
-                log.debug(
-                    "Exiting %s with return value %s. Took %s seconds.",
-                    func.__name__,
-                    out,
-                    end - start,
-                )
-            else:
-                log.debug("Exiting %s with return value %s", func.__name__, out)
+            elapsed = time.perf_counter() - start
+            log.debug("%s took %.3f seconds", name, elapsed)
+            for hook in trace_hooks:
+                hook(name, elapsed)
             return out
 
         return wrapper
@@ -75,8 +95,39 @@ def logger(is_timed: bool):
     return decorator
 
 
+def iter_events(decoder: SSEDecoder, chunks: Iterable[bytes]) -> Generator[bytes, None, None]:
+    """Data of the server-sent events in a stream of chunks"""
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+
+async def aiter_events(
+    decoder: SSEDecoder,
+    chunks: AsyncIterable[bytes],
+) -> AsyncGenerator[bytes, None]:
+    """Data of the server-sent events in an async stream of chunks"""
+    async for chunk in chunks:
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.close():
+        yield event
+
+
+def get_delta(prev_message: str, message: str) -> str:
+    """Text added to prev_message by message, every event carries the whole message so far"""
+    if message.startswith(prev_message):
+        return message[len(prev_message) :]
+    return message
+
+
 BASE_URL = environ.get("CHATGPT_BASE_URL") or "https://ai.fakeopen.com/api/"
 
+# Conversations listed per request, and histories fetched at the same time,
+# when mapping all conversations
+CONVERSATIONS_PAGE_SIZE = 100
+MAP_CONVERSATIONS_JOBS = 8
+
 bcolors = t.Colors()
 
 
@@ -96,6 +147,7 @@ class Chatbot:
         session_client=None,
         lazy_loading: bool = True,
         base_url: str | None = None,
+        session: requests.Session | None = None,
     ) -> None:
         """Initialize a chatbot
 
@@ -111,6 +163,8 @@ class Chatbot:
             conversation_id (str | None, optional): Id of the conversation to continue on. Defaults to None.
             parent_id (str | None, optional): Id of the previous response message to continue on. Defaults to None.
             session_client (_type_, optional): _description_. Defaults to None.
+            session (requests.Session | None, optional): Session to send the requests with, several chatbots can share
+                the connection pool of one session. Defaults to a new session created from the transport settings of config.
 
         Raises:
             Exception: _description_
@@ -128,7 +182,15 @@ class Chatbot:
             self.cache_path = Path(user_home, ".config", "revChatGPT", "cache.json")
 
         self.config = config
-        self.session = session_client() if session_client else requests.Session()
+        # A session given by the caller may be shared with chatbots running in other threads
+        self.owns_session = session is None
+        if session is not None:
+            self.session = session
+        elif session_client is not None:
+            self.session = session_client()
+        else:
+            self.session = create_session(config)
+        self.connect_timeout, _ = get_timeouts(config)
         if "email" in config and "password" in config:
             try:
                 cached_access_token = self.__get_cached_access_token(
@@ -170,6 +232,8 @@ class Chatbot:
             error = t.AuthenticationError("Insufficient login details provided!")
             raise error
         if "access_token" not in self.config:
+            from OpenAIAuth import Error as AuthError
+
             try:
                 self.login()
             except AuthError as error:
@@ -184,24 +248,26 @@ class Chatbot:
         Args:
             access_token (str): access_token
         """
-        self.session.headers.clear()
-        self.session.headers.update(
-            {
-                "Accept": "text/event-stream",
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-                "X-Openai-Assistant-App-Id": "",
-                "Connection": "close",
-                "Accept-Language": "en-US,en;q=0.9",
-                "Referer": "https://chat.openai.com/chat",
-                "User-Agent": 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Safari/537.36'
-            },
-        )
-        self.session.cookies.update(
-            {
-                "library": "revChatGPT",
-            },
-        )
+        headers = {
+            "Accept": "text/event-stream",
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+            "X-Openai-Assistant-App-Id": "",
+            "Accept-Language": "en-US,en;q=0.9",
+            "Referer": "https://chat.openai.com/chat",
+            "User-Agent": 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Safari/537.36'
+        }
+        # Other threads may be sending requests with a shared session, its headers are
+        # set once, by the first chatbot using it, and never cleared
+        if self.owns_session:
+            self.session.headers.clear()
+        if self.owns_session or self.session.headers.get("Authorization") != headers["Authorization"]:
+            self.session.headers.update(headers)
+            self.session.cookies.update(
+                {
+                    "library": "revChatGPT",
+                },
+            )
 
         self.config["access_token"] = access_token
 
@@ -307,6 +373,8 @@ class Chatbot:
             log.error("Insufficient login details provided!")
             error = t.AuthenticationError("Insufficient login details provided!")
             raise error
+        from OpenAIAuth import Authenticator
+
         auth = Authenticator(
             email_address=self.config.get("email"),
             password=self.config.get("password"),
@@ -317,7 +385,7 @@ class Chatbot:
 
         self.set_access_token(auth.access_token)
 
-    @logger(is_timed=True)
+    @logger(is_timed=False)
     def __send_request(
         self,
         data: dict,
@@ -335,43 +403,35 @@ class Chatbot:
         response = self.session.post(
             url=f"{self.base_url}conversation",
             data=json.dumps(data),
-            timeout=timeout,
+            timeout=(self.connect_timeout, timeout),
             stream=True,
         )
         self.__check_response(response)
 
         finish_details = None
-        for line in response.iter_lines():
-            # remove b' and ' at the beginning and end and ignore case
-            line = str(line)[2:-1]
-            if line.lower() == "internal server error":
-                log.error(f"Internal Server Error: {line}")
+        decoder = SSEDecoder()
+        for event in iter_events(decoder, response.iter_content(chunk_size=None)):
+            if event.strip().lower() == b"internal server error":
+                log.error("Internal Server Error: %s", event)
                 error = t.Error(
                     source="ask",
                     message="Internal Server Error",
                     code=t.ErrorType.SERVER_ERROR,
                 )
                 raise error
-            if not line or line is None:
-                continue
-            if "data: " in line:
-                line = line[6:]
-            if line == "[DONE]":
+            if event == b"[DONE]":
                 break
 
-            line = line.replace('\\"', '"')
-            line = line.replace("\\'", "'")
-            line = line.replace("\\\\", "\\")
-
             try:
-                line = json.loads(line)
-            except json.decoder.JSONDecodeError:
+                line = loads(event)
+            except ValueError:
                 continue
             if not self.__check_fields(line):
                 raise ValueError(f"Field missing. Details: {str(line)}")
             if line.get("message").get("author").get("role") != "assistant":
                 continue
-            message: str = line["message"]["content"]["parts"][0]
+            delta = get_delta(message, line["message"]["content"]["parts"][0])
+            message = line["message"]["content"]["parts"][0]
             cid = line["conversation_id"]
             pid = line["message"]["id"]
             metadata = line["message"].get("metadata", {})
@@ -379,6 +439,7 @@ class Chatbot:
             finish_details = metadata.get("finish_details", {"type": None})["type"]
             yield {
                 "message": message,
+                "delta": delta,
                 "conversation_id": cid,
                 "parent_id": pid,
                 "model": model,
@@ -404,7 +465,7 @@ class Chatbot:
             i["message"] = message + i["message"]
             yield i
 
-    @logger(is_timed=True)
+    @logger(is_timed=False)
     def post_messages(
         self,
         messages: list[dict],
@@ -427,6 +488,7 @@ class Chatbot:
         Yields: Generator[dict, None, None] - The response from the chatbot
             dict: {
                 "message": str,
+                "delta": str, # text added since the previous response
                 "conversation_id": str,
                 "parent_id": str,
                 "model": str,
@@ -489,7 +551,7 @@ class Chatbot:
             auto_continue=auto_continue,
         )
 
-    @logger(is_timed=True)
+    @logger(is_timed=False)
     def ask(
         self,
         prompt: str,
@@ -512,6 +574,7 @@ class Chatbot:
         Yields: The response from the chatbot
             dict: {
                 "message": str,
+                "delta": str, # text added since the previous response
                 "conversation_id": str,
                 "parent_id": str,
                 "model": str,
@@ -538,7 +601,7 @@ class Chatbot:
             timeout=timeout,
         )
 
-    @logger(is_timed=True)
+    @logger(is_timed=False)
     def continue_write(
         self,
         conversation_id: str | None = None,
@@ -558,6 +621,7 @@ class Chatbot:
         Yields:
             dict: {
                 "message": str,
+                "delta": str, # text added since the previous response
                 "conversation_id": str,
                 "parent_id": str,
                 "model": str,
@@ -647,6 +711,7 @@ class Chatbot:
                 source="OpenAI",
                 message=response.text,
                 code=response.status_code,
+                retry_after=response.headers.get("Retry-After"),
             )
             raise error from ex
 
@@ -729,11 +794,53 @@ class Chatbot:
         self.__check_response(response)
 
     @logger(is_timed=False)
+    def iter_conversations(
+        self,
+        page_size: int = CONVERSATIONS_PAGE_SIZE,
+        encoding: str | None = None,
+    ) -> Generator[list, None, None]:
+        """
+        Iterate over the pages of all conversations
+        :param page_size: Integer
+        :param encoding: String
+        """
+        offset = 0
+        while True:
+            items = self.get_conversations(offset, page_size, encoding)
+            if items:
+                yield items
+            if len(items) < page_size:
+                return
+            offset += len(items)
+
+    @logger(is_timed=True)
     def __map_conversations(self) -> None:
-        conversations = self.get_conversations()
-        histories = [self.get_msg_history(x["id"]) for x in conversations]
-        for x, y in zip(conversations, histories):
-            self.conversation_mapping[x["id"]] = y["current_node"]
+        """Map the id of every conversation to its current node
+
+        Histories are fetched by a pool of threads while the next page is listed,
+        and saved to conversation_mapping as soon as each one arrives. With the
+        map_current_node_only config, the current node given by the listing is
+        used and only conversations without one are fetched.
+        """
+        jobs = self.config.get("map_conversations_jobs", MAP_CONVERSATIONS_JOBS)
+        current_node_only = self.config.get("map_current_node_only", False)
+
+        def map_conversation(convo_id: str) -> None:
+            # Runs in the pool, so the mapping grows while the next pages are listed
+            try:
+                history = self.get_msg_history(convo_id)
+            except Exception as error:
+                log.debug("Failed to get history of %s: %s", convo_id, error)
+                return
+            self.conversation_mapping[convo_id] = history["current_node"]
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for items in self.iter_conversations():
+                for item in items:
+                    if current_node_only and item.get("current_node"):
+                        self.conversation_mapping[item["id"]] = item["current_node"]
+                    else:
+                        executor.submit(map_conversation, item["id"])
 
     @logger(is_timed=False)
     def reset_chat(self) -> None:
@@ -774,7 +881,7 @@ class AsyncChatbot(Chatbot):
             config=config,
             conversation_id=conversation_id,
             parent_id=parent_id,
-            session_client=AsyncClient,
+            session_client=lambda: create_async_client(config),
             base_url=base_url,
         )
 
@@ -784,6 +891,8 @@ class AsyncChatbot(Chatbot):
         auto_continue: bool = False,
         timeout: float = 360,
     ) -> AsyncGenerator[dict, None]:
+        import httpx
+
         cid, pid = data["conversation_id"], data["parent_message_id"]
 
         self.conversation_id_prev_queue.append(cid)
@@ -796,25 +905,23 @@ class AsyncChatbot(Chatbot):
             method="POST",
             url=f"{self.base_url}conversation",
             data=json.dumps(data),
-            timeout=timeout,
+            timeout=httpx.Timeout(timeout, connect=self.connect_timeout),
         ) as response:
             await self.__check_response(response)
-            async for line in response.aiter_lines():
-                if not line or line is None:
-                    continue
-                if "data: " in line:
-                    line = line[6:]
-                if "[DONE]" in line:
+            decoder = SSEDecoder()
+            async for event in aiter_events(decoder, response.aiter_bytes()):
+                if event == b"[DONE]":
                     break
 
                 try:
-                    line = json.loads(line)
-                except json.decoder.JSONDecodeError:
+                    line = loads(event)
+                except ValueError:
                     continue
                 if not self.__check_fields(line):
                     raise ValueError(f"Field missing. Details: {str(line)}")
 
-                message: str = line["message"]["content"]["parts"][0]
+                delta = get_delta(message, line["message"]["content"]["parts"][0])
+                message = line["message"]["content"]["parts"][0]
                 cid = line["conversation_id"]
                 pid = line["message"]["id"]
                 metadata = line["message"].get("metadata", {})
@@ -822,6 +929,7 @@ class AsyncChatbot(Chatbot):
                 finish_details = metadata.get("finish_details", {"type": None})["type"]
                 yield {
                     "message": message,
+                    "delta": delta,
                     "conversation_id": cid,
                     "parent_id": pid,
                     "model": model,
@@ -869,6 +977,7 @@ class AsyncChatbot(Chatbot):
             AsyncGenerator[dict, None]: The response from the chatbot
             {
                 "message": str,
+                "delta": str, # text added since the previous response
                 "conversation_id": str,
                 "parent_id": str,
                 "model": str,
@@ -944,6 +1053,7 @@ class AsyncChatbot(Chatbot):
             AsyncGenerator[dict, None]: The response from the chatbot
             {
                 "message": str,
+                "delta": str, # text added since the previous response
                 "conversation_id": str,
                 "parent_id": str,
                 "model": str,
@@ -992,6 +1102,7 @@ class AsyncChatbot(Chatbot):
             AsyncGenerator[dict, None]: The response from the chatbot
             {
                 "message": str,
+                "delta": str, # text added since the previous response
                 "conversation_id": str,
                 "parent_id": str,
                 "model": str,
@@ -1072,7 +1183,7 @@ class AsyncChatbot(Chatbot):
             return json.loads(response.text)
         return None
 
-    async def gen_title(self, convo_id: str, message_id: str) -> None:
+    async def gen_title(self, convo_id: str, message_id: str) -> str:
         """
         Generate title for conversation
         """
@@ -1084,6 +1195,7 @@ class AsyncChatbot(Chatbot):
             ),
         )
         await self.__check_response(response)
+        return response.json().get("title", "Error generating title")
 
     async def change_title(self, convo_id: str, title: str) -> None:
         """
@@ -1112,11 +1224,46 @@ class AsyncChatbot(Chatbot):
         response = await self.session.patch(url, data='{"is_visible": false}')
         await self.__check_response(response)
 
+    async def iter_conversations(
+        self,
+        page_size: int = CONVERSATIONS_PAGE_SIZE,
+    ) -> AsyncGenerator[list, None]:
+        """
+        Iterate over the pages of all conversations
+        :param page_size: Integer
+        """
+        offset = 0
+        while True:
+            items = await self.get_conversations(offset, page_size)
+            if items:
+                yield items
+            if len(items) < page_size:
+                return
+            offset += len(items)
+
     async def __map_conversations(self) -> None:
-        conversations = await self.get_conversations()
-        histories = [await self.get_msg_history(x["id"]) for x in conversations]
-        for x, y in zip(conversations, histories):
-            self.conversation_mapping[x["id"]] = y["current_node"]
+        """Same as Chatbot.__map_conversations, with the histories fetched by concurrent tasks"""
+        jobs = self.config.get("map_conversations_jobs", MAP_CONVERSATIONS_JOBS)
+        current_node_only = self.config.get("map_current_node_only", False)
+        semaphore = asyncio.Semaphore(jobs)
+
+        async def map_conversation(convo_id: str) -> None:
+            async with semaphore:
+                try:
+                    history = await self.get_msg_history(convo_id)
+                except Exception as error:
+                    log.debug("Failed to get history of %s: %s", convo_id, error)
+                    return
+            self.conversation_mapping[convo_id] = history["current_node"]
+
+        tasks = []
+        async for items in self.iter_conversations():
+            for item in items:
+                if current_node_only and item.get("current_node"):
+                    self.conversation_mapping[item["id"]] = item["current_node"]
+                else:
+                    tasks.append(asyncio.create_task(map_conversation(item["id"])))
+        await asyncio.gather(*tasks)
 
     def __check_fields(self, data: dict) -> bool:
         try:
@@ -1127,6 +1274,8 @@ class AsyncChatbot(Chatbot):
 
     async def __check_response(self, response: httpx.Response) -> None:
         # 改成自带的错误处理
+        import httpx
+
         try:
             response.raise_for_status()
         except httpx.HTTPStatusError as ex:
@@ -1135,11 +1284,17 @@ class AsyncChatbot(Chatbot):
                 source="OpenAI",
                 message=response.text,
                 code=response.status_code,
+                retry_after=response.headers.get("Retry-After"),
             )
             raise error from ex
 
 
-get_input = logger(is_timed=False)(get_input)
+@logger(is_timed=False)
+def get_input(*args, **kwargs) -> str:
+    # prompt_toolkit is only imported by the command line of this module
+    from .utils import get_input as get_input_impl
+
+    return get_input_impl(*args, **kwargs)
 
 
 @logger(is_timed=False)
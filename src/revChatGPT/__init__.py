@@ -9,23 +9,18 @@ __version__ = "5.0.0"
 __all__ = ()
 
 # Available Python Version Verify
+import sys
+
 from . import typings as t
 
-if int(__import__("platform").python_version_tuple()[0]) < 3:
-    error = t.NotAllowRunning("Not available Python version")
-    raise error
-elif int(__import__("platform").python_version_tuple()[1]) < 9:
+if sys.version_info < (3, 9):
     error = t.NotAllowRunning(
-        f"Not available Python version: {__import__('platform').python_version()}",
+        f"Not available Python version: {sys.version.split()[0]}",
     )
     raise error
-else:
-    if (
-        int(__import__("platform").python_version_tuple()[1]) < 10
-        and int(__import__("platform").python_version_tuple()[0]) == 3
-    ):
-        __import__("warnings").warn(
-            UserWarning(
-                "The current Python is not a recommended version, 3.10+ is recommended",
-            ),
-        )
+if sys.version_info < (3, 10):
+    __import__("warnings").warn(
+        UserWarning(
+            "The current Python is not a recommended version, 3.10+ is recommended",
+        ),
+    )
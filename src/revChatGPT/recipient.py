@@ -27,8 +27,6 @@ from abc import abstractmethod
 from typing import Callable
 from typing import Type
 
-from async_tio import Tio
-
 
 class RecipientMeta(ABCMeta):
     """
@@ -264,6 +262,9 @@ class PythonRecipient(Recipient):
 
     def __init__(self) -> None:
         super().__init__()
+        # Imported here, aiohttp is slow to import and only this recipient needs it
+        from async_tio import Tio
+
         self.tio = Tio()
 
     async def aprocess(self, message: dict, **kwargs: dict):
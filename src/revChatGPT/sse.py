@@ -0,0 +1,83 @@
+"""
+Incremental decoder of server-sent events
+"""
+from __future__ import annotations
+
+import json
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+class SSEDecoder:
+    """
+    Decode a stream of server-sent events from raw bytes.
+
+    Chunks of any size are fed as they arrive, and the data of every completed
+    event is returned as bytes, without decoding or copying the rest of the stream.
+    """
+
+    def __init__(self) -> None:
+        self.pending: list[bytes] = []
+        self.data: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        """Feed raw bytes
+
+        Args:
+            chunk (bytes): bytes received from the stream
+
+        Returns:
+            list[bytes]: data of the events completed by the chunk
+        """
+        if b"\n" not in chunk:
+            self.pending.append(chunk)
+            return []
+
+        if self.pending:
+            self.pending.append(chunk)
+            chunk = b"".join(self.pending)
+            self.pending = []
+        lines = chunk.split(b"\n")
+        if lines[-1]:
+            self.pending.append(lines[-1])
+
+        events = []
+        for line in lines[:-1]:
+            event = self.__feed_line(line.rstrip(b"\r"))
+            if event is not None:
+                events.append(event)
+        return events
+
+    def close(self) -> list[bytes]:
+        """Finish the stream
+
+        Returns:
+            list[bytes]: data of the last event, if the stream did not end with a blank line
+        """
+        events = self.feed(b"\n\n") if self.pending or self.data else []
+        self.pending = []
+        return events
+
+    def __feed_line(self, line: bytes) -> bytes | None:
+        if not line:
+            if not self.data:
+                return None
+            event = self.data[0] if len(self.data) == 1 else b"\n".join(self.data)
+            self.data = []
+            return event
+
+        if line.startswith(b":"):
+            return None
+
+        field, sep, value = line.partition(b":")
+        if not sep:
+            # Not an event field, keep the line as data like the server sent it
+            self.data.append(line)
+        elif field == b"data":
+            self.data.append(value[1:] if value.startswith(b" ") else value)
+        return None
@@ -0,0 +1,123 @@
+"""
+Connection pools shared by the chatbots
+"""
+from __future__ import annotations
+
+import importlib.util
+import logging
+
+from typing import TYPE_CHECKING
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    import httpx
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 360
+DEFAULT_RETRIES = 3
+
+
+def get_timeouts(config: dict) -> tuple[float, float]:
+    """Connect and read timeouts of the config
+
+    Args:
+        config (dict): config of the chatbot
+
+    Returns:
+        tuple[float, float]: timeouts in seconds
+    """
+    return (
+        config.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+        config.get("read_timeout", DEFAULT_READ_TIMEOUT),
+    )
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter applying default timeouts to requests sent without one"""
+
+    def __init__(self, timeout: tuple[float, float], *args, **kwargs) -> None:
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(config: dict) -> requests.Session:
+    """Create a session with a pool of keep-alive connections
+
+    Connection errors and 502/503/504 responses of idempotent requests are retried
+    by the adapter. Conversation requests are POST and are never retried here.
+
+    Args:
+        config (dict): config of the chatbot, the optional keys are
+            "pool_connections": number of hosts to keep pools for,
+            "pool_maxsize": connections kept per host, at least the number of parallel requests,
+            "connect_timeout" and "read_timeout": in seconds,
+            "retries": retries of failed idempotent requests
+
+    Returns:
+        requests.Session: the session, it can be shared by several chatbots
+    """
+    retries = config.get("retries", DEFAULT_RETRIES)
+    adapter = TimeoutHTTPAdapter(
+        get_timeouts(config),
+        pool_connections=config.get("pool_connections", DEFAULT_POOL_CONNECTIONS),
+        pool_maxsize=config.get("pool_maxsize", DEFAULT_POOL_MAXSIZE),
+        max_retries=Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        ),
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def create_async_client(config: dict) -> httpx.AsyncClient:
+    """Create an async client with a pool of keep-alive connections
+
+    Args:
+        config (dict): same keys as create_session, plus "http2" to multiplex the
+            requests over one connection per host, which needs the h2 package
+
+    Returns:
+        httpx.AsyncClient: the client
+    """
+    # httpx is only imported by the async chatbot
+    import httpx
+
+    http2 = config.get("http2", False)
+    if http2 and importlib.util.find_spec("h2") is None:
+        log.warning("HTTP/2 needs the h2 package, falling back to HTTP/1.1")
+        http2 = False
+
+    connect_timeout, read_timeout = get_timeouts(config)
+    pool_maxsize = config.get("pool_maxsize", DEFAULT_POOL_MAXSIZE)
+    limits = httpx.Limits(
+        max_connections=pool_maxsize,
+        max_keepalive_connections=pool_maxsize,
+    )
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        # The retries of the transport only cover failed connection attempts
+        transport=httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=limits,
+            retries=config.get("retries", DEFAULT_RETRIES),
+        ),
+    )
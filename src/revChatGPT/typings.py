@@ -3,7 +3,7 @@ A module that contains all the types used in this project
 """
 import os
 from enum import Enum
-from typing import Union
+from typing import Optional, Union
 
 
 SUPPORT_ADD_NOTES = [
@@ -94,10 +94,13 @@ class Error(ChatbotError):
         message: str,
         *args: object,
         code: Union[ErrorType, int] = ErrorType.UNKNOWN_ERROR,
+        retry_after: Optional[str] = None,
     ) -> None:
         self.source: str = source
         self.message: str = message
         self.code: ErrorType | int = code
+        # Retry-After header of the response, seconds or an HTTP date
+        self.retry_after: Optional[str] = retry_after
         super().__init__(*args)
 
     def __str__(self) -> str:
@@ -0,0 +1,87 @@
+import time
+
+# incremental: completed markdown blocks are printed once, only the last block is re-rendered
+# full: the whole message is re-rendered on every refresh
+# plain: the text is printed as it arrives, without markdown rendering
+RENDER_MODES = ['incremental', 'full', 'plain']
+
+
+def find_block_end(text: str) -> int:
+    """Offset right after the last complete markdown block of the text, 0 if there is none."""
+    end = 0
+    offset = 0
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        offset += len(line)
+        if not line.endswith('\n'):
+            break
+
+        stripped = line.strip()
+        if stripped.startswith('```') or stripped.startswith('~~~'):
+            in_fence = not in_fence
+            if not in_fence:
+                end = offset
+        elif not stripped and not in_fence:
+            end = offset
+    return end
+
+
+class StreamRenderer:
+    def __init__(self, mode: str = 'incremental', fps: float = 10) -> None:
+        self.mode = mode if mode in RENDER_MODES else 'incremental'
+        self.interval = 1 / fps if fps > 0 else 0
+        self.live = None
+        self.message = ''
+        self.committed = 0
+        self.last_refresh = 0.0
+
+    def __enter__(self) -> 'StreamRenderer':
+        if self.mode != 'plain':
+            from rich.live import Live
+
+            self.live = Live(auto_refresh=False, vertical_overflow='visible')
+            self.live.__enter__()
+        return self
+
+    def __exit__(self, *args) -> None:
+        if self.live is None:
+            print()
+            return
+
+        self.__refresh()
+        self.live.__exit__(*args)
+
+    def update(self, message: str, delta: str) -> None:
+        if self.live is None:
+            print(delta, end='', flush=True)
+            return
+
+        self.message = message
+        now = time.time()
+        if now - self.last_refresh < self.interval:
+            return
+        self.last_refresh = now
+        self.__refresh()
+
+    def __refresh(self) -> None:
+        if self.live is None:
+            return
+
+        from rich.markdown import Markdown
+
+        if self.mode == 'full':
+            self.live.update(Markdown(self.message), refresh=True)
+            return
+
+        if len(self.message) < self.committed:
+            self.committed = 0
+        pending = self.message[self.committed:]
+        end = find_block_end(pending)
+        if end > 0:
+            # Printed above the live area, it will never be rendered again
+            if self.committed > 0:
+                self.live.console.print()
+            self.live.console.print(Markdown(pending[:end]))
+            self.committed += end
+            pending = pending[end:]
+        self.live.update(Markdown(pending), refresh=True)
@@ -0,0 +1,109 @@
+import ast
+import os
+import re
+
+COMMENT_PREFIXES = ('//', '#', '/*', '*', '@', '--')
+OPEN_BRACKETS = '{(['
+CLOSE_BRACKETS = '})]'
+STRING_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`')
+LINE_COMMENT_PATTERN = re.compile(r'//.*$')
+BLOCK_COMMENT_PATTERN = re.compile(r'/\*.*?\*/')
+
+
+def split_python_units(code: str) -> list[str] | None:
+    try:
+        module = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+
+    lines = code.splitlines(keepends=True)
+    starts = []
+    prev_end = 0
+    for node in module.body:
+        start = node.lineno - 1
+        for decorator in getattr(node, 'decorator_list', []):
+            start = min(start, decorator.lineno - 1)
+        # Comments right above a statement belong to it, the blank lines before them
+        # to the previous one. Indented comments are left at the end of the previous body.
+        while start > prev_end and lines[start - 1].startswith('#'):
+            start -= 1
+        starts.append(start)
+        prev_end = node.end_lineno or node.lineno
+
+    if not starts:
+        return [code] if code else []
+
+    # Consecutive imports are kept together as a single unit
+    starts[0] = 0
+    result = []
+    prev_is_import = False
+    for i, node in enumerate(module.body):
+        end = starts[i + 1] if i + 1 < len(starts) else len(lines)
+        text = ''.join(lines[starts[i]:end])
+        is_import = isinstance(node, (ast.Import, ast.ImportFrom))
+        if is_import and prev_is_import:
+            result[-1] += text
+        else:
+            result.append(text)
+        prev_is_import = is_import
+    return result
+
+
+def is_comment(line: str) -> bool:
+    return line.lstrip().startswith(COMMENT_PREFIXES)
+
+
+def strip_comments(line: str, in_block_comment: bool) -> tuple[str, bool]:
+    # Returns the code part of the line, and whether a block comment is still open
+    if in_block_comment:
+        end = line.find('*/')
+        if end < 0:
+            return '', True
+        line = line[end + 2:]
+
+    line = BLOCK_COMMENT_PATTERN.sub('', STRING_PATTERN.sub('', line))
+    start = line.find('/*')
+    if start >= 0:
+        return line[:start], True
+    return LINE_COMMENT_PATTERN.sub('', line), False
+
+
+def split_brace_units(code: str) -> list[str]:
+    """Split code of brace or indent based languages into top level units.
+
+    A unit starts at a line without indentation outside of any bracket. Comments
+    and decorators are kept together with the declaration that follows them.
+    """
+    lines = code.splitlines(keepends=True)
+    starts = []
+    depth = 0
+    attach_next = False
+    in_block_comment = False
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if depth == 0 and not in_block_comment and stripped and not line[0].isspace() and stripped[0] not in CLOSE_BRACKETS:
+            if not attach_next:
+                starts.append(i)
+            attach_next = is_comment(line)
+
+        code_line, in_block_comment = strip_comments(stripped, in_block_comment)
+        for c in code_line:
+            if c in OPEN_BRACKETS:
+                depth += 1
+            elif c in CLOSE_BRACKETS:
+                depth = max(0, depth - 1)
+
+    if not starts:
+        return [code] if code else []
+
+    starts[0] = 0
+    starts.append(len(lines))
+    return [''.join(lines[starts[i]:starts[i + 1]]) for i in range(len(starts) - 1)]
+
+
+def split_units(code: str, path: str) -> list[str]:
+    if os.path.splitext(path)[1].lower() in ('.py', '.pyw', '.pyi'):
+        units = split_python_units(code)
+        if units is not None:
+            return units
+    return split_brace_units(code)
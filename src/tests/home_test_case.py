@@ -0,0 +1,20 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+
+class HomeTestCase(unittest.TestCase):
+    """Runs every test with HOME set to a new temporary directory.
+
+    Caches, stores and configs are saved under the home directory, so tests never
+    touch the real one. The environment is restored after the tearDown of subclasses,
+    every variable set by a test is reverted too.
+    """
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.addCleanup(self.home.cleanup)
+        env = mock.patch.dict(os.environ, {'HOME': self.home.name})
+        env.start()
+        self.addCleanup(env.stop)
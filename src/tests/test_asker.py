@@ -0,0 +1,219 @@
+import re
+import threading
+import time
+import unittest
+from unittest import mock
+
+from asker import (MODEL_BUDGETS, Prompt, Trunk, ask_trunks, get_budget, get_trunk_key, group_answers, pack_units,
+                   reduce_answers, split_files, split_pieces)
+from cache import TrunkCache
+from home_test_case import HomeTestCase
+
+
+def to_pieces(text: str) -> list[bytes]:
+    return [p.encode('utf-8') for p in re.findall(r'\n+|[^\S\n]+|\w+|[^\w\s]', text)]
+
+
+class FakeEncoder:
+    """Tokens are the pieces of to_pieces, so no tokenizer data is needed."""
+
+    def __init__(self) -> None:
+        self.pieces = []
+        self.batches = 0
+
+    def encode(self, text: str) -> list[int]:
+        result = []
+        for piece in to_pieces(text):
+            result.append(len(self.pieces))
+            self.pieces.append(piece)
+        return result
+
+    def encode_batch(self, texts: list[str]) -> list[list[int]]:
+        self.batches += 1
+        return [self.encode(text) for text in texts]
+
+    def decode_tokens_bytes(self, tokens: list[int]) -> list[bytes]:
+        return [self.pieces[t] for t in tokens]
+
+
+class TestSplitPieces(unittest.TestCase):
+    def test_single_trunk(self):
+        trunks = split_pieces(to_pieces('a = 1\nb = 2\n'))
+        self.assertEqual(len(trunks), 1)
+        self.assertEqual(trunks[0].text, 'a = 1\nb = 2\n')
+
+    def test_keeps_content_and_budgets(self):
+        text = ''.join(f'line_{i} = {i} # 中文注释\n' for i in range(200))
+        pieces = to_pieces(text)
+        trunks = split_pieces(pieces, token_size=100, str_size=300)
+        self.assertEqual(''.join(t.text for t in trunks), text)
+        self.assertEqual(sum(t.token_count for t in trunks), len(pieces))
+        for trunk in trunks:
+            self.assertLessEqual(trunk.token_count, 100)
+            self.assertLessEqual(len(trunk.text), 300)
+            self.assertTrue(trunk.text.endswith('\n'))
+
+    def test_prefers_blank_line(self):
+        text = 'a = 1\nb = 2\n\nc = 3\nd = 4\n'
+        trunks = split_pieces(to_pieces(text), token_size=20)
+        self.assertEqual(trunks[0].text, 'a = 1\nb = 2\n\n')
+
+    def test_never_splits_utf8_sequence(self):
+        data = '中文'.encode('utf-8')
+        pieces = [data[:2], data[2:4], data[4:]]
+        trunks = split_pieces(pieces, token_size=2)
+        self.assertEqual(''.join(t.text for t in trunks), '中文')
+        self.assertNotIn('�', ''.join(t.text for t in trunks))
+
+
+class TestPackUnits(unittest.TestCase):
+    def test_pack_units(self):
+        units = ['import a\n', 'def f():\n    pass\n', 'x' * 30 + '\n', 'def g():\n    pass\n']
+        token_counts = [3000, 1500, 1500, 1000]
+        split_unit = lambda i: [Trunk(units[i][:2], 1500), Trunk(units[i][2:], 1500)]
+        trunks = pack_units(units, token_counts, split_unit)
+        self.assertEqual([t.token_count for t in trunks], [1500, 1500, 1500, 2500])
+        self.assertEqual(''.join(t.text for t in trunks), ''.join(units))
+
+
+class TestSplitFiles(unittest.TestCase):
+    def test_budgets(self):
+        self.assertGreater(get_budget('gpt-4').token_size, get_budget('text-davinci-002-render-sha').token_size)
+        self.assertIs(get_budget('unknown'), MODEL_BUDGETS['gpt-3.5-turbo'])
+
+    def test_batch(self):
+        encoder = FakeEncoder()
+        codes = ['a = 1\n' * 1000, 'def f():\n    pass\n\n\ndef g():\n    pass\n']
+        with mock.patch('asker.get_encoder', return_value=encoder):
+            by_token = split_files('text-davinci-002-render-sha', codes)
+            by_syntax = split_files('gpt-4', codes, ['a.py', 'b.py'])
+        self.assertEqual(encoder.batches, 2)
+
+        for splits in [by_token, by_syntax]:
+            self.assertEqual([''.join(t.text for t in trunks) for trunks, _ in splits], codes)
+            self.assertEqual([count for _, count in splits], [6000, len(to_pieces(codes[1]))])
+        # gpt-4 gets larger trunks, so fewer of them
+        self.assertEqual([len(trunks) for trunks, _ in by_token], [3, 1])
+        self.assertEqual([len(trunks) for trunks, _ in by_syntax], [2, 1])
+
+
+class FakeBot:
+    """Answers every ask with the count of the lines it was sent."""
+
+    def __init__(self, fan_in: int) -> None:
+        self.config = {'model': 'gpt-3.5-turbo', 'reduce_fan_in': fan_in}
+        self.asks = []
+
+    def ask(self, text: str):
+        self.asks.append(text)
+        answer = f'{text.count(chr(10)) + 1} lines'
+        yield {'message': answer, 'delta': answer}
+
+
+class TestReduce(unittest.TestCase):
+    def test_group_answers(self):
+        self.assertEqual(group_answers(['a'] * 5, [1] * 5, fan_in=2), [['a', 'a'], ['a', 'a', 'a']])
+        self.assertEqual(group_answers(['a'] * 5, [1] * 5, fan_in=8), [['a'] * 5])
+        # Over the budget, but two answers are still grouped so the reduce progresses
+        self.assertEqual(group_answers(['a' * 100] * 4, [1] * 4, str_size=50), [['a' * 100] * 2, ['a' * 100] * 2])
+        self.assertEqual(group_answers(['a'] * 4, [2, 2, 2, 2], token_size=4), [['a', 'a'], ['a', 'a']])
+
+    def reduce(self, bot: 'FakeBot', texts: list[str], prompt: Prompt, encoder=None) -> str:
+        with mock.patch('asker.get_encoder', return_value=encoder or FakeEncoder()), mock.patch('builtins.print'):
+            return reduce_answers(bot, texts, prompt, 1)  # type: ignore
+
+    def test_tree_reduce(self):
+        bot = FakeBot(fan_in=3)
+        prompt = Prompt('first', 'next', 'multi:', 'single', 'partial:')
+        result = self.reduce(bot, [f'answer {i}' for i in range(9)], prompt)
+
+        # 9 answers in 3 groups of 3, then the final summary of the 3 group summaries
+        self.assertEqual([text.split(':')[0] for text in bot.asks], ['partial'] * 3 + ['multi'])
+        self.assertEqual(result, '3 lines')
+
+    def test_single_round(self):
+        bot = FakeBot(fan_in=8)
+        prompt = Prompt('first', 'next', 'multi:', 'single')
+        self.reduce(bot, ['a', 'b', 'c'], prompt)
+        self.assertEqual(bot.asks, ['multi:a\nb\nc'])
+
+    def test_exact_token_counts(self):
+        # Every answer is 900 tokens for the encoder, 3 of them fill the budget of a group
+        encoder = FakeEncoder()
+        encoder.encode = lambda text: [0] * (900 if text.startswith('answer') else 1)  # type: ignore
+        bot = FakeBot(fan_in=8)
+        prompt = Prompt('first', 'next', 'multi:', 'single', 'partial:')
+        self.reduce(bot, [f'answer {i}' for i in range(6)], prompt, encoder)
+        self.assertEqual([text.split(':')[0] for text in bot.asks], ['partial'] * 2 + ['multi'])
+
+
+class EchoBot:
+    """Answers every ask with the text it was sent, the later trunks are answered first."""
+
+    def __init__(self, asks: list[str]) -> None:
+        self.config = {'model': 'gpt-3.5-turbo', 'language': 'english'}
+        self.session = None
+        self.conversation_id = None
+        self.asks = asks
+        self.lock = threading.Lock()
+
+    def ask(self, text: str):
+        with self.lock:
+            self.asks.append(text)
+        # 'first:trunk N' or 'next:trunk N', the higher N the shorter the wait
+        time.sleep(0.01 * (10 - int(text.split()[-1])))
+        yield {'message': f'answer {text}', 'delta': ''}
+
+
+class TestAskTrunks(HomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.asks = []
+        self.bot = EchoBot(self.asks)
+        self.prompt = Prompt('first:', 'next:', 'multi:', 'single:')
+        self.trunks = [Trunk(f'trunk {i}', 1) for i in range(6)]
+
+    def ask(self, jobs: int, cache: TrunkCache | None = None) -> list[str]:
+        # Every parallel trunk is asked by a new chatbot
+        with mock.patch('asker.create_chatbot', lambda *args: EchoBot(self.asks)), mock.patch('builtins.print'):
+            return ask_trunks(self.bot, self.trunks, self.prompt, jobs, cache, stream=False)  # type: ignore
+
+    def next_prompt(self, jobs: int) -> str:
+        return self.prompt.trunk_next if jobs <= 1 else self.prompt.trunk_first
+
+    def test_order(self):
+        for jobs in [1, 4]:
+            self.asks.clear()
+            result = self.ask(jobs)
+            next = self.next_prompt(jobs)
+            self.assertEqual(result, ['answer first:trunk 0'] + [f'answer {next}trunk {i}' for i in range(1, 6)])
+            self.assertEqual(len(self.asks), 6)
+
+    def test_parallel_prompts(self):
+        # Every trunk is asked in its own conversation, none of them is a follow-up
+        self.ask(jobs=4)
+        self.assertEqual(sorted(self.asks), [f'first:trunk {i}' for i in range(6)])
+
+        self.asks.clear()
+        self.ask(jobs=1)
+        self.assertEqual(self.asks, ['first:trunk 0'] + [f'next:trunk {i}' for i in range(1, 6)])
+
+    def test_cache(self):
+        for jobs in [1, 4]:
+            cache = TrunkCache(f'test_{jobs}')
+            next = self.next_prompt(jobs)
+            for i in [0, 2, 3]:
+                prompt = self.prompt.trunk_first if i == 0 else next
+                cache.write(get_trunk_key(self.bot.config, prompt, self.trunks[i]), f'cached {i}')
+
+            self.asks.clear()
+            expected = ['cached 0', f'answer {next}trunk 1', 'cached 2', 'cached 3', f'answer {next}trunk 4',
+                        f'answer {next}trunk 5']
+            self.assertEqual(self.ask(jobs, cache), expected)
+            self.assertEqual(sorted(self.asks), [f'{next}trunk 1', f'{next}trunk 4', f'{next}trunk 5'])
+
+            # The answers were written back, nothing is asked again
+            self.asks.clear()
+            self.assertEqual(self.ask(jobs, cache), expected)
+            self.assertEqual(self.asks, [])
+            cache.flush()
@@ -0,0 +1,137 @@
+import os
+import time
+from unittest import mock
+
+from cache import Cache, TrunkCache
+from home_test_case import HomeTestCase
+
+
+class TestCache(HomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.home.name, 'code.py')
+        with open(self.path, 'w') as f:
+            f.write('print(1)\n')
+
+    def test_fresh_by_content(self):
+        meta = {'model': 'gpt-4', 'language': 'english', 'prompt_version': '1'}
+        written = Cache('test')
+        written.write(self.path, 'explain', meta)
+        written.flush()
+
+        cache = Cache('test')
+        self.assertEqual(cache.read(self.path, meta), 'explain')
+        self.assertIsNone(cache.read(self.path, {**meta, 'model': 'other'}))
+
+        # Same content with a new mtime is still fresh
+        os.utime(self.path, (0, 0))
+        self.assertEqual(cache.read(self.path, meta), 'explain')
+
+        with open(self.path, 'w') as f:
+            f.write('print(2)\n')
+        self.assertIsNone(cache.read(self.path, meta))
+        cache.flush()
+
+    def test_evict_least_recently_used(self):
+        cache = TrunkCache('test', max_bytes=25)
+        keys = [cache.get_key('p', 'm', 'l', str(i)) for i in range(3)]
+        for i, key in enumerate(keys):
+            cache.write(key, str(i) * 10)
+            cache.index[key] = {**cache.index[key], 'used': i}
+
+        cache.write(cache.get_key('p', 'm', 'l', '3'), '3' * 10)
+        self.assertIsNone(cache.read(keys[0]))
+        self.assertIsNone(cache.read(keys[1]))
+        self.assertEqual(cache.read(keys[2]), '2' * 10)
+        cache.flush()
+        self.assertEqual(TrunkCache('test').total_bytes, 20)
+
+    def test_truncated_index(self):
+        cache = TrunkCache('test')
+        key = cache.get_key('p', 'm', 'l', 't')
+        cache.write(key, 'answer')
+        cache.flush()
+        with open(cache.index.path, 'r+') as f:
+            f.truncate(10)
+
+        # The entries are forgotten, the cache still works
+        cache = TrunkCache('test')
+        self.assertEqual(len(cache), 0)
+        cache.write(key, 'answer')
+        cache.flush()
+        self.assertEqual(TrunkCache('test').read(key), 'answer')
+        self.assertEqual([n for n in os.listdir(os.path.dirname(cache.index.path)) if n.endswith('.tmp')], [])
+
+    def test_index_saved_in_batches(self):
+        cache = TrunkCache('test', max_bytes=1000, max_age_days=90)
+        with mock.patch.object(cache.index, 'save', wraps=cache.index.save) as save, \
+                mock.patch.object(cache.index, 'items', wraps=cache.index.items) as items:
+            for i in range(50):
+                cache.write(cache.get_key('p', 'm', 'l', str(i)), str(i))
+            # Neither rewritten nor scanned on every write
+            save.assert_not_called()
+            items.assert_not_called()
+            cache.flush()
+            save.assert_called_once()
+        self.assertEqual(len(TrunkCache('test')), 50)
+
+    def test_evict_expired(self):
+        cache = TrunkCache('test', max_age_days=1)
+        old_key = cache.get_key('p', 'm', 'l', 'old')
+        cache.write(old_key, 'old')
+        cache.index[old_key] = {**cache.index[old_key], 'used': time.time() - 2 * 24 * 3600}
+        cache.flush()
+
+        # The oldest entry is known when loading, so the next write evicts it
+        cache = TrunkCache('test', max_age_days=1)
+        cache.write(cache.get_key('p', 'm', 'l', 'new'), 'new')
+        cache.flush()
+        self.assertIsNone(cache.read(old_key))
+        self.assertEqual(len(cache), 1)
+
+    def test_concurrent_saves_merged(self):
+        first = TrunkCache('test')
+        second = TrunkCache('test')
+        keys = [first.get_key('p', 'm', 'l', str(i)) for i in range(3)]
+        first.write(keys[0], 'first')
+        first.write(keys[1], 'second')
+        first.flush()
+        second.write(keys[2], 'third')
+        second.flush()
+
+        # Neither process overwrites the entries of the other one
+        cache = TrunkCache('test')
+        self.assertEqual(sorted(key for key, _ in cache.index.items()), sorted(keys))
+        self.assertEqual(cache.total_bytes, len('firstsecondthird'))
+
+        # Entries removed by a process are not restored by the other one
+        self.assertEqual(first.prune(max_bytes=len('firstsecondthird') - 1, max_age_days=0), (1, len('first')))
+        second.write(keys[2], 'third')
+        second.flush()
+        self.assertEqual(sorted(key for key, _ in TrunkCache('test').index.items()), sorted(keys[1:]))
+
+    def test_reconcile_untracked_files(self):
+        # Left by a run killed before it saved the index
+        trunks = TrunkCache('test')
+        key = trunks.get_key('p', 'm', 'l', 't')
+        os.makedirs(os.path.dirname(trunks.get_cache_path(key)))
+        with open(trunks.get_cache_path(key), 'w') as f:
+            f.write('answer')
+        files = Cache('test')
+        orphan = files.get_cache_path(self.path)
+        with open(orphan, 'w') as f:
+            f.write('explain')
+        gone = trunks.get_key('p', 'm', 'l', 'gone')
+        trunks.index[gone] = {'bytes': 100, 'used': time.time()}
+        trunks.total_bytes += 100
+
+        self.assertEqual(trunks.reconcile(), 1)
+        self.assertEqual(files.reconcile(), 1)
+        # The trunk is indexed and counted, the file whose key is unknown is removed,
+        # and so is the entry whose file is gone
+        self.assertEqual([k for k, _ in TrunkCache('test').index.items()], [key])
+        self.assertEqual(trunks.total_bytes, len('answer'))
+        self.assertFalse(os.path.exists(orphan))
+
+        self.assertEqual(trunks.prune(max_bytes=1, max_age_days=0), (1, len('answer')))
+        self.assertEqual(len(TrunkCache('test')), 0)
@@ -0,0 +1,68 @@
+import asyncio
+import os
+from unittest import mock
+
+from prompt_toolkit import PromptSession
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+
+from cli import ChatbotCli
+from home_test_case import HomeTestCase
+
+
+class TestAsyncCli(HomeTestCase):
+    def setUp(self):
+        super().setUp()
+        config = {'access_token': 'token', 'model': 'gpt-3.5-turbo', 'auto_export': False,
+                  'export_dir': os.path.join(self.home.name, 'export'), 'render_mode': 'plain', 'render_fps': 10}
+        self.cli = ChatbotCli(config, use_async=True)
+        self.chatbot = self.cli._ChatbotCli__chatbot # type: ignore
+        self.async_chatbot = self.cli._ChatbotCli__async_chatbot # type: ignore
+        self.store = self.cli._ChatbotCli__store # type: ignore
+        self.store.save_conversation({'id': 'c0', 'title': 'title 0'})
+
+    def tearDown(self):
+        asyncio.run(self.async_chatbot.session.aclose())
+        self.store.close()
+
+    def run_command(self, command: str, answer: str) -> mock.MagicMock:
+        async def run():
+            return self.cli._ChatbotCli__commands.handle(command) # type: ignore
+
+        # A real prompt, reading the answer from a pipe
+        with create_pipe_input() as pipe:
+            pipe.send_text(answer + '\n')
+            get_input = lambda: PromptSession(input=pipe, output=DummyOutput()).prompt()
+            with mock.patch('revChatGPT.utils.get_input', get_input), mock.patch('builtins.print'), \
+                    mock.patch.object(self.chatbot, 'clear_conversations') as clear:
+                self.assertTrue(asyncio.run(run()))
+        return clear
+
+    def test_confirm_in_event_loop(self):
+        clear = self.run_command('.delete_all', 'n')
+        clear.assert_not_called()
+        self.assertFalse(self.store.is_empty())
+
+        clear = self.run_command('.delete_all', 'y')
+        clear.assert_called_once()
+        self.assertTrue(self.store.is_empty())
+
+    def test_title_generated_once(self):
+        titles = []
+
+        async def gen_title(cid, message_id):
+            await asyncio.sleep(0.01)
+            titles.append(cid)
+            return 'new title'
+
+        async def run():
+            # The tasks of two answers in a row of a new conversation
+            after_ask = self.cli._ChatbotCli__after_ask_async # type: ignore
+            await asyncio.gather(after_ask('c1', 'm1'), after_ask('c1', 'm2'))
+
+        with mock.patch.object(self.async_chatbot, 'gen_title', gen_title), mock.patch('builtins.print'):
+            asyncio.run(run())
+        self.assertEqual(titles, ['c1'])
+        self.assertEqual(self.store.get_conversation('c1')['title'], 'new title')
+        cache = self.cli._ChatbotCli__get_cache() # type: ignore
+        self.assertEqual(cache.get_title(cache.get_index('c1')), 'new title')
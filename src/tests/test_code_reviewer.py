@@ -0,0 +1,79 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from code_reviewer import gen_patch, open_repo
+
+
+def git(cwd: str, *args: str) -> None:
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args], cwd=cwd,
+                   check=True, capture_output=True)
+
+
+def write(root: str, name: str, content: str) -> None:
+    with open(os.path.join(root, name), 'w') as f:
+        f.write(content)
+
+
+class TestGenPatch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+        git(self.root, 'init', '-q')
+        write(self.root, 'a.py', 'a = 1\n')
+        write(self.root, 'b.py', 'b = 1\n')
+        git(self.root, 'add', '.')
+        git(self.root, 'commit', '-q', '-m', 'Initial commit')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def gen_patch(self) -> str:
+        repo = open_repo(self.root)
+        try:
+            return gen_patch(repo, os.path.join(self.root, 'a.py'))
+        finally:
+            repo.close()
+
+    def test_root_commit(self):
+        patch = self.gen_patch()
+        self.assertIn('Subject: [PATCH] Initial commit', patch)
+        self.assertIn('diff --git a/a.py b/a.py\nnew file\n--- /dev/null\n+++ b/a.py', patch)
+        self.assertIn('+a = 1', patch)
+        self.assertIn('+b = 1', patch)
+
+    def test_last_commit(self):
+        write(self.root, 'a.py', 'a = 2\n')
+        git(self.root, 'commit', '-q', '-am', 'Change a')
+        patch = self.gen_patch()
+        self.assertIn('Subject: [PATCH] Change a', patch)
+        self.assertIn('--- a/a.py\n+++ b/a.py', patch)
+        self.assertIn('-a = 1', patch)
+        self.assertIn('+a = 2', patch)
+        self.assertNotIn('b.py', patch)
+
+    def test_uncommitted(self):
+        # Staged, unstaged, untracked and deleted files are all in the patch
+        write(self.root, 'a.py', 'a = 2\n')
+        git(self.root, 'add', 'a.py')
+        write(self.root, 'a.py', 'a = 3\n')
+        os.remove(os.path.join(self.root, 'b.py'))
+        write(self.root, 'c.py', 'c = 1\n')
+        patch = self.gen_patch()
+
+        self.assertNotIn('Subject:', patch)
+        self.assertIn('-a = 1', patch)
+        self.assertIn('+a = 3', patch)
+        self.assertNotIn('+a = 2', patch)
+        self.assertIn('diff --git a/b.py b/b.py\ndeleted file\n--- a/b.py\n+++ /dev/null', patch)
+        self.assertIn('-b = 1', patch)
+        self.assertIn('diff --git a/c.py b/c.py\nnew file\n--- /dev/null\n+++ b/c.py\n@@ -0,0 +1,1 @@\n+c = 1\n', patch)
+
+    def test_staged_only(self):
+        write(self.root, 'b.py', 'b = 2\n')
+        git(self.root, 'add', 'b.py')
+        patch = self.gen_patch()
+        self.assertIn('-b = 1', patch)
+        self.assertIn('+b = 2', patch)
+        self.assertNotIn('a.py', patch)
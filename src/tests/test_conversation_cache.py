@@ -0,0 +1,78 @@
+import random
+import unittest
+
+from conversation_cache import ConversationCache
+
+CONVERSATIONS = [{'id': f'c{i}', 'title': f'title {i}'} for i in range(25)]
+
+
+class TestConversationCache(unittest.TestCase):
+    def create_cache(self):
+        self.loaded = []
+
+        def load_page(last, limit):
+            offset = 0 if last is None else CONVERSATIONS.index(last) + 1
+            self.loaded.append(offset)
+            return CONVERSATIONS[offset:offset + limit]
+
+        return ConversationCache(load_page=load_page, page_size=10)
+
+    def test_lazy_paging(self):
+        cache = self.create_cache()
+        self.assertEqual(cache.get_title(3), 'title 3')
+        self.assertEqual(self.loaded, [0])
+        self.assertEqual(cache.get_index('c15'), 15)
+        self.assertEqual(self.loaded, [0, 10])
+        self.assertEqual(len(cache), 25)
+        self.assertFalse(cache.exist(25))
+        self.assertEqual(cache.get_index('missing'), -1)
+
+    def test_add_and_delete(self):
+        cache = self.create_cache()
+        cache.add({'id': 'new1', 'title': 'new 1'})
+        cache.add({'id': 'new2', 'title': 'new 2'})
+        self.assertEqual(cache.get_index('new2'), 0)
+        self.assertEqual(cache.get_index('new1'), 1)
+        self.assertEqual(cache.get_index('c0'), 2)
+
+        cache.delete(1)
+        cache.delete(cache.get_index('c0'))
+        self.assertEqual(cache.get_cid(1), 'c1')
+        self.assertEqual(cache.get_index('c1'), 1)
+        self.assertEqual(cache.get_index('new1'), -1)
+        self.assertEqual(len(cache), 25)
+        self.assertEqual(cache.titles()[:3], ['new 2', 'title 1', 'title 2'])
+
+    def test_set_title(self):
+        cache = ConversationCache([{'id': 'a', 'title': 'a'}])
+        cache.set_title(cache.get_index('a'), 'b')
+        self.assertEqual(cache.titles(), ['b'])
+        self.assertIsNone(cache[1])
+
+
+    def test_random_operations(self):
+        # Compared with a plain list of the conversations from the most recent one
+        rng = random.Random(0)
+        cache = self.create_cache()
+        expected = list(CONVERSATIONS)
+        for i in range(300):
+            op = rng.random()
+            if op < 0.3:
+                conv = {'id': f'n{i}', 'title': f'new {i}'}
+                cache.add(conv)
+                expected.insert(0, conv)
+            elif op < 0.6 and expected:
+                index = rng.randrange(len(expected))
+                cache.delete(index)
+                del expected[index]
+            else:
+                index = rng.randrange(len(expected) + 1)
+                self.assertEqual(cache[index], expected[index] if index < len(expected) else None)
+                if index < len(expected):
+                    self.assertEqual(cache.get_index(expected[index]['id']), index)
+        self.assertEqual(cache.titles(), [conv['title'] for conv in expected])
+        self.assertEqual(len(cache), len(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
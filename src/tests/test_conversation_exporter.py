@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from conversation_exporter import ConversationExporter
+from conversation_store import ConversationStore
+
+
+def create_history(cid: str) -> dict:
+    return {'mapping': {
+        '1': {'message': {'author': {'role': 'user'}, 'content': {'content_type': 'text', 'parts': [f'question {cid}']}}},
+        '2': {'message': {'author': {'role': 'assistant'}, 'content': {'content_type': 'text', 'parts': [f'answer {cid}']}}},
+    }}
+
+
+class TestConversationExporter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = ConversationStore(':memory:')
+        self.chatbot = mock.Mock()
+        self.chatbot.get_msg_history.side_effect = lambda cid, encoding=None: create_history(cid)
+        for i in range(5):
+            self.store.save_conversation({'id': f'c{i}', 'title': f'title {i}', 'update_time': f'2023-01-0{i + 1}'})
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def create_exporter(self):
+        return ConversationExporter(self.dir.name, self.chatbot, self.store)
+
+    def test_export_all(self):
+        exporter = self.create_exporter()
+        self.assertEqual(exporter.export_all(self.store.list_conversations(), jobs=3), (5, 0, 0))
+        with open(os.path.join(self.dir.name, 'title 2.md'), encoding='utf8') as f:
+            self.assertEqual(f.read(), '# title 2\n\nYou:\nquestion c2\n\nChatGPT:\nanswer c2\n\n')
+
+        # The manifest is kept next to the exported files
+        exporter = self.create_exporter()
+        self.assertNotIn('.export_manifest', exporter.all_titles)
+        self.store.save_conversation({'id': 'c1', 'title': 'title 1', 'update_time': '2023-02-01'})
+        self.assertEqual(exporter.export_all(self.store.list_conversations()), (1, 4, 0))
+        self.assertEqual(exporter.export_all(self.store.list_conversations(), force=True), (5, 0, 0))
+
+    def test_title_index(self):
+        with open(os.path.join(self.dir.name, 'old.md'), 'w') as f:
+            f.write('# old')
+        exporter = self.create_exporter()
+        exporter.index_in_background()
+        self.assertEqual(exporter.all_titles, ['old'])
+
+        exporter.export('c1', 'title 1')
+        exporter.rename('c1', 'title 1', 'renamed')
+        exporter.delete('old')
+        self.assertEqual(exporter.all_titles, ['renamed'])
+        self.assertTrue(exporter.has_conversation('renamed'))
+        self.assertFalse(exporter.has_conversation('title 1'))
+
+    def test_failed_history(self):
+        fetched = []
+
+        def get_msg_history(cid, encoding=None):
+            fetched.append(cid)
+            return {} if cid == 'c3' else create_history(cid)
+
+        self.chatbot.get_msg_history.side_effect = get_msg_history
+        exporter = self.create_exporter()
+        with mock.patch('builtins.print'):
+            self.assertEqual(exporter.export_all(self.store.list_conversations()), (4, 0, 1))
+            # No partial file is left, and the bad history is not kept in the store
+            self.assertFalse(os.path.exists(os.path.join(self.dir.name, 'title 3.md')))
+            self.assertEqual(exporter.export_all(self.store.list_conversations()), (0, 4, 1))
+            self.assertEqual(fetched.count('c3'), 2)
+
+            self.chatbot.get_msg_history.side_effect = lambda cid, encoding=None: create_history(cid)
+            self.assertEqual(exporter.export_all(self.store.list_conversations()), (1, 4, 0))
+        self.assertEqual(sorted(os.listdir(self.dir.name)),
+                         ['.export_manifest.json'] + [f'title {i}.md' for i in range(5)])
+
+    def test_failed_export_keeps_file(self):
+        path = os.path.join(self.dir.name, 'title 1.md')
+        with open(path, 'w', encoding='utf8') as f:
+            f.write('# title 1\n\nprevious export')
+        self.chatbot.get_msg_history.side_effect = lambda cid, encoding=None: {}
+        exporter = self.create_exporter()
+        with mock.patch('builtins.print'), self.assertRaises(Exception):
+            exporter.export('c1', 'title 1')
+        with open(path, encoding='utf8') as f:
+            self.assertEqual(f.read(), '# title 1\n\nprevious export')
+
+
+if __name__ == '__main__':
+    unittest.main()
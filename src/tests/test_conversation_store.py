@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+from conversation_store import ConversationStore
+
+
+def create_conversations(count: int, update_time: str = '2023-01-01') -> list[dict]:
+    return [{'id': f'c{i}', 'title': f'title {i}', 'update_time': f'{update_time}T00:00:{59 - i:02}'} for i in range(count)]
+
+
+def create_chatbot(conversations: list[dict]) -> mock.Mock:
+    bot = mock.Mock()
+    bot.iter_conversations.side_effect = lambda encoding=None: iter([conversations[i:i + 10] for i in range(0, len(conversations), 10)])
+    bot.get_msg_history.side_effect = lambda cid, encoding=None: {'title': cid, 'mapping': {}}
+    return bot
+
+
+class TestConversationStore(unittest.TestCase):
+    def setUp(self):
+        self.store = ConversationStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_sync(self):
+        conversations = create_conversations(25)
+        bot = create_chatbot(conversations)
+        self.assertEqual(self.store.sync(bot), 25)
+        self.assertEqual([c['id'] for c in self.store.list_conversations()], [c['id'] for c in conversations])
+
+        self.assertEqual(self.store.sync(bot), 0)
+
+        conversations[0]['update_time'] = '2023-02-01T00:00:00'
+        self.assertEqual(self.store.sync(bot), 1)
+
+    def test_full_sync_removes_deleted(self):
+        conversations = create_conversations(5)
+        self.store.sync(create_chatbot(conversations))
+        self.assertEqual(self.store.sync(create_chatbot(conversations[1:]), full=True), 1)
+        self.assertIsNone(self.store.get_conversation('c0'))
+
+    def test_history_is_read_locally_until_changed(self):
+        conversations = create_conversations(3)
+        bot = create_chatbot(conversations)
+        self.store.sync(bot)
+
+        self.store.get_history(bot, 'c1')
+        self.store.get_history(bot, 'c1')
+        self.assertEqual(bot.get_msg_history.call_count, 1)
+
+        conversations[1]['update_time'] = '2023-02-01T00:00:00'
+        self.store.sync(bot)
+        self.store.get_history(bot, 'c1')
+        self.assertEqual(bot.get_msg_history.call_count, 2)
+
+        self.store.invalidate('c1')
+        self.store.get_history(bot, 'c1')
+        self.assertEqual(bot.get_msg_history.call_count, 3)
+
+    def test_local_changes(self):
+        self.store.sync(create_chatbot(create_conversations(3)))
+        self.store.save_conversation({'id': 'new', 'title': 'new'})
+        self.store.set_title('c1', 'renamed')
+        self.store.delete_conversation('c2')
+        conversations = self.store.list_conversations()
+        self.assertEqual([c['id'] for c in conversations], ['new', 'c0', 'c1'])
+        self.assertEqual(conversations[2]['title'], 'renamed')
+
+
+if __name__ == '__main__':
+    unittest.main()
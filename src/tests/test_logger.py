@@ -0,0 +1,29 @@
+import unittest
+from unittest import mock
+
+from revChatGPT import V1
+
+
+def add(a, b):
+    """Add two numbers"""
+    return a + b
+
+
+class TestLogger(unittest.TestCase):
+    def test_disabled(self):
+        with mock.patch.object(V1, 'TRACE', False):
+            self.assertIs(V1.logger(is_timed=True)(add), add)
+
+    def test_trace_hook(self):
+        calls = []
+        with mock.patch.object(V1, 'TRACE', True), mock.patch.object(V1, 'trace_hooks', []):
+            V1.add_trace_hook(lambda name, seconds: calls.append(name))
+            traced = V1.logger(is_timed=True)(add)
+            self.assertEqual(traced.__name__, 'add')
+            self.assertEqual(traced.__doc__, 'Add two numbers')
+            self.assertEqual(traced(1, 2), 3)
+        self.assertEqual(calls, ['add'])
+
+
+if __name__ == '__main__':
+    unittest.main()
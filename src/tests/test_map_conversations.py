@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from home_test_case import HomeTestCase
+from revChatGPT.V1 import AsyncChatbot, Chatbot
+
+CONVERSATIONS = [{'id': f'c{i}', 'current_node': f'n{i}' if i % 2 else None} for i in range(25)]
+
+
+def get_conversations(offset=0, limit=20, encoding=None):
+    return CONVERSATIONS[offset:offset + limit]
+
+
+def get_msg_history(convo_id, encoding=None):
+    return {'current_node': 'n' + convo_id[1:]}
+
+
+class TestMapConversations(HomeTestCase):
+    def setUp(self):
+        # The chatbots save their config under the home directory
+        super().setUp()
+        self.bots = []
+
+    def tearDown(self):
+        for bot in self.bots:
+            if isinstance(bot, AsyncChatbot):
+                asyncio.run(bot.session.aclose())
+
+    def create_chatbot(self, cls, **config):
+        bot = cls({'access_token': 'token', **config})
+        self.bots.append(bot)
+        if cls is AsyncChatbot:
+            bot.get_conversations = mock.AsyncMock(side_effect=get_conversations)
+            bot.get_msg_history = mock.AsyncMock(side_effect=get_msg_history)
+        else:
+            bot.get_conversations = mock.Mock(side_effect=get_conversations)
+            bot.get_msg_history = mock.Mock(side_effect=get_msg_history)
+        return bot
+
+    def test_iter_conversations(self):
+        bot = self.create_chatbot(Chatbot)
+        pages = list(bot.iter_conversations(page_size=10))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+
+    def test_map_all(self):
+        bot = self.create_chatbot(Chatbot)
+        bot._Chatbot__map_conversations()
+        self.assertEqual(bot.conversation_mapping, {f'c{i}': f'n{i}' for i in range(25)})
+        self.assertEqual(bot.get_msg_history.call_count, 25)
+
+    def test_mapped_while_listing(self):
+        # The histories of the first page are mapped before the listing is over
+        bot = self.create_chatbot(Chatbot, map_conversations_jobs=3)
+        mapped_early = threading.Event()
+
+        def get_next_pages(offset=0, limit=20, encoding=None):
+            if offset > 0:
+                deadline = time.monotonic() + 5
+                while 'c0' not in bot.conversation_mapping and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                if 'c0' in bot.conversation_mapping:
+                    mapped_early.set()
+            return get_conversations(offset, limit)
+
+        bot.get_conversations.side_effect = get_next_pages
+        bot.iter_conversations = lambda: Chatbot.iter_conversations(bot, page_size=10)
+        bot._Chatbot__map_conversations()
+        self.assertTrue(mapped_early.is_set())
+        self.assertEqual(bot.conversation_mapping, {f'c{i}': f'n{i}' for i in range(25)})
+
+    def test_map_current_node_only(self):
+        bot = self.create_chatbot(Chatbot, map_current_node_only=True)
+        bot._Chatbot__map_conversations()
+        self.assertEqual(bot.conversation_mapping, {f'c{i}': f'n{i}' for i in range(25)})
+        self.assertEqual(bot.get_msg_history.call_count, 13)
+
+    def test_map_async(self):
+        bot = self.create_chatbot(AsyncChatbot, map_conversations_jobs=3)
+        asyncio.run(bot._AsyncChatbot__map_conversations())
+        self.assertEqual(bot.conversation_mapping, {f'c{i}': f'n{i}' for i in range(25)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from common import iter_messages
+
+
+def create_node(parent, role, text, content_type='text'):
+    return {'parent': parent, 'message': {'author': {'role': role}, 'content': {'content_type': content_type, 'parts': [text]}}}
+
+
+class TestMessages(unittest.TestCase):
+    def test_active_branch(self):
+        # The answer a1 was regenerated as a2, and the mapping is not in conversation order
+        mapping = {
+            'q2': create_node('a2', 'user', 'question 2'),
+            'a2': create_node('q1', 'assistant', 'answer 2'),
+            'root': {'parent': None},
+            'system': create_node('root', 'system', ' '),
+            'a1': create_node('q1', 'assistant', 'answer 1'),
+            'q1': create_node('system', 'user', 'question 1'),
+            'a3': create_node('q2', 'assistant', 'answer 3'),
+        }
+        history = {'mapping': mapping, 'current_node': 'a3'}
+        self.assertEqual(list(iter_messages(history)), [
+            ('user', 'question 1'),
+            ('assistant', 'answer 2'),
+            ('user', 'question 2'),
+            ('assistant', 'answer 3'),
+        ])
+
+    def test_without_current_node(self):
+        mapping = {
+            'q1': create_node(None, 'user', 'question'),
+            'code': create_node('q1', 'assistant', 'x = 1', 'code'),
+            'a1': create_node('code', 'assistant', 'answer'),
+        }
+        self.assertEqual(list(iter_messages({'mapping': mapping})), [('user', 'question'), ('assistant', 'answer')])
+
+
+if __name__ == '__main__':
+    unittest.main()
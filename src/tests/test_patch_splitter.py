@@ -0,0 +1,40 @@
+import unittest
+
+from patch_splitter import filter_patches, get_hunk_key, parse_patch
+
+PATCH = '''From 1234
+Subject: [PATCH] test
+
+diff --git a/src/a.py b/src/a.py
+--- a/src/a.py
++++ b/src/a.py
+@@ -1,2 +1,2 @@ def f():
+-    return 1
++    return 2
+@@ -10,1 +10,1 @@
+-x = 1
++x = 2
+diff --git a/package-lock.json b/package-lock.json
+--- a/package-lock.json
++++ b/package-lock.json
+@@ -1 +1 @@
+-{}
++{"a": 1}
+'''
+
+
+class TestPatchSplitter(unittest.TestCase):
+    def test_parse_patch(self):
+        patches = parse_patch(PATCH)
+        self.assertEqual([p.path for p in patches], ['src/a.py', 'package-lock.json'])
+        self.assertEqual(patches[0].header, 'diff --git a/src/a.py b/src/a.py\n--- a/src/a.py\n+++ b/src/a.py\n')
+        self.assertEqual(len(patches[0].hunks), 2)
+        self.assertEqual(patches[0].hunks[1], '@@ -10,1 +10,1 @@\n-x = 1\n+x = 2\n')
+
+    def test_filter_patches(self):
+        patches = filter_patches(parse_patch(PATCH), ['*.lock', 'package-lock.json'])
+        self.assertEqual([p.path for p in patches], ['src/a.py'])
+
+    def test_hunk_key_ignores_line_numbers(self):
+        self.assertEqual(get_hunk_key('@@ -10,1 +10,1 @@\n-x = 1\n'), get_hunk_key('@@ -12 +13 @@\n-x = 1\n'))
+        self.assertNotEqual(get_hunk_key('@@ -10,1 +10,1 @@\n-x = 1\n'), get_hunk_key('@@ -10,1 +10,1 @@\n-x = 2\n'))
@@ -1,6 +1,9 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
 
-from common import get_next_name, get_next_path_name
+from common import atomic_write, get_next_name, get_next_path_name
 
 
 class TestPath(unittest.TestCase):
@@ -12,3 +15,20 @@ class TestPath(unittest.TestCase):
     
     def test_get_next_path_name(self):
         self.assertEqual(get_next_path_name('hello.txt'), 'hello-1.txt')
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'sub', 'file.txt')
+            atomic_write(path, 'text')
+            atomic_write(path + '.bin', b'\x00data')
+            with open(path, encoding='utf8') as f:
+                self.assertEqual(f.read(), 'text')
+            with open(path + '.bin', 'rb') as f:
+                self.assertEqual(f.read(), b'\x00data')
+
+            # A failed write keeps the previous content and leaves no temporary file
+            with mock.patch('os.replace', side_effect=OSError('killed')), self.assertRaises(OSError):
+                atomic_write(path, 'new text')
+            with open(path, encoding='utf8') as f:
+                self.assertEqual(f.read(), 'text')
+            self.assertEqual(sorted(os.listdir(os.path.dirname(path))), ['file.txt', 'file.txt.bin'])
@@ -0,0 +1,110 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from retry import RetryExhausted, RetryPolicy, add_attempt_hook, attempt_hooks, classify, get_retry_after
+from revChatGPT.typings import AuthenticationError, Error, ErrorType
+
+
+class Flaky:
+    """Raises the errors in order, then returns 'ok'."""
+
+    def __init__(self, *errors: Exception) -> None:
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class TestClassify(unittest.TestCase):
+    def test_classify(self):
+        self.assertEqual(classify(Error('OpenAI', '', code=429)), 'rate_limit')
+        self.assertEqual(classify(Error('OpenAI', '', code=ErrorType.PROHIBITED_CONCURRENT_QUERY_ERROR)), 'rate_limit')
+        self.assertEqual(classify(Error('OpenAI', '', code=502)), 'server')
+        self.assertEqual(classify(Error('OpenAI', '', code=401)), 'auth')
+        self.assertEqual(classify(Error('cache', '', code=ErrorType.EXPIRED_ACCESS_TOKEN_ERROR)), 'auth')
+        self.assertEqual(classify(AuthenticationError('bad token')), 'auth')
+        self.assertEqual(classify(Error('User', '', code=ErrorType.USER_ERROR)), 'invalid')
+        self.assertEqual(classify(requests.ConnectionError()), 'network')
+        self.assertEqual(classify(ValueError()), 'unknown')
+
+    def test_retry_after(self):
+        self.assertEqual(get_retry_after(Error('OpenAI', '', code=429, retry_after='7')), 7)
+        self.assertIsNone(get_retry_after(Error('OpenAI', '', code=429)))
+        self.assertEqual(get_retry_after(Error('OpenAI', '', code=429, retry_after='Wed, 21 Oct 2015 07:28:00 GMT')), 0)
+
+
+@mock.patch('retry.time.sleep')
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.attempts = []
+        add_attempt_hook(self.attempts.append)
+
+    def tearDown(self):
+        attempt_hooks.remove(self.attempts.append)
+
+    def test_backoff(self, sleep):
+        func = Flaky(Error('OpenAI', '', code=502), requests.Timeout(), Error('OpenAI', '', code=503))
+        policy = RetryPolicy(max_attempts=5, max_delay=3)
+        self.assertEqual(policy.call(func, verbose=False), 'ok')
+        self.assertEqual(func.calls, 4)
+
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(delays), 3)
+        # Server errors wait up to 2s then 8s, capped by max_delay, network errors up to 2s
+        self.assertTrue(0 <= delays[0] <= 2 and 0 <= delays[1] <= 2 and 0 <= delays[2] <= 3)
+        self.assertEqual([a.error_class for a in self.attempts], ['server', 'network', 'server', None])
+
+    def test_fail_fast(self, sleep):
+        func = Flaky(Error('OpenAI', 'invalid token', code=401))
+        with self.assertRaises(RetryExhausted) as context:
+            RetryPolicy().call(func, verbose=False)
+        self.assertEqual(func.calls, 1)
+        self.assertEqual(context.exception.attempt.error_class, 'auth')
+        sleep.assert_not_called()
+
+    def test_retry_after(self, sleep):
+        func = Flaky(Error('OpenAI', '', code=429, retry_after='20'))
+        RetryPolicy(max_delay=1).call(func, verbose=False)
+        sleep.assert_called_once_with(20)
+
+    def test_deadline(self, sleep):
+        func = Flaky(Error('OpenAI', '', code=429, retry_after='40'))
+        with self.assertRaises(RetryExhausted):
+            RetryPolicy(deadline=30).call(func, verbose=False)
+        # The retry would start after the deadline
+        self.assertEqual(func.calls, 1)
+        sleep.assert_not_called()
+
+    def test_deadline_counts_waits_only(self, sleep):
+        # Attempts streaming for minutes before failing are still retried
+        clock = iter(range(0, 10000, 100))
+        func = Flaky(Error('OpenAI', '', code=502), Error('OpenAI', '', code=502))
+        with mock.patch('retry.time.monotonic', lambda: next(clock)):
+            self.assertEqual(RetryPolicy(deadline=60, max_delay=1).call(func, verbose=False), 'ok')
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+        # The waits add up to the deadline
+        func = Flaky(*[Error('OpenAI', '', code=429, retry_after='25')] * 3)
+        with self.assertRaises(RetryExhausted):
+            RetryPolicy(deadline=60).call(func, verbose=False)
+        self.assertEqual(func.calls, 3)
+
+    def test_max_attempts(self, sleep):
+        func = Flaky(*[ValueError('bad')] * 5)
+        with self.assertRaises(RetryExhausted) as context:
+            RetryPolicy(max_attempts=3).call(func, verbose=False)
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(context.exception.attempt.number, 3)
+
+    def test_interrupt(self, sleep):
+        func = Flaky(KeyboardInterrupt())
+        with self.assertRaises(KeyboardInterrupt):
+            RetryPolicy().call(func, verbose=False)
+        self.assertEqual(func.calls, 1)
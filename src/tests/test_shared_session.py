@@ -0,0 +1,63 @@
+import io
+import json
+import threading
+from unittest import mock
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from asker import Prompt, Trunk, ask_trunks, create_chatbot
+from home_test_case import HomeTestCase
+
+
+class FakeServer(BaseAdapter):
+    """Answers the requests of the chatbots, and records the Authorization header of every one."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.lock = threading.Lock()
+        self.authorizations = []
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.authorizations.append(request.headers.get('Authorization'))
+
+        body = b'{}'
+        if request.method == 'POST':
+            prompt = json.loads(request.body)['messages'][0]['content']['parts'][0]
+            event = {
+                'message': {'id': 'm', 'author': {'role': 'assistant'}, 'content': {'parts': [f'answer {prompt}']}},
+                'conversation_id': 'c',
+            }
+            body = f'data: {json.dumps(event)}\n\ndata: [DONE]\n\n'.encode()
+
+        response = requests.Response()
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict()
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+class TestSharedSession(HomeTestCase):
+    def test_parallel_asks(self):
+        server = FakeServer()
+        config = {'access_token': 'token', 'model': 'gpt-3.5-turbo', 'language': 'english'}
+        bot = create_chatbot(config, jobs=8)
+        bot.session.mount('https://', server)
+
+        # Every trunk is asked by a new chatbot on the shared session
+        trunks = [Trunk(f'trunk {i}', 1) for i in range(40)]
+        with mock.patch.object(bot.session.headers, 'clear', side_effect=AssertionError('headers cleared')), \
+                mock.patch('builtins.print'):
+            result = ask_trunks(bot, trunks, Prompt('first:', 'next:', 'multi:', 'single:'), 8, stream=False)
+
+        self.assertEqual(result, [f'answer first:trunk {i}' for i in range(40)])
+        # An ask and a delete per trunk, all of them authorized
+        self.assertEqual(len(server.authorizations), 80)
+        self.assertEqual(set(server.authorizations), {'Bearer token'})
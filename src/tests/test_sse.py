@@ -0,0 +1,20 @@
+import unittest
+
+from revChatGPT.sse import SSEDecoder
+
+
+class TestSSEDecoder(unittest.TestCase):
+    def test_split_chunks(self):
+        stream = 'data: {"a": "中文"}\r\n\r\n: comment\nevent: x\ndata: 1\ndata: 2\n\ndata: [DONE]\n\n'.encode('utf-8')
+        for size in [1, 3, len(stream)]:
+            decoder = SSEDecoder()
+            events = []
+            for i in range(0, len(stream), size):
+                events += decoder.feed(stream[i:i + size])
+            events += decoder.close()
+            self.assertEqual(events, ['{"a": "中文"}'.encode('utf-8'), b'1\n2', b'[DONE]'])
+
+    def test_close_without_blank_line(self):
+        decoder = SSEDecoder()
+        self.assertEqual(decoder.feed(b'Internal Server Error'), [])
+        self.assertEqual(decoder.close(), [b'Internal Server Error'])
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_MODULES = ['cli', 'code_explainer', 'code_reviewer', 'cache', 'tokenizer']
+HEAVY_MODULES = ['tiktoken', 'rich', 'git', 'prompt_toolkit', 'httpx', 'OpenAIAuth', 'async_tio', 'aiohttp']
+
+# Cumulative import time of an entry module measured by python -X importtime, in microseconds.
+# It is about 60ms for cli on a developer machine, the heavy modules alone took more than 500ms.
+IMPORT_TIME_BUDGET_US = 250000
+
+
+def import_module(name: str) -> tuple[list[str], int]:
+    """Import the module in a new interpreter, returns the heavy modules loaded and the import time."""
+    code = f'import sys, {name}; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=SRC_DIR,
+                            capture_output=True, text=True, check=True)
+    import_time = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == name:
+            import_time = int(fields[1])
+    loaded = result.stdout.strip()
+    return loaded.split(',') if loaded else [], import_time
+
+
+class TestStartup(unittest.TestCase):
+    def test_heavy_modules_are_lazy(self):
+        for name in ENTRY_MODULES:
+            loaded, _ = import_module(name)
+            self.assertEqual(loaded, [], f'{name} imports {loaded}')
+
+    def test_import_time_budget(self):
+        for name in ENTRY_MODULES:
+            # The best of a few runs, the first one may compile the modules
+            import_time = min(import_module(name)[1] for _ in range(3))
+            self.assertLess(import_time, IMPORT_TIME_BUDGET_US, f'{name} takes {import_time}us to import')
+
+
+if __name__ == '__main__':
+    unittest.main()
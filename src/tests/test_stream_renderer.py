@@ -0,0 +1,33 @@
+import unittest
+
+from stream_renderer import find_block_end
+
+
+class TestStreamRenderer(unittest.TestCase):
+    def test_no_complete_block(self):
+        self.assertEqual(find_block_end(''), 0)
+        self.assertEqual(find_block_end('# Title'), 0)
+        self.assertEqual(find_block_end('Some text\nmore text'), 0)
+
+    def test_paragraphs(self):
+        text = '# Title\n\nSome text\n\nmore'
+        end = find_block_end(text)
+        self.assertEqual(text[:end], '# Title\n\nSome text\n\n')
+
+    def test_blank_line_in_code_fence(self):
+        text = 'text\n\n```python\nprint(1)\n\nprint(2)\n'
+        end = find_block_end(text)
+        self.assertEqual(text[:end], 'text\n\n')
+
+    def test_closed_code_fence(self):
+        text = '```python\nprint(1)\n\nprint(2)\n```\nafter'
+        end = find_block_end(text)
+        self.assertEqual(text[:end], '```python\nprint(1)\n\nprint(2)\n```\n')
+
+    def test_unfinished_line(self):
+        text = 'text\n\n```'
+        self.assertEqual(find_block_end(text), len('text\n\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from syntax_splitter import split_units
+
+
+class TestSplitUnits(unittest.TestCase):
+    def test_python(self):
+        code = '"""doc"""\nimport os\nimport re\n\n# comment\n@dec\ndef f():\n    pass\n\n\nclass A:\n    x = 1\n'
+        units = split_units(code, 'a.py')
+        self.assertEqual(''.join(units), code)
+        self.assertEqual(units[1], 'import os\nimport re\n\n')
+        self.assertEqual(units[2], '# comment\n@dec\ndef f():\n    pass\n\n\n')
+        self.assertEqual(units[3], 'class A:\n    x = 1\n')
+
+    def test_python_comments(self):
+        code = 'x = 1\n\n# Helper\n# adds\ndef add():\n    return 1\n    # end of add\n\ny = 2\n'
+        units = split_units(code, 'a.py')
+        self.assertEqual(''.join(units), code)
+        self.assertEqual(units, ['x = 1\n\n', '# Helper\n# adds\ndef add():\n    return 1\n    # end of add\n\n', 'y = 2\n'])
+
+    def test_braces(self):
+        code = '''import a from 'a';
+
+/**
+ * Doc {
+ */
+@Component({
+  x: 1,
+})
+export class Foo {
+    bar() { /* { */
+    }
+}
+
+// helper
+function baz(s = "}") {
+    return 1;
+}
+'''
+        units = split_units(code, 'a.ts')
+        self.assertEqual(''.join(units), code)
+        self.assertEqual(len(units), 3)
+        self.assertTrue(units[1].startswith('/**'))
+        self.assertTrue(units[2].startswith('// helper'))
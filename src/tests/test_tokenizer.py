@@ -0,0 +1,127 @@
+import glob
+import hashlib
+import os
+import unittest
+from unittest import mock
+
+import tokenizer
+from asker import split_files
+from home_test_case import HomeTestCase
+from tokenizer import ApproximateEncoder, configure, ensure_installed, get_encoding, install, is_installed
+
+
+def estimate(text: str) -> int:
+    return len(ApproximateEncoder().encode(text))
+
+
+class TestEstimate(unittest.TestCase):
+    def test_pieces_cover_text(self):
+        encoder = ApproximateEncoder()
+        for text in ['def f(x):\n    return x + 1\n\n', '你好，世界 hello_world 12345', "it's _x__ ==\r\n\t", '']:
+            pieces = encoder.decode_tokens_bytes(encoder.encode(text))
+            self.assertEqual(b''.join(pieces).decode('utf-8'), text)
+
+    def test_estimate(self):
+        # The counts of cl100k_base: 'hello', ' world' and '   ', ' x', ' =', ' ', '123', '\n'
+        self.assertEqual(estimate('hello world'), 2)
+        self.assertEqual(estimate('    x = 123\n'), 6)
+        self.assertEqual(estimate("I'm here, don't worry."), 8)
+        # Long identifiers are split, every non ascii letter is a token
+        self.assertEqual(estimate(' get_encoding'), 3)
+        self.assertEqual(estimate('你好'), 2)
+
+    @unittest.skipUnless(is_installed('cl100k_base'), 'the tokenizer data of cl100k_base is not installed')
+    def test_calibrated(self):
+        # Close to the exact count on real code, the sources of this tool, and never much lower
+        import tiktoken
+
+        exact = tiktoken.get_encoding('cl100k_base')
+        for path in glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '*.py')):
+            with open(path, encoding='utf8') as f:
+                text = f.read()
+            ratio = estimate(text) / max(1, len(exact.encode(text)))
+            self.assertTrue(0.95 <= ratio <= 1.3, f'{path}: {ratio:.2f}')
+
+
+class TestTokenizerData(HomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = self.home
+        self.state = (tokenizer.tokenizer_dir, tokenizer.tokenizer_mode)
+
+    def tearDown(self):
+        tokenizer.tokenizer_dir, tokenizer.tokenizer_mode = self.state
+        get_encoding.cache_clear()
+
+    def test_configure(self):
+        configure({'tokenizer_dir': self.dir.name, 'tokenizer': 'unknown'})
+        self.assertEqual(os.environ['TIKTOKEN_CACHE_DIR'], self.dir.name)
+        self.assertEqual(tokenizer.tokenizer_mode, 'auto')
+
+    def test_auto_without_data(self):
+        # Estimated when the data is neither installed nor cached by tiktoken, nothing is downloaded
+        configure({'tokenizer_dir': self.dir.name, 'tokenizer': 'auto'})
+        self.assertFalse(is_installed('cl100k_base'))
+        with mock.patch.object(tokenizer, 'TIKTOKEN_CACHE_DIRS', []), \
+                mock.patch('urllib.request.urlopen') as urlopen, mock.patch('builtins.print'):
+            self.assertIsInstance(get_encoding('cl100k_base'), ApproximateEncoder)
+            urlopen.assert_not_called()
+
+            codes = ['a = 1\n' * 3000, 'def f():\n    pass\n']
+            splits = split_files('gpt-3.5-turbo', codes, ['a.py', 'b.py'])
+        self.assertEqual([''.join(t.text for t in trunks) for trunks, _ in splits], codes)
+        self.assertEqual(splits[0][1], 5 * 3000)
+        self.assertGreater(len(splits[0][0]), 1)
+
+    def test_install(self):
+        configure({'tokenizer_dir': self.dir.name, 'tokenizer': 'auto'})
+        source = os.path.join(self.dir.name, 'data.tiktoken')
+        with open(source, 'wb') as f:
+            f.write(b'data')
+
+        with self.assertRaises(Exception):
+            install('cl100k_base', source)
+        self.assertFalse(is_installed('cl100k_base'))
+
+        url = 'https://example.com/test.tiktoken'
+        encodings = {'test': (url, hashlib.sha256(b'data').hexdigest())}
+        with mock.patch.dict(tokenizer.ENCODINGS, encodings):
+            path = install('test', source)
+            self.assertTrue(is_installed('test'))
+        # Named like the files cached by tiktoken
+        self.assertEqual(path, os.path.join(self.dir.name, hashlib.sha1(url.encode()).hexdigest()))
+
+    def test_dry_run(self):
+        # Never downloads, even when the config asks for exact counts
+        configure({'tokenizer_dir': self.dir.name, 'tokenizer': 'exact'}, dry_run=True)
+        self.assertEqual(tokenizer.tokenizer_mode, 'auto')
+        configure({'tokenizer_dir': self.dir.name, 'tokenizer': 'approximate'}, dry_run=True)
+        self.assertEqual(tokenizer.tokenizer_mode, 'approximate')
+
+    def test_install_from_tiktoken_cache(self):
+        configure({'tokenizer_dir': self.dir.name, 'tokenizer': 'auto'})
+        cache_dir = os.path.join(self.dir.name, 'data-gym-cache')
+        os.makedirs(cache_dir)
+        url = 'https://example.com/test.tiktoken'
+        encodings = {'test': (url, hashlib.sha256(b'data').hexdigest())}
+        cached = os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+
+        with mock.patch.dict(tokenizer.ENCODINGS, encodings), \
+                mock.patch.object(tokenizer, 'TIKTOKEN_CACHE_DIRS', [cache_dir]), \
+                mock.patch('builtins.print'):
+            # Copied from the cache of tiktoken, nothing is downloaded
+            with open(cached, 'wb') as f:
+                f.write(b'data')
+            with mock.patch('urllib.request.urlopen') as urlopen:
+                self.assertTrue(ensure_installed('test'))
+                urlopen.assert_not_called()
+            self.assertTrue(is_installed('test'))
+
+            # A corrupted cached copy is not installed, and not replaced by a download
+            os.remove(tokenizer.get_data_path('test'))
+            with open(cached, 'wb') as f:
+                f.write(b'corrupted')
+            with mock.patch('urllib.request.urlopen') as urlopen:
+                self.assertFalse(ensure_installed('test'))
+                urlopen.assert_not_called()
+            self.assertFalse(is_installed('test'))
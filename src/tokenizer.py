@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from functools import lru_cache
+from app import get_save_path, load_config
+from common import atomic_write
+from revChatGPT.typings import C
+
+PROG_NAME = 'tokenizer'
+DESC = 'Install the tokenizer data in tokenizer_dir, so counting tokens never downloads anything'
+
+# Url and sha256 of the data of every encoding. The data is saved the way tiktoken
+# caches it, in a file named by the sha1 of the url.
+ENCODINGS = {
+    'cl100k_base': ('https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken',
+                    '223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7'),
+}
+
+# auto: exact when the data is installed or cached by tiktoken, estimated otherwise, never downloads
+# exact: always exact, tiktoken downloads the data when it is missing
+# approximate: always estimated, the data is never read
+TOKENIZER_MODES = ['auto', 'exact', 'approximate']
+DOWNLOAD_TIMEOUT = 30
+# Where tiktoken caches the data when TIKTOKEN_CACHE_DIR is not set by configure,
+# data found there is installed without downloading it again
+TIKTOKEN_CACHE_DIRS = [path for path in [os.environ.get('TIKTOKEN_CACHE_DIR'), os.environ.get('DATA_GYM_CACHE_DIR')] if path] \
+    + [os.path.join(tempfile.gettempdir(), 'data-gym-cache')]
+
+# The pre-tokenization of cl100k_base, with letters as [^\W\d_] since re has no \p{L}.
+# Real tokens never cross these pieces, the estimate only guesses how BPE splits each of them.
+PRETOKEN_PATTERN = re.compile(r"""(?P<word>'(?:[sdmt]|ll|ve|re))|(?P<letters>(?:[^\r\n\w]|_)?[^\W\d_]+)|(?P<digits>\d{1,3})"""
+                              r"""|(?P<punct> ?(?:[^\s\w]|_)+[\r\n]*)|(?P<space>\s*[\r\n]+|\s+(?!\S)|\s+)""", re.I)
+# Pseudo tokens of every kind of piece: most words and their leading space or symbol are a single
+# token, longer identifiers are split every 6 ascii letters and other letters count one each;
+# symbols merge by pairs, runs of spaces (indents) are a single token up to 16 of them
+PSEUDO_TOKEN_PATTERNS = {
+    'word': re.compile(r'.+', re.S),
+    'letters': re.compile(r'[^A-Za-z]?[A-Za-z]{1,6}|.', re.S),
+    'digits': re.compile(r'.+', re.S),
+    'punct': re.compile(r' ?[^\r\n]{1,2}[\r\n]*|[\r\n]+'),
+    'space': re.compile(r'\s{1,16}'),
+}
+
+tokenizer_dir = os.path.join(get_save_path(), 'tiktoken')
+tokenizer_mode = 'auto'
+warn_lock = threading.Lock()
+warned = set()
+
+
+def configure(config: dict, dry_run: bool = False) -> None:
+    """Set the tokenizer from the config, a dry run counts exactly only with local data."""
+    global tokenizer_dir, tokenizer_mode
+    tokenizer_dir = os.path.expanduser(config.get('tokenizer_dir') or tokenizer_dir)
+    tokenizer_mode = config.get('tokenizer', tokenizer_mode)
+    if tokenizer_mode not in TOKENIZER_MODES or (dry_run and tokenizer_mode == 'exact'):
+        tokenizer_mode = 'auto'
+    # Read by tiktoken when it loads an encoding
+    os.environ['TIKTOKEN_CACHE_DIR'] = tokenizer_dir
+    get_encoding.cache_clear()
+
+
+def get_data_path(encoding: str) -> str:
+    url, _ = ENCODINGS[encoding]
+    return os.path.join(tokenizer_dir, hashlib.sha1(url.encode()).hexdigest())
+
+
+def is_installed(encoding: str) -> bool:
+    return encoding in ENCODINGS and os.path.exists(get_data_path(encoding))
+
+
+def install(encoding: str, source: str | None = None) -> str:
+    """Install the data of the encoding from a local file, or download it, returns its path.
+
+    The data must match the pinned hash, it is written atomically, so a concurrent
+    run never reads partial data.
+    """
+    url, expected_hash = ENCODINGS[encoding]
+    if source:
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        import urllib.request
+
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+            data = response.read()
+
+    actual_hash = hashlib.sha256(data).hexdigest()
+    if actual_hash != expected_hash:
+        raise Exception(f'Hash mismatch for {encoding}: expected {expected_hash}, got {actual_hash}')
+
+    path = get_data_path(encoding)
+    atomic_write(path, data)
+    return path
+
+
+def find_cached(encoding: str) -> str | None:
+    path = get_data_path(encoding)
+    for cache_dir in TIKTOKEN_CACHE_DIRS:
+        cached = os.path.join(cache_dir, os.path.basename(path))
+        if os.path.exists(cached) and os.path.abspath(cached) != os.path.abspath(path):
+            return cached
+    return None
+
+
+def ensure_installed(encoding: str) -> bool:
+    """Install the data of the encoding from the cache of tiktoken, returns whether it is installed.
+
+    Only local files are read, so a machine without network access never waits for a
+    download; a warning is printed once when the data is missing.
+    """
+    if is_installed(encoding):
+        return True
+
+    error = 'unknown encoding'
+    cached = find_cached(encoding) if encoding in ENCODINGS else None
+    if cached:
+        try:
+            install(encoding, cached)
+            return True
+        except Exception as e:
+            error = str(e)
+    elif encoding in ENCODINGS:
+        error = 'not installed'
+    warn_once(encoding, error)
+    return False
+
+
+def export(encoding: str, target: str) -> None:
+    # Copy the installed data, to ship it with the tool or to another machine
+    shutil.copyfile(get_data_path(encoding), target)
+
+
+class ApproximateEncoder:
+    """Estimate tokens without any tokenizer data, the tokens are the bytes of pseudo tokens.
+
+    It has the interface of a tiktoken encoding used by asker, so trunks can be planned
+    with it. Texts are pre-tokenized like cl100k_base, so English texts and codes get
+    about as many tokens as the real ones, a bit more for long identifiers.
+    """
+
+    def encode(self, text: str) -> list[bytes]:
+        result = []
+        for match in PRETOKEN_PATTERN.finditer(text):
+            for piece in PSEUDO_TOKEN_PATTERNS[match.lastgroup].findall(match.group()): # type: ignore
+                result.append(piece.encode('utf-8'))
+        return result
+
+    def encode_batch(self, texts: list[str]) -> list[list[bytes]]:
+        return [self.encode(text) for text in texts]
+
+    def decode_tokens_bytes(self, tokens: list[bytes]) -> list[bytes]:
+        return tokens
+
+
+def warn_once(encoding: str, error) -> None:
+    with warn_lock:
+        if encoding in warned:
+            return
+        warned.add(encoding)
+    print(f'{C.WARNING}Tokenizer data of {encoding} is missing ({error}), token counts are estimated.{C.ENDC} '
+          f'Run `python tokenizer.py install` to count them exactly.')
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding: str):
+    """The encoder of the encoding, following tokenizer_mode.
+
+    Created once per process, tiktoken takes a while to import and to load an encoding.
+    """
+    if tokenizer_mode == 'approximate':
+        return ApproximateEncoder()
+    if tokenizer_mode == 'auto' and not ensure_installed(encoding):
+        return ApproximateEncoder()
+
+    os.environ.setdefault('TIKTOKEN_CACHE_DIR', tokenizer_dir)
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding)
+
+
+def show_status() -> None:
+    print(f'Tokenizer mode: {tokenizer_mode} dir: {tokenizer_dir}')
+    for encoding in ENCODINGS:
+        state = f'{C.OKGREEN}installed{C.ENDC}' if is_installed(encoding) else f'{C.WARNING}missing{C.ENDC}'
+        print(f'{encoding:<20}{state}')
+
+
+def create_args_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog=PROG_NAME, description=DESC)
+    parser.add_argument('command', nargs='?', choices=['status', 'install', 'export'], default='status',
+                        help='install downloads the data, or copies it with --source; export copies it to --target. default status')
+    parser.add_argument('-e', '--encoding', choices=list(ENCODINGS), default='cl100k_base', help='encoding to install or export, default cl100k_base')
+    parser.add_argument('-s', '--source', help='local file of the data to install, instead of downloading it')
+    parser.add_argument('--target', help='file the data is exported to')
+    parser.add_argument('-cfg', '--config', help='path of the config file')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = create_args_parser()
+    args = parser.parse_args()
+    configure(load_config(args.config))
+
+    if args.command == 'install':
+        print(f'Installed {args.encoding} in: {install(args.encoding, args.source)}')
+    elif args.command == 'export':
+        if not args.target:
+            print(parser.format_help())
+            exit(1)
+        export(args.encoding, args.target)
+        print(f'Exported {args.encoding} to: {args.target}')
+    else:
+        show_status()